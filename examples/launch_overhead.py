@@ -0,0 +1,35 @@
+""" measure the per-job launch overhead of gist.runner
+compares the old way of launching a job (a shell command line with a
+">> output.log" redirect) with an argv list whose output is written by
+the runner, using a command that does nothing so that only the launch
+cost is left (not "true", which is a builtin of most shells)
+usage: python examples/launch_overhead.py [num_jobs]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import gist.utils
+from gist import runner
+
+
+def time_jobs(jobs):
+    start = time.time()
+    runner.JobRunner(max_jobs=1, poll_interval=0.001).run(jobs)
+    return (time.time() - start) / len(jobs)
+
+
+if __name__ == "__main__":
+    num_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    out_dir = tempfile.mkdtemp()
+    log = os.path.join(out_dir, "output.log")
+    shell_jobs = [runner.Job("config_%d" % i, "sleep 0 >> %s" % log)
+                  for i in range(num_jobs)]
+    argv = [gist.utils.find_exe("sleep"), "0"]
+    argv_jobs = [runner.Job("config_%d" % i, argv, log_name=log)
+                 for i in range(num_jobs)]
+    print "shell string: %.2f ms per job" % (time_jobs(shell_jobs) * 1000)
+    print "argv list:    %.2f ms per job" % (time_jobs(argv_jobs) * 1000)
+    shutil.rmtree(out_dir)
@@ -1,3 +1,5 @@
 from .simulator import *
 from .sst_simu import *
+from .runner import *
+from .distrib import *
 from .utils import *
@@ -0,0 +1,386 @@
+""" Sweeps that decide what to run next from what they have run so far
+Successive halving runs every config of a sweep short, e.g. with a
+tenth of the packets, and only the best ones by some metric longer, in
+rounds, so most of the core hours go to the configs that matter.
+Active sampling fits a Gaussian process on the configs run so far and
+runs the ones it expects the most of next, until a budget of configs
+is spent or it predicts the metric well enough.
+Each round is a sweep of its own in a sub dir of the output dir, with
+its own config.csv and summary.csv, and halving.csv or active.csv ties
+them together
+"""
+import copy
+import math
+import os
+import re
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import gist.utils
+from gist import simulator
+from gist import sweep
+
+
+def scale_fidelity(value, scale):
+    """
+    :param value: a number, or a number with a unit like "100 us"
+    :param scale: what to multiply it by
+    :return: value scaled, an int stays an int (at least 1)
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return max(int(round(value * scale)), 1)
+    if isinstance(value, float):
+        return value * scale
+    match = re.match(r"\s*([0-9.]+)\s*(.*)$", str(value))
+    if not match:
+        raise ValueError("can't scale %s" % value)
+    num = float(match.group(1)) * scale
+    return ("%g %s" % (num, match.group(2))).strip()
+
+
+def set_fidelity(param, key, scale):
+    """
+    scale every value of key in a nested param dict
+    :return: True if key is in param
+    """
+    found = False
+    for k, v in param.iteritems():
+        if isinstance(v, dict):
+            found = set_fidelity(v, key, scale) or found
+        elif k == key:
+            param[k] = scale_fidelity(v, scale)
+            found = True
+    return found
+
+
+def read_metric(summary_csv, metric):
+    """
+    :param summary_csv: summary of a sweep, labelled by config name
+    :param metric: column to read
+    :return: dict of config name -> metric, averaged if a config has
+             more than one row, configs without it are left out
+    """
+    df = pd.read_csv(summary_csv, index_col=0)
+    if metric not in df:
+        return {}
+    values = pd.to_numeric(df[metric], errors="coerce")
+    values = values.groupby(level=0).mean().dropna()
+    return values.to_dict()
+
+
+def _run_round(sim, round_dir, names, param_list):
+    """
+    run some configs of a sweep as a sweep of their own in round_dir
+    :param sim: the simulator
+    :param round_dir: output dir of the round, must not exist yet
+    :param names: config names
+    :param param_list: params of the configs, used up by the simulator
+    :return: summary.csv of the round
+    """
+    os.mkdir(round_dir)
+    sim.output_base_dir = round_dir
+    sim.config_index = sim.get_config_index()
+    sim.config_names = names
+    sim.param_list = param_list
+    sim.manifest = simulator.Manifest(round_dir, sim.configs, param_list,
+                                      sim.cache_dir, names=names)
+    sim.manifest.dump()
+    sim.results = {}
+    sim.job_info = {}
+    sim.run()
+    sim.compile_output()
+    return os.path.join(round_dir, "summary.csv")
+
+
+def successive_halving(sim, fidelity_key="", scales=(), keep=0, metric="",
+                       minimize=None):
+    """
+    run the configs of a simulator in rounds of successive halving,
+    instead of sim.run(). Each argument not given is taken from
+    sim_opts["halving"], e.g.
+    {"fidelity_key": "packets_to_send", "scales": [0.1, 0.3, 1],
+     "keep": 0.33, "metric": "real_latency(us)", "minimize": true}
+    :param sim: a Simulator that hasn't been run, and doesn't stream
+    :param fidelity_key: param that sets how long a config runs, can
+                         be in sim_opts["other_opts"] too, e.g. stop_at
+    :param scales: fidelity of each round, as a fraction of the value
+                   in the config
+    :param keep: fraction of the configs of a round that go on to the
+                 next one, at least one does
+    :param metric: column of the summary to rank the configs by
+    :param minimize: True if lower metric is better
+    :return: list of names of the configs of the last round, best first
+    """
+    opts = sim.sim_opts.get("halving", {})
+    fidelity_key = fidelity_key or opts.get("fidelity_key",
+                                            "packets_to_send")
+    scales = list(scales or opts.get("scales", [0.1, 0.3, 1.0]))
+    keep = keep or opts.get("keep", 1.0 / 3)
+    metric = metric or opts.get("metric", "exe_time(us)")
+    if minimize is None:
+        minimize = opts.get("minimize", True)
+    if sim.streamed:
+        raise ValueError("successive halving needs the params as a list, "
+                         "turn off sim_opts[\"stream\"]")
+    logger = gist.utils.get_logger()
+    base_dir = sim.output_base_dir
+    params = OrderedDict(zip(sim.config_names, sim.param_list))
+    other_opts = copy.deepcopy(getattr(sim, "other_opts", {}))
+    metrics = OrderedDict((name, OrderedDict()) for name in params)
+    names = list(params)
+    for k, scale in enumerate(scales):
+        param_list = []
+        found = False
+        for name in names:
+            param = copy.deepcopy(params[name])
+            found = set_fidelity(param, fidelity_key, scale) or found
+            param_list.append(param)
+        if fidelity_key in other_opts:
+            sim.other_opts[fidelity_key] = scale_fidelity(
+                other_opts[fidelity_key], scale)
+            found = True
+        if not found:
+            raise ValueError("no %s in the params" % fidelity_key)
+        logger.info("round %d: %d configs at %g of %s" %
+                    (k, len(names), scale, fidelity_key))
+        summary = _run_round(sim, os.path.join(base_dir, "round_%d" % k),
+                             names, param_list)
+        values = read_metric(summary, metric)
+        for name, value in values.iteritems():
+            metrics[name]["round_%d:%s" % (k, metric)] = value
+        ranked = sorted([name for name in names if name in values],
+                        key=lambda n: values[n], reverse=not minimize)
+        if k < len(scales) - 1:
+            num_kept = max(int(math.ceil(len(names) * keep)), 1)
+            names = ranked[:num_kept]
+        else:
+            names = ranked
+    sim.output_base_dir = base_dir
+    sim.config_index = sim.get_config_index()
+    if fidelity_key in other_opts:
+        sim.other_opts[fidelity_key] = other_opts[fidelity_key]
+    _dump_halving_summary(metrics, base_dir)
+    return names
+
+
+def _dump_halving_summary(metrics, base_dir):
+    """
+    write halving.csv, the metric of every config in each round it was
+    run in, and the last round it made it to (-1 if it never had a
+    result)
+    """
+    rows = []
+    for name, row in metrics.iteritems():
+        row = OrderedDict(row)
+        row["last_round"] = len(row) - 1
+        rows.append(row)
+    df = pd.DataFrame(rows, index=list(metrics))
+    df.to_csv(os.path.join(base_dir, "halving.csv"), index_label="configs")
+
+
+def _to_number(values):
+    """
+    :return: list of floats if all values are numbers, or strings of a
+             number with the same unit like "2GB/s", otherwise None
+    """
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool)
+           for v in values):
+        return [float(v) for v in values]
+    units = set()
+    numbers = []
+    for v in values:
+        match = re.match(r"\s*([0-9.]+)\s*([^0-9]*)$", str(v))
+        if not match:
+            return None
+        try:
+            numbers.append(float(match.group(1)))
+        except ValueError:
+            return None
+        units.add(match.group(2))
+    return numbers if len(units) == 1 else None
+
+
+def encode_params(flat_list):
+    """
+    turn params into features a regression can use: a column for each
+    param that is a number (or a number with a unit), one for each value
+    of any other param that varies, all scaled to mean 0 and std 1
+    :param flat_list: list of flattened param dicts
+    :return: 2d array, a row per config
+    """
+    keys = sorted(set(k for flat in flat_list for k in flat))
+    columns = []
+    for key in keys:
+        values = [flat.get(key) for flat in flat_list]
+        numbers = _to_number(values)
+        if numbers is not None:
+            columns.append(numbers)
+            continue
+        for level in sorted(set(str(v) for v in values)):
+            columns.append([float(str(v) == level) for v in values])
+    if not columns:
+        return np.zeros((len(flat_list), 0))
+    x = np.array(columns).T
+    std = x.std(axis=0)
+    std[std == 0] = 1
+    return (x - x.mean(axis=0)) / std
+
+
+class GaussianProcess(object):
+    """
+    Gaussian process regression with an RBF kernel, small enough for
+    the few hundred configs a sweep can afford to run
+    :param length_scale: of the kernel, sqrt of the num of features by
+                         default, which suits features scaled to std 1
+    :param noise: variance of the noise, relative to that of y
+    """
+    def __init__(self, length_scale=None, noise=1e-2):
+        self.length_scale = length_scale
+        self.noise = noise
+        self._x = None
+        self._alpha = None
+        self._chol = None
+        self._y_mean = 0
+        self._y_std = 1
+
+    def _kernel(self, a, b):
+        dist = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)
+        return np.exp(-0.5 * dist / self._scale ** 2)
+
+    def fit(self, x, y):
+        y = np.asarray(y, dtype=float)
+        self._scale = self.length_scale or max(np.sqrt(x.shape[1]), 1)
+        self._x = x
+        self._y_mean = y.mean()
+        self._y_std = y.std() or 1
+        k = self._kernel(x, x) + self.noise * np.eye(len(x))
+        self._chol = np.linalg.cholesky(k)
+        self._alpha = np.linalg.solve(
+            self._chol.T, np.linalg.solve(self._chol,
+                                          (y - self._y_mean) / self._y_std))
+        return self
+
+    def predict(self, x):
+        """
+        :return: predicted mean and std of each row of x
+        """
+        k = self._kernel(x, self._x)
+        mean = k.dot(self._alpha)
+        v = np.linalg.solve(self._chol, k.T)
+        var = np.maximum(1 - (v ** 2).sum(axis=0), 0)
+        return (mean * self._y_std + self._y_mean,
+                np.sqrt(var) * self._y_std)
+
+
+def _get_scores(mean, std, acquisition, kappa, minimize):
+    """
+    :return: how much running each config is expected to be worth
+    """
+    sign = -1 if minimize else 1
+    if acquisition == "value":
+        return sign * mean
+    if acquisition == "uncertainty":
+        return std
+    return sign * mean + kappa * std
+
+
+def active_sampling(sim, metric="", budget=0, batch_size=0,
+                    target_error=None, pool_size=0, acquisition="",
+                    kappa=2.0, minimize=None, seed=0):
+    """
+    run the configs of a simulator a batch at a time instead of
+    sim.run(), choosing each batch with a Gaussian process fitted on the
+    metric of all the configs run before. Each argument not given is
+    taken from sim_opts["active"], e.g.
+    {"metric": "real_latency(us)", "budget": 100, "target_error": 0.05}
+    :param sim: a Simulator that hasn't been run, and doesn't stream
+    :param metric: column of the summary to model
+    :param budget: max num of configs to run
+    :param batch_size: configs per batch, sim_opts["max_parallel_jobs"]
+                       by default so a batch fills the job slots
+    :param target_error: stop once the mean relative error of the
+                         predictions for a batch is below this
+    :param pool_size: num of configs of the space to choose from, drawn
+                      with SampledIndices, all if the space is smaller
+    :param acquisition: what the next configs are chosen by, "value"
+                        (best predicted metric), "uncertainty" or "ucb"
+                        (best metric within kappa stds, the default)
+    :param kappa: see acquisition
+    :param minimize: True if lower metric is better
+    :param seed: of the pool and the first batch
+    :return: list of names of the configs run, best first
+    """
+    opts = sim.sim_opts.get("active", {})
+    metric = metric or opts.get("metric", "exe_time(us)")
+    budget = budget or opts.get("budget", 50)
+    batch_size = batch_size or opts.get(
+        "batch_size", sim.sim_opts.get("max_parallel_jobs", 1))
+    batch_size = max(int(batch_size), 1)
+    if target_error is None:
+        target_error = opts.get("target_error", None)
+    pool_size = pool_size or opts.get("pool_size", 1000)
+    acquisition = acquisition or opts.get("acquisition", "ucb")
+    kappa = opts.get("kappa", kappa)
+    if minimize is None:
+        minimize = opts.get("minimize", True)
+    seed = opts.get("seed", seed)
+    if sim.streamed:
+        raise ValueError("active sampling needs the params as a list, "
+                         "turn off sim_opts[\"stream\"]")
+    logger = gist.utils.get_logger()
+    base_dir = sim.output_base_dir
+    indices = list(sweep.SampledIndices(sim.space, "random", pool_size,
+                                        seed))
+    params = [sim.space[i] for i in indices]
+    names = [sweep.get_config_name(i) for i in indices]
+    x = encode_params([gist.utils.flatten_dict(p) for p in params])
+    unrun = range(len(indices))
+    values = {}  # position in the pool -> metric
+    rows = OrderedDict()
+    k = 0
+    while unrun and len(rows) < budget:
+        size = min(batch_size, budget - len(rows))
+        predicted = {}
+        if len(values) < 2:  # nothing to fit yet
+            batch = unrun[:size]
+        else:
+            done = sorted(values)
+            gp = GaussianProcess().fit(x[done], [values[i] for i in done])
+            mean, std = gp.predict(x[unrun])
+            scores = _get_scores(mean, std, acquisition, kappa, minimize)
+            best = np.argsort(-scores, kind="mergesort")[:size]
+            batch = [unrun[i] for i in best]
+            predicted = dict((unrun[i], mean[i]) for i in best)
+        unrun = [i for i in unrun if i not in batch]
+        logger.info("batch %d: %d configs" % (k, len(batch)))
+        summary = _run_round(sim, os.path.join(base_dir, "batch_%d" % k),
+                             [names[i] for i in batch],
+                             [copy.deepcopy(params[i]) for i in batch])
+        batch_values = read_metric(summary, metric)
+        errors = []
+        for i in batch:
+            row = OrderedDict([("batch", k), (metric, None),
+                               ("predicted", predicted.get(i))])
+            if names[i] in batch_values:
+                values[i] = row[metric] = batch_values[names[i]]
+                if i in predicted and values[i]:
+                    errors.append(abs(predicted[i] - values[i]) /
+                                  abs(values[i]))
+            rows[names[i]] = row
+        k += 1
+        if errors:
+            error = float(np.mean(errors))
+            logger.info("mean relative error of the predictions %.3f" %
+                        error)
+            if target_error is not None and error <= target_error:
+                break
+    sim.output_base_dir = base_dir
+    sim.config_index = sim.get_config_index()
+    df = pd.DataFrame(rows.values(), index=rows.keys())
+    df.to_csv(os.path.join(base_dir, "active.csv"), index_label="configs")
+    ranked = sorted(values, key=lambda i: values[i], reverse=not minimize)
+    return [names[i] for i in ranked]
@@ -1,4 +1,6 @@
 import itertools
+import os
+
 import numpy as np
 import pandas as pd
 from gist import utils
@@ -365,6 +367,119 @@ def add_num_nodes_col(df):
     return df
 
 
+def get_num_nodes_from_params(params):
+    """
+    num of nodes of a config, from its flattened params or a row of its
+    summary, where topology and shape could be either "topo" and "shape"
+    or "topo_type" and e.g. "torus:shape"
+    :param params: flattened dict of params
+    :return: num of nodes, None if it can't be told
+    """
+    if "num_nodes" in params:
+        return params["num_nodes"]
+    topo = params.get("topo", params.get("topo_type"))
+    if not isinstance(topo, str):
+        return None
+    shape = params.get("shape", params.get(topo + ":shape"))
+    if not isinstance(shape, str):
+        return None
+    try:
+        return cal_num_nodes(topo, shape)
+    except (ValueError, KeyError, IndexError):
+        return None
+
+
+def get_cost_features(params, features):
+    """
+    numbers that decide how long a config takes to simulate
+    :param params: flattened dict of params, or a row of a summary
+    :param features: names of the params to use, "num_nodes" is
+                     calculated from topology and shape
+    :return: list of floats, None if any of them is missing or not > 0
+    """
+    vals = []
+    for feature in features:
+        if feature == "num_nodes":
+            val = get_num_nodes_from_params(params)
+        else:
+            val = params.get(feature)
+        try:
+            val = float(val)
+        except (TypeError, ValueError):
+            return None
+        if not val > 0:
+            return None
+        vals.append(val)
+    return vals
+
+
+def fit_runtime_model(summary_files, features, time_col="wall_time(s)"):
+    """
+    fit a power law, time = c * f0^a0 * f1^a1 ..., of how long configs
+    took to simulate in previous sweeps, i.e. a linear fit in log space
+    :param summary_files: summary csv files of previous sweeps
+    :param features: see get_cost_features
+    :param time_col: column of the summaries with the run time
+    :return: list of coefficients, intercept first, None if there is
+             not enough history to fit
+    """
+    xs = []
+    ys = []
+    for summary in summary_files:
+        if not os.path.exists(summary):
+            continue
+        df = pd.read_csv(summary, index_col=0)
+        if time_col not in df:
+            continue
+        for row in df.to_dict("records"):
+            vals = get_cost_features(row, features)
+            try:
+                run_time = float(row[time_col])
+            except (TypeError, ValueError):
+                continue
+            if vals is None or not run_time > 0:
+                continue
+            xs.append([1.0] + [np.log(v) for v in vals])
+            ys.append(np.log(run_time))
+    if len(xs) <= len(features):
+        return None
+    coef = np.linalg.lstsq(np.array(xs), np.array(ys), rcond=None)[0]
+    return list(coef)
+
+
+def estimate_runtimes(param_list, features, summary_files=()):
+    """
+    expected run time of each config, from a model fitted on previous
+    sweeps if there are any, otherwise just by how big the configs are
+    (the product of the features). Configs the model can't predict are
+    assumed to be as long as the longest predicted one
+    :param param_list: list of param dicts
+    :param features: see get_cost_features
+    :param summary_files: summary csv files of previous sweeps
+    :return: list of costs, same order as param_list
+    """
+    flat_list = [utils.flatten_dict(p) for p in param_list]
+    # only use the features this sweep has
+    features = [f for f in features
+                if any(get_cost_features(flat, [f]) for flat in flat_list)]
+    if not features:
+        return [0] * len(param_list)
+    coef = fit_runtime_model(summary_files, features)
+    feature_list = [get_cost_features(flat, features) for flat in flat_list]
+    costs = []
+    for vals in feature_list:
+        if vals is None:
+            costs.append(None)
+        elif coef is None:
+            costs.append(float(np.prod(vals)))
+        else:
+            log_vals = [1.0] + [np.log(v) for v in vals]
+            costs.append(float(np.exp(np.dot(coef, log_vals))))
+    known = [c for c in costs if c is not None]
+    longest = max(known) if known else 0
+    return [longest if c is None else c for c in costs]
+
+
 def concat_summarys(file_list, output_name="super_summary.csv"):
     """
     concatenate output summaries from various places
@@ -0,0 +1,248 @@
+""" Run a sweep through the batch scheduler of a cluster
+Instead of calling the simulator, all the jobs of a sweep are written to
+a job list and submitted as one job array, where array index i runs
+line i of the list. Every job writes its exit status into its own dir
+when done, which is how completions are collected, so nothing but the
+shared file system is needed between the submitting box and the nodes.
+A task killed by the scheduler (walltime, preemption, node failure)
+never writes its exit status, so the scheduler is asked as well whether
+the arrays are still there, and the jobs of arrays that are gone without
+a status are failed.
+The defaults are for slurm, other schedulers need the submit command,
+the array directive, the array index variable and the status and cancel
+commands changed.
+"""
+import math
+import os
+import pipes
+import re
+import shlex
+import subprocess
+import time
+
+import gist.utils
+
+
+STATUS_FILE = "exit_status"
+# exit status of timeout(1) when it had to stop the job, and when it
+# had to kill it
+TIMEOUT_STATUSES = (124, 137)
+
+
+class ArraySubmitter(object):
+    """
+    Submits jobs as job arrays and waits for them, same interface as
+    JobRunner. Jobs must have a sub_dir, that's where the exit status
+    goes, and are run through the shell on the nodes, under timeout(1)
+    if they have a timeout. hang_timeout is not supported.
+    :param work_dir: where the job list and submit scripts go
+    :param submit_cmd: command that takes a script and submits it
+    :param array_directive: script header asking for the array, with
+                            %d for the last index of the array
+    :param index_var: env var that has the array index in a task
+    :param header: other script header lines, e.g. time limits
+    :param max_array_size: jobs are split into arrays of at most this
+                           many tasks
+    :param poll_interval: seconds between checks for finished jobs
+    :param callback: same as the one of JobRunner, only called when jobs
+                     finish since it's not known when they start
+    :param job_id_pattern: regex whose first group is the job id in the
+                           output of submit_cmd
+    :param status_cmd: command that prints something and exits with 0
+                       while any of the arrays {job_ids} (comma
+                       separated) is queued or running. Once it has
+                       said no twice in a row, the jobs without an exit
+                       status are failed. "" to never ask
+    :param cancel_cmd: command that cancels the arrays {job_ids}
+    :param max_wait: max seconds to wait for all the jobs, the ones
+                     not done by then are cancelled and time out
+    """
+    def __init__(self, work_dir, submit_cmd="sbatch",
+                 array_directive="#SBATCH --array=0-%d",
+                 index_var="SLURM_ARRAY_TASK_ID", header=(),
+                 max_array_size=1000, poll_interval=30, callback=None,
+                 job_id_pattern=r"(\d+)",
+                 status_cmd="squeue -h -j {job_ids}",
+                 cancel_cmd="scancel {job_ids}", max_wait=None):
+        self.work_dir = work_dir
+        self.submit_cmd = submit_cmd
+        self.array_directive = array_directive
+        self.index_var = index_var
+        self.header = list(header)
+        self.max_array_size = max(int(max_array_size), 1)
+        self.poll_interval = poll_interval
+        self.callback = callback
+        self.job_id_pattern = job_id_pattern
+        self.status_cmd = status_cmd
+        self.cancel_cmd = cancel_cmd
+        self.max_wait = max_wait
+        self.logger = gist.utils.get_logger()
+
+    def _get_job_line(self, job):
+        """
+        :return: shell command line that runs a job and writes its
+                 exit status into its dir
+        """
+        if isinstance(job.cmd, str):
+            cmd = job.cmd
+        else:
+            cmd = gist.utils.cmd_to_str(job.cmd)
+        if job.timeout:
+            # killed 10 seconds later if it doesn't stop
+            cmd = "timeout -k 10 %d sh -c %s" % (math.ceil(job.timeout),
+                                                 pipes.quote(cmd))
+        if job.log_name:
+            cmd = "%s >> %s" % (cmd, pipes.quote(job.log_name))
+        status_file = os.path.join(job.sub_dir, STATUS_FILE)
+        return "%s; echo $? > %s\n" % (cmd, pipes.quote(status_file))
+
+    def write_scripts(self, jobs):
+        """
+        write the job list and one submit script per array
+        :param jobs: list of jobs
+        :return: list of script names
+        """
+        if not os.path.exists(self.work_dir):
+            os.makedirs(self.work_dir)
+        job_list = os.path.join(self.work_dir, "job_list.sh")
+        with open(job_list, "w") as fp:
+            for job in jobs:
+                fp.write(self._get_job_line(job))
+            fp.close()
+        scripts = []
+        for offset in range(0, len(jobs), self.max_array_size):
+            size = min(self.max_array_size, len(jobs) - offset)
+            script = os.path.join(self.work_dir, "submit_%d.sh" % offset)
+            with open(script, "w") as fp:
+                fp.write("#!/bin/sh\n")
+                fp.write(self.array_directive % (size - 1) + "\n")
+                for line in self.header:
+                    fp.write(line + "\n")
+                fp.write("LINE=$((%d + $%s + 1))\n" %
+                         (offset, self.index_var))
+                fp.write("sed -n \"${LINE}p\" %s | sh\n" %
+                         pipes.quote(job_list))
+                fp.close()
+            scripts.append(script)
+        return scripts
+
+    def _collect(self, job):
+        """
+        :return: True if the job is finished, with its results filled in
+        """
+        status_file = os.path.join(job.sub_dir, STATUS_FILE)
+        if not os.path.exists(status_file):
+            return False
+        with open(status_file) as fp:
+            status = fp.read().strip()
+            fp.close()
+        if not status:  # being written
+            return False
+        returncode = int(status)
+        if returncode == 0:
+            self._finish(job, returncode, "done")
+            self.logger.info("%s finished" % job.name)
+        elif job.timeout and returncode in TIMEOUT_STATUSES:
+            self._finish(job, returncode, "timeout")
+            self.logger.error("%s ran for more than %d seconds, killed" %
+                              (job.name, job.timeout))
+        else:
+            self._finish(job, returncode, "failed")
+            self.logger.error("%s exited with status %d" %
+                              (job.name, returncode))
+        return True
+
+    def _finish(self, job, returncode, status):
+        job.returncode = returncode
+        job.status = status
+        if job.parser and job.log_name and os.path.exists(job.log_name):
+            with open(job.log_name) as log_fp:
+                for line in log_fp:
+                    job.results.update(job.parser(line))
+                log_fp.close()
+        if self.callback:
+            self.callback(job)
+
+    def _give_up(self, jobs, status, reason):
+        """
+        finish jobs that will never write their exit status
+        """
+        for job in jobs:
+            self.logger.error("%s %s, %s" % (job.name, reason, status))
+            self._finish(job, -1, status)
+
+    def _run_cmd(self, cmd_format, job_ids):
+        """
+        :return: (returncode, stdout) of a status or cancel command,
+                 None if it can't be run
+        """
+        cmd = shlex.split(cmd_format.format(job_ids=",".join(job_ids)))
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+        except OSError as e:
+            self.logger.warning("cannot run %s: %s" %
+                                (gist.utils.cmd_to_str(cmd), e))
+            return None
+        out, _ = proc.communicate()
+        return proc.returncode, out
+
+    def _are_arrays_gone(self, job_ids):
+        """
+        :return: True if the scheduler says none of the arrays is
+                 queued or running, False if it can't tell
+        """
+        if not self.status_cmd or not job_ids:
+            return False
+        result = self._run_cmd(self.status_cmd, job_ids)
+        if result is None:
+            self.status_cmd = ""  # don't try again every poll
+            return False
+        returncode, out = result
+        return returncode != 0 or not out.strip()
+
+    def run(self, jobs):
+        """
+        submit the jobs and wait for all of them to finish, or for the
+        scheduler to lose them, or for max_wait
+        :param jobs: list of Job objects
+        :return: the same list, with returncode of each job filled in,
+                 -1 for the jobs that were lost or cancelled
+        """
+        job_ids = []
+        for script in self.write_scripts(jobs):
+            cmd = shlex.split(self.submit_cmd) + [script]
+            self.logger.info(gist.utils.cmd_to_str(cmd))
+            out = subprocess.check_output(cmd)
+            match = re.search(self.job_id_pattern, out)
+            if match:
+                job_ids.append(match.group(1))
+            else:
+                self.logger.warning("no job id in the output of %s, "
+                                    "lost tasks won't be noticed" % script)
+                self.status_cmd = ""
+        start = time.time()
+        gone_polls = 0
+        pending = list(jobs)
+        while pending:
+            pending = [job for job in pending if not self._collect(job)]
+            if not pending:
+                break
+            if self.max_wait and time.time() - start > self.max_wait:
+                if self.cancel_cmd and job_ids:
+                    self._run_cmd(self.cancel_cmd, job_ids)
+                self._give_up(pending, "timeout",
+                              "not done in %d seconds" % self.max_wait)
+                break
+            # asked twice, so exit statuses written right before the
+            # arrays left the queue are collected first
+            if self._are_arrays_gone(job_ids):
+                gone_polls += 1
+            else:
+                gone_polls = 0
+            if gone_polls >= 2:
+                self._give_up(pending, "failed",
+                              "left the queue without an exit status")
+                break
+            time.sleep(self.poll_interval)
+        return jobs
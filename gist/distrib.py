@@ -0,0 +1,244 @@
+""" Run a sweep on more than one machine
+A coordinator owns the jobs of a sweep and hands them out over a TCP
+connection to workers, which can be on any host that sees the same
+file system (the commands and output dirs are sent as they are).
+Messages are one JSON object per line:
+    worker -> coordinator: ready, heartbeat, result
+    coordinator -> worker: job, done
+A worker that drops its connection or stops sending heartbeats while
+running a job is considered lost, and its job goes back to the queue.
+Start a worker with
+    python -m gist.distrib --host <coordinator host> --port <port>
+"""
+import argparse
+import json
+import socket
+import threading
+from collections import deque
+from SocketServer import StreamRequestHandler, ThreadingTCPServer
+
+import gist.utils
+from gist import runner
+
+
+class WorkerLost(Exception):
+    pass
+
+
+def _send(wfile, msg):
+    wfile.write(json.dumps(msg) + "\n")
+    wfile.flush()
+
+
+def _recv(rfile):
+    line = rfile.readline()
+    if not line:
+        raise WorkerLost("connection closed")
+    return json.loads(line, object_hook=gist.utils._byteify)
+
+
+def _job_to_msg(job):
+    return {
+        "type": "job",
+        "name": job.name,
+        "cmd": job.cmd,
+        "sub_dir": job.sub_dir,
+        "cores": job.cores,
+        "log_name": job.log_name,
+        "parser": job.parser.__name__ if job.parser else "",
+        "timeout": job.timeout,
+        "hang_timeout": job.hang_timeout
+    }
+
+
+def _msg_to_job(msg):
+    parser = None
+    if msg["parser"]:
+        # the parsers are the line parsers of sst_simu
+        from gist import sst_simu
+        parser = getattr(sst_simu, msg["parser"])
+    return runner.Job(msg["name"], msg["cmd"], msg["sub_dir"],
+                      cores=msg["cores"], log_name=msg["log_name"],
+                      parser=parser, timeout=msg["timeout"],
+                      hang_timeout=msg["hang_timeout"])
+
+
+class _WorkerHandler(StreamRequestHandler):
+    """
+    talks to one worker, for as long as it's connected
+    """
+    def handle(self):
+        coordinator = self.server.coordinator
+        self.request.settimeout(coordinator.heartbeat_timeout)
+        job = None
+        try:
+            _recv(self.rfile)  # ready
+            while True:
+                job = coordinator.get_job()
+                if job is None:
+                    _send(self.wfile, {"type": "done"})
+                    return
+                _send(self.wfile, _job_to_msg(job))
+                msg = _recv(self.rfile)
+                while msg["type"] == "heartbeat":
+                    msg = _recv(self.rfile)
+                coordinator.finish_job(job, msg)
+                job = None
+        except (WorkerLost, socket.error, ValueError) as e:
+            # socket.timeout is a socket.error, i.e. no heartbeats
+            if job:
+                coordinator.requeue_job(job, e)
+
+
+class _Server(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Coordinator(object):
+    """
+    Hands jobs out to workers and collects their results, run() returns
+    once every job has a result.
+    A job is handed out again if the worker running it is lost, i.e.
+    its connection closes or nothing comes from it for heartbeat_timeout
+    seconds (workers send heartbeats much more often than that).
+    callback is the same as the one of JobRunner
+    """
+    def __init__(self, host="", port=0, heartbeat_timeout=60,
+                 callback=None):
+        self.heartbeat_timeout = heartbeat_timeout
+        self.callback = callback
+        self.logger = gist.utils.get_logger()
+        self.server = _Server((host, port), _WorkerHandler)
+        self.server.coordinator = self
+        # the actual port if port 0 was asked for
+        self.address = self.server.server_address
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._remaining = 0
+
+    def run(self, jobs):
+        """
+        :param jobs: list of Job objects
+        :return: the same list, with results filled in by the workers
+        """
+        with self._cond:
+            self._pending.extend(sorted(jobs, key=lambda j: j.cost,
+                                        reverse=True))
+            self._remaining = len(jobs)
+        server_thread = threading.Thread(target=self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        self.logger.info("waiting for workers on %s:%d" % self.address)
+        with self._cond:
+            while self._remaining:
+                self._cond.wait(1)
+        self.server.shutdown()
+        self.server.server_close()
+        return jobs
+
+    def get_job(self):
+        """
+        wait for a job to hand out
+        :return: a job, or None if all jobs are finished
+        """
+        with self._cond:
+            while True:
+                if self._pending:
+                    job = self._pending.popleft()
+                    self.logger.debug("handing out %s" % job.name)
+                    if self.callback:
+                        self.callback(job)
+                    return job
+                if not self._remaining:
+                    return None
+                # a lost worker might give a job back
+                self._cond.wait(1)
+
+    def requeue_job(self, job, reason):
+        with self._cond:
+            self.logger.warning("lost the worker of %s (%s), requeued" %
+                                (job.name, reason))
+            self._pending.appendleft(job)
+            self._cond.notify_all()
+
+    def finish_job(self, job, msg):
+        with self._cond:
+            job.returncode = msg["returncode"]
+            job.status = msg["status"]
+            job.usage = msg["usage"]
+            job.results = msg["results"]
+            if job.status == "done":
+                self.logger.info("%s finished" % job.name)
+            else:
+                self.logger.error("%s %s with status %d" %
+                                  (job.name, job.status, job.returncode))
+            self._remaining -= 1
+            if self.callback:
+                self.callback(job)
+            self._cond.notify_all()
+
+
+def run_worker(host, port, heartbeat_interval=10):
+    """
+    connect to a coordinator and run the jobs it gives, one at a time,
+    until it says it's done
+    :param host: host of the coordinator
+    :param port: port of the coordinator
+    :param heartbeat_interval: seconds between heartbeats while running
+    :return: num of jobs run
+    """
+    sock = socket.create_connection((host, port))
+    rfile = sock.makefile("rb")
+    wfile = sock.makefile("wb")
+    send_lock = threading.Lock()
+
+    def send(msg):
+        with send_lock:
+            _send(wfile, msg)
+
+    send({"type": "ready"})
+    num_jobs = 0
+    try:
+        while True:
+            msg = _recv(rfile)
+            if msg["type"] == "done":
+                break
+            job = _msg_to_job(msg)
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=_send_heartbeats,
+                                         args=(send, stop,
+                                               heartbeat_interval))
+            heartbeat.daemon = True
+            heartbeat.start()
+            try:
+                runner.JobRunner(max_cores=job.cores).run([job])
+            finally:
+                stop.set()
+                heartbeat.join()
+            send({"type": "result", "name": job.name,
+                  "returncode": job.returncode, "status": job.status,
+                  "usage": job.usage, "results": job.results})
+            num_jobs += 1
+    except WorkerLost:
+        pass  # the coordinator is gone
+    finally:
+        sock.close()
+    return num_jobs
+
+
+def _send_heartbeats(send, stop, interval):
+    while not stop.wait(interval):
+        send({"type": "heartbeat"})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run a gist worker")
+    parser.add_argument("--host", help="host of the coordinator",
+                        default="localhost")
+    parser.add_argument("--port", help="port of the coordinator",
+                        type=int, required=True)
+    parser.add_argument("--heartbeat", help="seconds between heartbeats",
+                        type=float, default=10)
+    args = parser.parse_args()
+    run_worker(args.host, args.port, args.heartbeat)
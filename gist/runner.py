@@ -0,0 +1,346 @@
+""" Job launching for sweeps
+A sweep is a bunch of independent simulations, so there is no reason to
+run them one after another when the box has a lot of cores
+"""
+import multiprocessing
+import os
+import select
+import signal
+import time
+from collections import deque
+from subprocess import PIPE, Popen
+
+import gist.utils
+
+
+class Job(object):
+    """
+    One simulation to run: the command, where its outputs go, and
+    what happened to it after it has been run
+    cmd is an argv list that is executed directly, a str is run through
+    the shell instead
+    cores is how many cores the job occupies while running, e.g.
+    MPI ranks times threads per rank
+    cost is how long the job is expected to run, in any unit as long
+    as all the jobs use the same one, longer jobs are launched first
+    If log_name is given, stdout of the job is appended to it as it comes
+    out, and if parser is given as well, every line is passed to it and
+    the dict it returns goes into results, lines it raises on are skipped
+    timeout is the max seconds the job can run, and hang_timeout is the
+    max seconds it can go without writing to its log, the job is killed
+    when it goes over either of them
+    status ends up as one of "done", "failed", "timeout" or "hang"
+    After the job exits, usage has its wall time, user and sys CPU time
+    in seconds, and peak RSS in KB of the largest process in it
+    """
+    def __init__(self, name, cmd, sub_dir="", cores=1, log_name="",
+                 parser=None, timeout=None, hang_timeout=None, cost=0):
+        self.name = name
+        self.cmd = cmd
+        self.sub_dir = sub_dir
+        self.cores = max(int(cores), 1)
+        self.cost = cost
+        self.log_name = log_name
+        self.parser = parser
+        self.timeout = timeout
+        self.hang_timeout = hang_timeout
+        self.results = {}
+        self.proc = None
+        self.returncode = None
+        self.status = ""
+        self.usage = {}
+        self.start_time = None
+        self.last_output_time = None
+        self._log_fp = None
+        self._partial_line = ""
+
+    def consume_output(self, data):
+        """
+        write a chunk of stdout to the log and parse the complete lines
+        in it, an incomplete line at the end waits for the next chunk
+        :param data: str read from stdout, "" if stdout is closed
+        """
+        if data:
+            self.last_output_time = time.time()
+            self._log_fp.write(data)
+            buf = self._partial_line + data
+            end = buf.rfind("\n") + 1
+            self._partial_line = buf[end:]
+            lines = buf[:end].splitlines(True)
+        else:
+            self._log_fp.close()
+            self._log_fp = None
+            lines = [self._partial_line] if self._partial_line else []
+            self._partial_line = ""
+        if self.parser:
+            for line in lines:
+                try:
+                    self.results.update(self.parser(line))
+                except Exception as e:
+                    # a line the parser can't make sense of shouldn't
+                    # take the whole sweep down with it
+                    gist.utils.get_logger().warning(
+                        "%s: skipped output line %r: %s" %
+                        (self.name, line.rstrip("\n"), e))
+
+
+class JobRunner(object):
+    """
+    Runs a list of jobs with at most max_jobs of them alive at any time,
+    and the cores of all running jobs never exceed max_cores.
+    Whenever cores free up, the pending job with the highest cost that
+    fits is launched first (the widest one if costs are the same) and
+    cheaper or narrower ones fill whatever is left, so the longest jobs
+    don't end up starting last and a mix of big and small jobs keeps the
+    box busy.
+    A job wider than max_cores is only launched when nothing else runs.
+    callback, if given, is called with the job every time a job is
+    launched or finished
+    can_launch, if given, is called before launching a job, and nothing
+    is launched while it returns False, e.g. while the outputs of the
+    finished jobs are behind on being written back. The jobs already
+    running are looked after as usual meanwhile
+    """
+    def __init__(self, max_jobs=1, max_cores=None, poll_interval=0.1,
+                 callback=None, can_launch=None):
+        self.max_jobs = max(int(max_jobs), 1)
+        self.callback = callback
+        self.can_launch = can_launch or (lambda: True)
+        if max_cores:
+            self.max_cores = int(max_cores)
+        else:
+            self.max_cores = multiprocessing.cpu_count()
+        self.poll_interval = poll_interval
+        self.logger = gist.utils.get_logger()
+        # stdout fd -> job, for jobs whose output is being streamed
+        self._streams = {}
+
+    def _launch(self, job):
+        shell = isinstance(job.cmd, str)
+        cmd_str = job.cmd if shell else gist.utils.cmd_to_str(job.cmd)
+        self.logger.debug("launching %s on %d cores: %s" %
+                          (job.name, job.cores, cmd_str))
+        # own process group, so that everything the job started can be
+        # killed together
+        if job.log_name:
+            job._log_fp = open(job.log_name, "ab")
+            job.proc = Popen(job.cmd, shell=shell, stdout=PIPE,
+                             preexec_fn=os.setsid)
+            self._streams[job.proc.stdout.fileno()] = job
+        else:
+            job.proc = Popen(job.cmd, shell=shell, preexec_fn=os.setsid)
+        job.start_time = time.time()
+        job.last_output_time = job.start_time
+        if self.callback:
+            self.callback(job)
+
+    def _kill(self, job, status):
+        """
+        kill the process group of a job, the job will be finished with
+        this status once it is gone
+        """
+        job.status = status
+        try:
+            os.killpg(job.proc.pid, signal.SIGKILL)
+        except OSError:  # already gone
+            pass
+
+    def _check_timeouts(self, job, now):
+        if job.status:  # already killed
+            return
+        if job.timeout and now - job.start_time > job.timeout:
+            self.logger.error("%s ran for more than %d seconds, killed" %
+                              (job.name, job.timeout))
+            self._kill(job, "timeout")
+        elif job.hang_timeout and job.log_name and \
+                now - job.last_output_time > job.hang_timeout:
+            self.logger.error("%s had no output for %d seconds, killed" %
+                              (job.name, job.hang_timeout))
+            self._kill(job, "hang")
+
+    def _poll(self, job):
+        """
+        like Popen.poll(), but waits with wait4 to also get the resource
+        usage of the job and everything it has waited for, e.g. the
+        ranks started by mpirun
+        :return: returncode, None if still running
+        """
+        if job.proc.returncode is not None:
+            return job.proc.returncode
+        pid, status, rusage = os.wait4(job.proc.pid, os.WNOHANG)
+        if pid == 0:
+            return None
+        if os.WIFSIGNALED(status):
+            job.proc.returncode = -os.WTERMSIG(status)
+        else:
+            job.proc.returncode = os.WEXITSTATUS(status)
+        job.usage = {
+            "wall_time": time.time() - job.start_time,
+            "user_time": rusage.ru_utime,
+            "sys_time": rusage.ru_stime,
+            "max_rss": rusage.ru_maxrss
+        }
+        return job.proc.returncode
+
+    def _finish(self, job, returncode):
+        job.returncode = returncode
+        job.proc = None
+        if not job.status:
+            job.status = "done" if returncode == 0 else "failed"
+        if returncode == 0:
+            self.logger.info("%s finished" % job.name)
+        elif job.status in ("timeout", "hang"):
+            pass  # already logged when killed
+        else:
+            self.logger.error("%s exited with status %d" %
+                              (job.name, returncode))
+        if self.callback:
+            self.callback(job)
+
+    def _read_streams(self, timeout):
+        """
+        wait for output of any streamed job for up to timeout seconds,
+        and hand whatever comes out to the job
+        """
+        if not self._streams:
+            time.sleep(timeout)
+            return
+        readable, _, _ = select.select(list(self._streams), [], [], timeout)
+        for fd in readable:
+            job = self._streams[fd]
+            data = os.read(fd, 65536)
+            job.consume_output(data)
+            if not data:
+                job.proc.stdout.close()
+                del self._streams[fd]
+
+    def _pop_fitting_job(self, pending, free_cores, idle):
+        """
+        get the most costly pending job that fits in free_cores
+        :param pending: dict of cores -> deque of jobs of that width,
+                        sorted by cost from high to low
+        :param free_cores: cores not used by running jobs
+        :param idle: True if nothing is running
+        :return: a job, or None if nothing fits
+        """
+        best = None
+        for cores in sorted(pending, reverse=True):
+            if cores <= free_cores or idle:
+                if best is None or \
+                        pending[cores][0].cost > pending[best][0].cost:
+                    best = cores
+        if best is None:
+            return None
+        if best > self.max_cores:
+            self.logger.warning("%d cores needed but only %d "
+                                "available, running it alone" %
+                                (best, self.max_cores))
+        job = pending[best].popleft()
+        if not pending[best]:
+            del pending[best]
+        return job
+
+    def run(self, jobs):
+        """
+        run all the jobs and wait for them to finish
+        :param jobs: list of Job objects
+        :return: the same list, with returncode of each job filled in
+        """
+        pending = {}
+        for job in sorted(jobs, key=lambda j: j.cost, reverse=True):
+            pending.setdefault(job.cores, deque()).append(job)
+        self._run_all(pending, None, 0)
+        return jobs
+
+    def run_stream(self, jobs, lookahead=None):
+        """
+        like run(), but jobs can be any iterable, e.g. a generator, and
+        only lookahead jobs are taken from it ahead of being launched.
+        Nothing is kept of a job once it's finished, so if the iterable
+        makes the jobs as they are asked for, the memory taken does not
+        depend on how many there are. The callback is the only way to
+        get at the finished jobs
+        :param jobs: iterable of Job objects
+        :param lookahead: max jobs waiting to be launched, twice max_jobs
+                          by default. Costs only matter among these
+        :return: num of jobs run
+        """
+        if not lookahead:
+            lookahead = 2 * self.max_jobs
+        return self._run_all({}, iter(jobs), lookahead)
+
+    def _run_all(self, pending, source, lookahead):
+        running = []
+        try:
+            return self._run(pending, running, source, lookahead)
+        except BaseException:
+            # e.g. Ctrl-C, don't leave the jobs behind since they are
+            # not in our process group
+            for job in running:
+                if job.proc:
+                    self._kill(job, "failed")
+            raise
+
+    def _refill(self, pending, source, lookahead):
+        """
+        take jobs from source until lookahead jobs are pending
+        :return: False if source has run out
+        """
+        num_pending = sum(len(q) for q in pending.itervalues())
+        widths = set()
+        more = True
+        while num_pending < lookahead:
+            job = next(source, None)
+            if job is None:
+                more = False
+                break
+            pending.setdefault(job.cores, deque()).append(job)
+            widths.add(job.cores)
+            num_pending += 1
+        for cores in widths:
+            pending[cores] = deque(sorted(pending[cores],
+                                          key=lambda j: j.cost,
+                                          reverse=True))
+        return more
+
+    def _run(self, pending, running, source, lookahead):
+        used_cores = 0
+        num_finished = 0
+        while pending or running or source:
+            if source and not self._refill(pending, source, lookahead):
+                source = None
+            while pending and len(running) < self.max_jobs and \
+                    self.can_launch():
+                job = self._pop_fitting_job(pending,
+                                            self.max_cores - used_cores,
+                                            not running)
+                if job is None:
+                    break
+                self._launch(job)
+                running.append(job)
+                used_cores += job.cores
+            if running or pending:  # pending ones may wait on can_launch
+                self._read_streams(self.poll_interval)
+            still_running = []
+            now = time.time()
+            for job in running:
+                returncode = self._poll(job)
+                # a streamed job is done once its stdout is drained too
+                if returncode is None or job._log_fp:
+                    still_running.append(job)
+                    if returncode is None:
+                        self._check_timeouts(job, now)
+                else:
+                    self._finish(job, returncode)
+                    used_cores -= job.cores
+                    num_finished += 1
+            running[:] = still_running
+        return num_finished
+
+
+def get_failed_jobs(jobs):
+    """
+    :param jobs: list of jobs that have been run
+    :return: list of jobs that did not exit cleanly
+    """
+    return [job for job in jobs if job.returncode != 0]
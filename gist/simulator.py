@@ -2,9 +2,189 @@
 It's gonna take a while to figure out the structure of this project.
 We will see...
 """
+import copy
+import hashlib
+import json
 import os
+import shlex
 import sys
+import time
+from collections import OrderedDict
+
 import gist.utils
+from gist import sweep
+
+
+class Manifest(object):
+    """
+    On-disk record of a sweep, so that a sweep that died half way can be
+    resumed: the configs it was started with, the expanded params and
+    the state (pending/running/done/failed) of each config.
+    Rewriting it for every state change is slow for big sweeps, so state
+    changes are only written every min_interval seconds. Forced ones,
+    e.g. failures, are appended to a journal next to it in between,
+    which the next rewrite clears
+    names are the names of the configs, config_0 to config_N by default
+    A streamed sweep has param_list None and keeps neither the params
+    nor the states, only the configs and the shard it was started with,
+    the params are made again from those and what is done is told by
+    the output dirs
+    """
+    file_name = "manifest.json"
+    journal_name = "manifest_journal.txt"
+
+    def __init__(self, output_dir, configs, param_list, cache_dir="",
+                 min_interval=10, names=None, shard=""):
+        self.path = os.path.join(output_dir, self.file_name)
+        self.journal_path = os.path.join(output_dir, self.journal_name)
+        # simulators may change their configs and params later on,
+        # keep the original ones
+        self.configs = copy.deepcopy(configs)
+        self.param_list = copy.deepcopy(param_list)
+        self.cache_dir = cache_dir
+        self.shard = shard
+        self.min_interval = min_interval
+        self.states = OrderedDict()
+        if param_list is None:
+            names = []
+        elif names is None:
+            names = ["config_%d" % i for i in range(len(param_list))]
+        for name in names:
+            self.states[name] = "pending"
+        self.last_dump = 0
+
+    @classmethod
+    def load(cls, output_dir):
+        """
+        :param output_dir: output dir of a sweep with a manifest in it
+        :return: Manifest object
+        """
+        with open(os.path.join(output_dir, cls.file_name)) as fp:
+            d = gist.utils.json_to_dict(fp)
+            fp.close()
+        if "param_list" not in d:  # streamed
+            return cls(output_dir, d["configs"], None, d["cache_dir"],
+                       shard=d["shard"])
+        manifest = cls(output_dir, d["configs"],
+                       [c["params"] for c in d["param_list"]],
+                       d["cache_dir"],
+                       names=[c["name"] for c in d["param_list"]])
+        for c in d["param_list"]:
+            manifest.states[c["name"]] = c["state"]
+        if os.path.exists(manifest.journal_path):
+            with open(manifest.journal_path) as fp:
+                for line in fp:
+                    name, state = line.split()
+                    manifest.states[name] = state
+                fp.close()
+        return manifest
+
+    def dump(self):
+        """
+        write to a tmp file then rename, so that a crash in the middle
+        of writing doesn't leave a broken manifest behind
+        """
+        d = {
+            "configs": self.configs,
+            "cache_dir": self.cache_dir,
+            "shard": self.shard
+        }
+        if self.param_list is not None:
+            d["param_list"] = [{"name": name, "state": state, "params": p}
+                               for (name, state), p in
+                               zip(self.states.items(), self.param_list)]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(d, fp)
+            fp.close()
+        os.rename(tmp_path, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.last_dump = time.time()
+
+    def set_state(self, name, state, force=False):
+        """
+        :param force: write the state down right away, in the journal
+                      if it's not time to rewrite the manifest yet
+        """
+        if self.param_list is None:
+            return
+        self.states[name] = state
+        if time.time() - self.last_dump > self.min_interval:
+            self.dump()
+        elif force:
+            with open(self.journal_path, "a") as fp:
+                fp.write("%s %s\n" % (name, state))
+                fp.close()
+
+
+class ConfigIndex(object):
+    """
+    Where the output dir of each config of a sweep is, relative to the
+    output dir of the sweep.
+    The default layout puts each config right in the output dir. Some
+    parallel file systems slow down a lot with tens of thousands of
+    entries in a dir, so with sharded, configs go two levels down
+    instead, into dirs named by a hash of the config name, e.g.
+    3f/a2/config_17, which makes at most 65536 dirs of a few configs.
+    The path of a config is always made from its name, only the layout
+    is kept, in config_index.txt of the output dir as "layout sharded"
+    or "layout flat", so the index takes no memory however many configs
+    there are, and whatever reads the outputs later on finds them
+    without being told the layout. Sweeps without the file, e.g. run
+    before it existed, are taken to be flat
+    """
+    file_name = "config_index.txt"
+
+    def __init__(self, output_dir, sharded=False):
+        self.output_dir = output_dir
+        self.sharded = sharded
+        self._made_dirs = set()
+        self._index_file = os.path.join(output_dir, self.file_name)
+        self._has_file = os.path.exists(self._index_file)
+        if self._has_file:
+            with open(self._index_file) as fp:
+                self.sharded = fp.read().split() == ["layout", "sharded"]
+                fp.close()
+
+    def get_path(self, config_name):
+        """
+        :return: path of the output dir of a config relative to the
+                 output dir of the sweep
+        """
+        if not self.sharded:
+            return config_name
+        digest = hashlib.sha1(config_name).hexdigest()
+        return os.path.join(digest[:2], digest[2:4], config_name)
+
+    def get_dir(self, config_name):
+        """
+        :return: output dir of a config
+        """
+        return os.path.join(self.output_dir, self.get_path(config_name))
+
+    def add(self, config_names):
+        """
+        make the dirs the output dirs of configs go in, the output dirs
+        themselves are left to be made, and write the layout down the
+        first time
+        :param config_names: iterable of config names
+        """
+        if not self._has_file:
+            with open(self._index_file, "w") as fp:
+                fp.write("layout %s\n" %
+                         ("sharded" if self.sharded else "flat"))
+                fp.close()
+            self._has_file = True
+        if not self.sharded:
+            return
+        for name in config_names:
+            parent = os.path.dirname(self.get_path(name))
+            if parent not in self._made_dirs:
+                parent_dir = os.path.join(self.output_dir, parent)
+                if not os.path.exists(parent_dir):
+                    os.makedirs(parent_dir)
+                self._made_dirs.add(parent)
 
 
 class Simulator(object):
@@ -14,26 +194,106 @@ class Simulator(object):
                      configs or params
     Run Commands: run time commands, like the executable, mpi, debug, 
                   verbose, input/output dirs
+    With sim_opts["stream"], param_list and config_names are made on
+    demand from the sweep space instead of being built up front, so a
+    sweep of any size takes the same memory
+    With sim_opts["output_layout"] set to "sharded", the output dirs of
+    the configs are nested by a hash of their names, see ConfigIndex
     """
-    def __init__(self, config_file_name=""):
-        self.cmd = ""
+    def __init__(self, config_file_name="", resume_dir="", shard=""):
+        self.cmd = []
         self.configs = {}
+        self.space = None
         self.param_list = []
+        # sub dir name of each config in param_list, config_<index in
+        # the space>, so that shards of a sweep never use the same name
+        self.config_names = []
         self.sim_opts = {}
         self.params = {}
+        self.manifest = None
+        self.config_index = None
+        self.streamed = False
+        self.resumed = bool(resume_dir)
         self.logger = gist.utils.get_logger()
+        if resume_dir:
+            self.manifest = Manifest.load(resume_dir)
+            self.configs = copy.deepcopy(self.manifest.configs)
+            self.sim_opts = self.configs["sim_opts"]
+            self.params = self.configs["model_params"]
+            self.space = sweep.SweepSpace(self.params,
+                                          self.get_constraint_functions())
+            if self.manifest.param_list is None:
+                self._stream_params(self.manifest.shard)
+            else:
+                self.param_list = copy.deepcopy(self.manifest.param_list)
+                self.config_names = list(self.manifest.states)
+            self.output_base_dir = resume_dir
+            self.cache_dir = self.manifest.cache_dir
+            self.config_index = self.get_config_index()
+            return
         if config_file_name:
             with open(config_file_name) as config_f:
                 self.configs = gist.utils.json_to_dict(config_f)
                 self.sim_opts = self.configs["sim_opts"]
                 self.params = self.configs["model_params"]
-                self.param_list = gist.utils.permute_params(self.params)
                 config_f.close()
+            self.space = sweep.SweepSpace(self.params,
+                                          self.get_constraint_functions())
+            if self.sim_opts.get("stream", False):
+                self._stream_params(shard)
+            else:
+                indices = list(self._get_indices(shard))
+                self.param_list = [self.space[i] for i in indices]
+                self.config_names = [sweep.get_config_name(i)
+                                     for i in indices]
         if not self.param_list:
             self.logger.fatal("Did not load valid params!")
             sys.exit(1)
         self.output_base_dir = self.sim_opts["output_dir"]
+        self.cache_dir = ""
         self.prep_output()
+        self.config_index = self.get_config_index()
+        if os.path.isdir(self.output_base_dir):
+            param_list = None if self.streamed else self.param_list
+            self.manifest = Manifest(self.output_base_dir, self.configs,
+                                     param_list, self.cache_dir,
+                                     names=self.config_names, shard=shard)
+            self.manifest.dump()
+
+    def get_config_index(self):
+        """
+        :return: ConfigIndex of the output dir
+        """
+        sharded = self.sim_opts.get("output_layout", "flat") == "sharded"
+        return ConfigIndex(self.output_base_dir, sharded)
+
+    def get_constraint_functions(self):
+        """ functions that the constraints in model_params can call
+        could be overridden to add simulator specific ones
+        :return: dict of name -> function
+        """
+        return {}
+
+    def _get_indices(self, shard):
+        """
+        :param shard: "i/N" for one of N slices of the space, or ""
+        :return: indices of the configs to run, a sample of them if
+                 sim_opts["sample"] is given, e.g.
+                 {"method": "lhs", "num": 100, "seed": 1}, see
+                 sweep.SampledIndices
+        """
+        shard, num_shards = sweep.parse_shard(shard) if shard else (0, 1)
+        if "sample" in self.sim_opts:
+            return sweep.SampledIndices(self.space, shard=shard,
+                                        num_shards=num_shards,
+                                        **self.sim_opts["sample"])
+        return sweep.ConfigIndices(self.space, shard, num_shards)
+
+    def _stream_params(self, shard):
+        self.streamed = True
+        indices = self._get_indices(shard)
+        self.param_list = sweep.LazyList(self.space.__getitem__, indices)
+        self.config_names = sweep.LazyList(sweep.get_config_name, indices)
 
     def prep_output(self):
         """
@@ -48,8 +308,15 @@ class Simulator(object):
                 time_dir = "time-" + gist.utils.get_time_str()
                 self.output_base_dir = os.path.join(base_dir, time_dir)
             elif os.path.split(self.output_base_dir)[1] == "hash":
-                # TODO create output dir based on hash val of config
-                pass
+                # results go to a cache dir, one sub dir per hash val of
+                # config, and the dir of this run only links to them
+                base_dir = os.path.split(self.output_base_dir)[0]
+                self.cache_dir = self.sim_opts.get(
+                    "cache_dir", os.path.join(base_dir, "cache"))
+                if not os.path.exists(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                hash_dir = "hash-" + gist.utils.get_time_str()
+                self.output_base_dir = os.path.join(base_dir, hash_dir)
             elif os.path.split(self.output_base_dir)[1] == "config":
                 # TODO create output dir based on config abstract
                 pass
@@ -63,26 +330,38 @@ class Simulator(object):
 
     def mpi_cmd_gen(self, program_cmd):
         """ if support MPI then get an MPI prefix with basic options
-        :param program_cmd: stuff to attach to after mpi
-        :return: command string with MPI
+        :param program_cmd: argv list to attach to after mpi
+        :return: argv list with MPI
         """
-        cmd = self.sim_opts["mpi_opts"]["mpi_exe"]
+        cmd = shlex.split(self.sim_opts["mpi_opts"]["mpi_exe"])
+        cmd[0] = gist.utils.find_exe(cmd[0])
         n_threads = self.sim_opts["mpi_opts"]["n"]
         n_threads = int(n_threads)
+        cmd += ["-n", str(n_threads)]
         if "other_opts" in self.sim_opts["mpi_opts"]:
             other_opts = self.sim_opts["mpi_opts"]["other_opts"]
-            cmd = "%s -n %d %s %s " % (cmd, n_threads, other_opts, program_cmd)
-        else:
-            cmd = "%s -n %d %s " % (cmd, n_threads, program_cmd)
-        return cmd
+            cmd += shlex.split(other_opts)
+        return cmd + program_cmd
+
+    def get_job_cores(self):
+        """ how many cores one simulation occupies while running
+        could be overridden if the simulator runs multi-threaded
+        :return: number of MPI ranks, or 1 if not using MPI
+        """
+        if self.sim_opts["mpi"]:
+            return int(self.sim_opts["mpi_opts"]["n"])
+        return 1
 
     def assemble_command(self):
         """ assemble commands that will be called later
         format is like [mpi stuff][simulator stuff][other]
         could be overridden if necessary
-        :return: command string
+        commands are argv lists and called without a shell, so no quoting
+        is needed for any of the args
+        :return: argv list
         """
-        cmd = self.sim_opts["sim_exe"]
+        cmd = shlex.split(self.sim_opts["sim_exe"])
+        cmd[0] = gist.utils.find_exe(cmd[0])
         if self.sim_opts["mpi"]:
             cmd = self.mpi_cmd_gen(cmd)
         cmd = self.add_specific_opts(cmd)
@@ -90,8 +369,8 @@ class Simulator(object):
 
     def add_specific_opts(self, pre_cmd):
         """ this handles ["other_opts"]
-        :param pre_cmd: the command before adding simulator specific opts
-        :return: complete command with simulator specific opts
+        :param pre_cmd: argv list before adding simulator specific opts
+        :return: complete argv list with simulator specific opts
         """
         self.logger.info("No simulator-specific opts!")
         return pre_cmd
@@ -103,7 +382,7 @@ class Simulator(object):
         :return: none
         """
         self.cmd = self.assemble_command()
-        self.logger.info(self.cmd)
+        self.logger.info(gist.utils.cmd_to_str(self.cmd))
     
     def compile_output(self):
         self.logger.warning("this should be implemented by sub-classes")
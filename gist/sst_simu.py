@@ -2,17 +2,29 @@
 explore what interfaces should look like in this file
 """
 import csv
+import glob
+import itertools
+import json
 import os
+import shutil
 import sys
-from collections import OrderedDict
-from subprocess import call
+import tempfile
+from collections import OrderedDict, deque
 
 import gist.utils
 import numpy as np
 import pandas as pd
 import simulator
 from gist import analysis
+from gist import cluster
+from gist import distrib
 from gist import plot
+from gist import runner
+from gist import staging
+
+
+# params that decide how long a simulation runs, see estimate_job_costs
+DEFAULT_COST_FEATURES = ["num_nodes", "packets_to_send", "message_size"]
 
 
 def get_exe_time_in_line(line):
@@ -50,7 +62,7 @@ def _add_metrics_to_header(header, other_stats):
 
 def _get_ext_time_from_log(log_file):
     exe_time = ""
-    with open(log_file, "r") as log:
+    with gist.utils.open_output_file(log_file) as log:
         for line in log:
             if "Simulation is complete" in line:
                 exe_time = get_exe_time_in_line(line)
@@ -58,47 +70,156 @@ def _get_ext_time_from_log(log_file):
         return exe_time
 
 
+def is_sim_complete(log_file):
+    """
+    :param log_file: output log of one simulation, which may have been
+                     compressed since
+    :return: True if sst got to the end of the simulation
+    """
+    if not gist.utils.find_output_file(log_file):
+        return False
+    with gist.utils.open_output_file(log_file) as log:
+        for line in log:
+            if "Simulation is complete" in line:
+                return True
+        log.close()
+    return False
+
+
+def _remove_dir(sub_dir):
+    """
+    remove what an unfinished run left in sub_dir, which could be a
+    link to a cache entry
+    """
+    if os.path.islink(sub_dir):
+        os.remove(sub_dir)
+    elif os.path.exists(sub_dir):
+        shutil.rmtree(sub_dir)
+
+
+def _is_output_to_compress(file_name):
+    """ the log, the stats and the config dump of a config """
+    return file_name in ("output.log", "config.py") or \
+        file_name.endswith(".csv")
+
+
+def _write_job_info(sub_dir, info):
+    """
+    keep the job_info of a config in its output dir, for a streamed
+    sweep that can't keep it in memory until it's compiled
+    """
+    with open(os.path.join(sub_dir, JobInfoFiles.file_name), "w") as fp:
+        json.dump(info, fp)
+        fp.close()
+
+
+class JobInfoFiles(object):
+    """
+    job_info of the configs of a streamed sweep, read from the output
+    dir of each config when asked for, see _write_job_info. Works as
+    the job_info of compile_accu_output and compile_histogram_outputs
+    :param config_index: ConfigIndex of the output dir
+    :param header: the info keys, in the order of the columns
+    """
+    file_name = "job_info.json"
+
+    def __init__(self, config_index, header):
+        self.config_index = config_index
+        self.header = header
+
+    def get(self, config_name, default=None):
+        info_file = os.path.join(self.config_index.get_dir(config_name),
+                                 self.file_name)
+        if not os.path.exists(info_file):
+            return default
+        with open(info_file) as fp:
+            info = json.load(fp)
+            fp.close()
+        return info
+
+    def __nonzero__(self):
+        return bool(self.header)
+
+
+def _get_job_info_header(job_info):
+    """
+    :param job_info: dict of config name -> dict of info about its job,
+                     or JobInfoFiles
+    :return: list of all the info keys, in the order they first show up
+    """
+    if isinstance(job_info, JobInfoFiles):
+        return list(job_info.header)
+    header = []
+    if job_info:
+        for info in job_info.values():
+            for key in info:
+                if key not in header:
+                    header.append(key)
+    return header
+
+
+def _get_job_info_row(job_info, config_name, info_header):
+    info = job_info.get(config_name, {}) if job_info else {}
+    return [info.get(key, "") for key in info_header]
+
+
+def get_accu_stats(stats_dict, sub_dir):
+    """
+    add up the accumulator stats of one config
+    :param stats_dict: stats to add up, see compile_accu_output
+    :param sub_dir: output dir of the config
+    :return: OrderedDict of exe_time(us) and each stat, in the order of
+             the columns _add_metrics_to_header adds
+    """
+    log_file = os.path.join(sub_dir, "output.log")
+    stats = OrderedDict([("exe_time(us)", _get_ext_time_from_log(log_file))])
+    for key in sorted(stats_dict):
+        stats[key] = 0
+    for csv_file in os.listdir(sub_dir):
+        if ".csv" in csv_file:
+            stats_csv = os.path.join(sub_dir, csv_file)
+            with gist.utils.open_output_file(stats_csv) as stats_f:
+                stats_reader = csv.reader(stats_f)
+                csv_header = next(stats_reader)
+                for line in stats_reader:
+                    for key, value in stats_dict.items():
+                        cnt_index = csv_header.index(value[2])
+                        if value[0] in line[0]:
+                            if value[1] in line[1]:
+                                stats[key] += int(line[cnt_index])
+                stats_f.close()
+    return stats
+
+
 def compile_accu_output(stats_dict, output_dir_base, 
-                        output_name="summary.csv"):
+                        output_name="summary.csv", job_info=None):
     """
     Accumulator type statistics, compile everthing together, e.g.
     adding up all the same stats of one type of component specified by 
     the stats_dict
     The output is a compiled csv file 
+    job_info is a dict of config name -> dict of info about how its job
+    went, e.g. {"status": "timeout"}, which goes behind the stats
+    The config dirs are looked up in the config index of the output dir
     """
+    info_header = _get_job_info_header(job_info)
+    config_index = simulator.ConfigIndex(output_dir_base)
     with open(os.path.join(output_dir_base, "config.csv"), "r") as rfp, \
             open(os.path.join(output_dir_base, output_name), "wb") as wfp:
         reader = csv.reader(rfp)
         header = next(reader)
         header = _add_metrics_to_header(header, stats_dict)
+        header += info_header
         writer = csv.writer(wfp)
         writer.writerow(header)
         for row in reader:
             new_row = list(row)
             config_dir = row[0]
-            sub_dir = os.path.join(output_dir_base, config_dir)
+            sub_dir = config_index.get_dir(config_dir)
             if os.path.exists(sub_dir):
-                log_file = os.path.join(sub_dir, "output.log")
-                exe_time = _get_ext_time_from_log(log_file)
-                new_row.append(exe_time)
-                stats = {}
-                for key in stats_dict:
-                    stats.update({key: 0})
-                for csv_file in os.listdir(sub_dir):
-                    if ".csv" in csv_file:
-                        stats_csv = os.path.join(sub_dir, csv_file)
-                        with open(stats_csv, "r") as stats_f:
-                            stats_reader = csv.reader(stats_f)
-                            csv_header = next(stats_reader)
-                            for line in stats_reader:
-                                for key, value in stats_dict.items():
-                                    cnt_index = csv_header.index(value[2])
-                                    if value[0] in line[0]:
-                                        if value[1] in line[1]:
-                                            stats[key] += int(line[cnt_index])
-                            stats_f.close()
-                for key in sorted(stats_dict):
-                    new_row.append(stats[key])
+                new_row += get_accu_stats(stats_dict, sub_dir).values()
+                new_row += _get_job_info_row(job_info, config_dir,
+                                             info_header)
                 writer.writerow(new_row)
             else:
                 pass
@@ -107,46 +228,59 @@ def compile_accu_output(stats_dict, output_dir_base,
 
 
 def compile_histogram_outputs(stats_dict, output_dir_base,
-                              output_name="summary.csv"):
+                              output_name="summary.csv", job_info=None):
     """
     for histogram stats output, simply append everything
     behind the configs
+    job_info is the same as in compile_accu_output, and goes right
+    behind exe_time
     """
+    info_header = _get_job_info_header(job_info)
+    config_index = simulator.ConfigIndex(output_dir_base)
     with open(os.path.join(output_dir_base, "config.csv"), "r") as rfp, \
             open(os.path.join(output_dir_base, output_name), "wb") as wfp:
         reader = csv.reader(rfp)
         header = next(reader)
         header.append("exe_time(us)")
+        header += info_header
         writer = csv.writer(wfp)
-        # open up config_0 to complete the header
-        config_0_dir = os.path.join(output_dir_base, "config_0")
+        first_row = next(reader, None)
+        # open up the first config to complete the header, it's not
+        # config_0 for a shard of a sweep
+        first_dir = ""
+        if first_row:
+            first_dir = config_index.get_dir(first_row[0])
         stats_csv_file = ""
-        if os.path.exists(config_0_dir):
-            for each_file in os.listdir(config_0_dir):
+        if os.path.exists(first_dir):
+            for each_file in os.listdir(first_dir):
                 if ("stats" in each_file) and (".csv" in each_file):
-                    stats_csv_file = os.path.join(config_0_dir, each_file)
+                    stats_csv_file = os.path.join(first_dir, each_file)
                     break
         else:
             sys.exit(1)
         if stats_csv_file:
-            with open(stats_csv_file, "r") as stats_fp:
+            with gist.utils.open_output_file(stats_csv_file) as stats_fp:
                 header = header + next(stats_fp).split()
                 stats_fp.close()
         writer.writerow(header)
-        for row in reader:
+        for row in itertools.chain([first_row], reader):
             config_dir = row[0]
-            sub_dir = os.path.join(output_dir_base, config_dir)
+            sub_dir = config_index.get_dir(config_dir)
             if os.path.exists(sub_dir):
                 log_file = os.path.join(sub_dir, "output.log")
                 exe_time = _get_ext_time_from_log(log_file)
+                info_row = _get_job_info_row(job_info, config_dir,
+                                             info_header)
                 for csv_file in os.listdir(sub_dir):
                     if ".csv" in csv_file:
                         stats_csv = os.path.join(sub_dir, csv_file)
-                        with open(stats_csv, "r") as stats_f:
+                        with gist.utils.open_output_file(stats_csv) \
+                                as stats_f:
                             stats_reader = csv.reader(stats_f)
                             for line in stats_reader:
                                 new_row = list(row)
                                 new_row.append(exe_time)
+                                new_row += info_row
                                 for key, value in stats_dict.items():
                                     if value[0] in line[0]:
                                         if value[1] in line[1]:
@@ -176,13 +310,14 @@ def get_ember_output_from_line(line):
     """
     tokens = line.split(" ")
     results = {}
-    if "latency" in line:
+    # whole words only, e.g. not link_latency=10ns
+    if "latency" in tokens:
         lat_index = tokens.index("latency")
         lat = tokens[lat_index + 1]
         lat_unit = tokens[lat_index + 2]
         lat_in_us = str(gist.utils.convert_time_to_us(lat, lat_unit))
         results["real_latency(us)"] = lat_in_us
-    if "bandwidth" in line:
+    if "bandwidth" in tokens:
         bw_index = tokens.index("bandwidth")
         bw = tokens[bw_index + 1]
         results["real_bandwidth(GB/s)"] = bw
@@ -217,7 +352,7 @@ def get_ember_output_from_file(log_name):
     :return: dict
     """
     result = {}
-    with open(log_name, "r") as log_fp:
+    with gist.utils.open_output_file(log_name) as log_fp:
         for line in log_fp:
             result.update(get_ember_output_from_line(line))
         log_fp.close()
@@ -226,7 +361,7 @@ def get_ember_output_from_file(log_name):
 
 def get_miranda_output_from_file(log_name):
     result = {}
-    with open(log_name, "r") as log_fp:
+    with gist.utils.open_output_file(log_name) as log_fp:
         for line in log_fp:
             result.update(get_miranda_output_from_line(line))
         log_fp.close()
@@ -250,6 +385,18 @@ def get_ep_specific_output(ep_type, log_name):
     return results
 
 
+def get_ep_specific_parser(ep_type):
+    """
+    line parser that matches get_ep_specific_output
+    :param ep_type: end point type, e.g. ember, miranda ...
+    :return: function that takes a line and returns a dict of results
+    """
+    if ep_type == "ember_ep":
+        return get_ember_output_from_line
+    else:
+        return get_miranda_output_from_line
+
+
 def compile_ember_output(log_name, output_dir_base,
                          output_name="summary.csv"):
     """
@@ -261,7 +408,7 @@ def compile_ember_output(log_name, output_dir_base,
     :param output_name: the name you want to output to, by default summary.csv
     :return:
     """
-    with open(log_name, "r") as log_fp, \
+    with gist.utils.open_output_file(log_name) as log_fp, \
             open(os.path.join(output_dir_base, output_name), "wb") as w_fp:
         writer = csv.writer(w_fp)
         header = ["config", ]
@@ -366,6 +513,57 @@ def compile_ember_output(log_name, output_dir_base,
         w_fp.close()
 
 
+def split_ember_log(log_name, out_logs):
+    """
+    split the log of one sst run with many ember configs in it, one
+    "EMBER: platform" block per config like in compile_ember_output,
+    into one log per config. The lines before the first block go to
+    every log, and each log ends with a "Simulation is complete" line
+    with the total time of that config's workload, so that the split
+    logs read the same as if each config had been run alone.
+    If the run was killed or crashed part way, every log is still
+    written, but none of them ends with that line, and the configs
+    whose blocks never showed up only get the lines before the first
+    block, so they all read as not complete
+    :param log_name: log of the whole run, may not exist if the run
+                     never started
+    :param out_logs: names of the logs to write, in the order of blocks
+    :return: num of blocks found
+    """
+    preamble = []
+    blocks = []
+    complete_line = ""
+    if os.path.exists(log_name):
+        with open(log_name, "r") as log_fp:
+            for line in log_fp:
+                if "Simulation is complete" in line:
+                    complete_line = line
+                    continue
+                if "EMBER: platform" in line:
+                    blocks.append([])
+                if blocks:
+                    blocks[-1].append(line)
+                else:
+                    preamble.append(line)
+            log_fp.close()
+    num_blocks = len(blocks)
+    blocks += [[]] * (len(out_logs) - num_blocks)
+    for out_log, block in zip(out_logs, blocks):
+        work_time = ""
+        for line in block:
+            if "total time" in line:
+                work_time = get_ember_output_from_line(line)["work_time(us)"]
+        with open(out_log, "w") as out_fp:
+            out_fp.writelines(preamble + block)
+            if work_time and complete_line:
+                out_fp.write("Simulation is complete, simulated time: "
+                             "%s us\n" % work_time)
+            else:
+                out_fp.write(complete_line)
+            out_fp.close()
+    return num_blocks
+
+
 def plot_ember_summary(summary_csv, output_dir_base):
     df = pd.read_csv(summary_csv)
     df = analysis.move_bw_unit_to_index(df)
@@ -393,23 +591,116 @@ def plot_ember_summary(summary_csv, output_dir_base):
 
 
 class SSTSimulator(simulator.Simulator):
-    def __init__(self, config_file=""):
-        super(SSTSimulator, self).__init__(config_file)
+    def __init__(self, config_file="", resume_dir="", shard=""):
+        super(SSTSimulator, self).__init__(config_file, resume_dir, shard)
         self.other_opts = self.sim_opts["other_opts"]
         self.stats = self.other_opts.pop("stats")
         self.stats_params = self.params["stats_params"]
         self.df = None
+        self.jobs = []
+        self.cached_configs = []
+        self.exit_status = OrderedDict()
+        # config name -> results parsed from its output while running
+        self.results = {}
+        # config name -> how its job went, e.g. status
+        self.job_info = {}
+        # batch job name -> list of (config name, run dir) in it
+        self._batches = {}
+        # when streamed, what is kept of the configs being run, until
+        # their rows are in summary.csv
+        # config name -> its param
+        self._running_params = {}
+        # job name -> param file of the job
+        self._param_files = {}
+        # job name -> list of (config name, param) of configs with the
+        # same hash as the config of the job, which wait for its result
+        self._dup_configs = {}
+        # hash key -> name of the config run for it and back, until the
+        # outputs of the config are final, see _release_key
+        self._queued_keys = {}
+        self._config_keys = {}
+        # config name -> (results, job_info) of those done running
+        self._finished = {}
+        # keys of the job_info written to the config dirs, see
+        # JobInfoFiles
+        self._job_info_header = []
+        # (num_done the write back gets to, config name) of the configs
+        # with a key whose outputs are being written back
+        self._written_keys = deque()
+        self._summary_writer = None
+        self._num_failed = 0
+        # the one params file of the sweep with sim_opts["indexed_params"]
+        self._param_writer = None
+        # with sim_opts["scratch_dir"], the dir on scratch the jobs of
+        # this run go in, and what writes them back
+        self._scratch_root = ""
+        self._write_back = None
+        # config or batch name -> (its dir on scratch, its final dir),
+        # until it's handed to the write back
+        self._staged = {}
+        # where the config dumps go with sim_opts["dedup_config"]
+        self._config_store = None
 
     def add_specific_opts(self, pre_cmd):
         """ this handles ["other_opts"]
-        :param pre_cmd: the command before adding simulator specific opts
-        :return: complete command with simulator specific opts
+        :param pre_cmd: argv list before adding simulator specific opts
+        :return: complete argv list with simulator specific opts
         """
         sst_opts = self.sim_opts["other_opts"]
         tgt = sst_opts["target_script"]
-        cmd = pre_cmd + " " + tgt
+        n_threads = int(self.sim_opts.get("threads", 1))
+        if n_threads > 1:
+            pre_cmd = pre_cmd + ["--num_threads", str(n_threads)]
+        cmd = pre_cmd + [tgt]
         return cmd
+
+    def get_constraint_functions(self):
+        """
+        num_nodes(topo, shape) for the num of nodes of a topology, and
+        gbps(bw) for a bandwidth like "1GB/s" in GB/s
+        """
+        return {"num_nodes": analysis.cal_num_nodes,
+                "gbps": gist.utils.convert_bw_to_gbps}
+
+    def get_job_cores(self):
+        """ each MPI rank of sst runs sim_opts["threads"] threads
+        :return: number of cores one sst job occupies
+        """
+        ranks = super(SSTSimulator, self).get_job_cores()
+        return ranks * int(self.sim_opts.get("threads", 1))
         
+    def estimate_job_costs(self):
+        """
+        expected run time of each config, so that the longest ones can
+        be launched first. Fitted on the summaries of previous sweeps
+        listed (or globbed) in sim_opts["history"], with the params in
+        sim_opts["cost_features"]. Only matters when running in parallel
+        :return: list of costs, same order as self.param_list
+        """
+        if self.sim_opts.get("max_parallel_jobs", 1) <= 1:
+            return [0] * len(self.param_list)
+        summary_files = []
+        for pattern in self.sim_opts.get("history", []):
+            summary_files += glob.glob(pattern)
+        features = self.sim_opts.get("cost_features", DEFAULT_COST_FEATURES)
+        return analysis.estimate_runtimes(self.param_list, features,
+                                          summary_files)
+
+    def get_job_timeout(self, param):
+        """
+        sim_opts["timeout"] is either the max seconds any job can run, or
+        scaled by a size param of each config, like
+        {"scale_by": "packets_to_send", "seconds_per_unit": 0.01, "min": 60}
+        :param param: param dict of the config
+        :return: max seconds the job of this config can run, None if no limit
+        """
+        timeout = self.sim_opts.get("timeout", None)
+        if isinstance(timeout, dict):
+            size = gist.utils.flatten_dict(param)[timeout["scale_by"]]
+            scaled = float(size) * timeout["seconds_per_unit"]
+            return max(scaled, timeout.get("min", 0))
+        return timeout
+
     def _add_other_opts_to_params(self):
         """
         add other options that will be passed to target script
@@ -422,53 +713,681 @@ class SSTSimulator(simulator.Simulator):
         """ SST specific run command
         :return: none
         """
+        if self.streamed:
+            self._run_streamed()
+            return
         self.cmd = self.assemble_command()
-        gist.utils.dump_param_summary(self.param_list, self.output_base_dir)
+        gist.utils.dump_param_summary(self.param_list, self.output_base_dir,
+                                      self.config_names)
         self._add_other_opts_to_params()
+        self._open_param_writer()
+        param_files = self._write_param_files(self.param_list,
+                                              self.config_names)
+        output_as_file = (self.sim_opts["output_as"] == "file")
+        job_cores = self.get_job_cores()
+        script_digest = ""
+        if self.cache_dir:
+            script_digest = gist.utils.get_file_digest(
+                self.other_opts["target_script"])
+        costs = self.estimate_job_costs()
+        batch_size = int(self.sim_opts.get("batch_size", 1))
+        to_batch = []
+        queued_keys = set()
+        self.jobs = []
+        self.cached_configs = []
+        self.config_index.add(self.config_names)
+        self._open_config_store()
+        self._start_staging()
+        for config_name, param, param_file, cost in zip(self.config_names,
+                                                         self.param_list,
+                                                         param_files, costs):
+            # make sub dir first
+            sub_dir = self.config_index.get_dir(config_name)
+            if self.resumed:
+                if is_sim_complete(os.path.join(sub_dir, "output.log")):
+                    self.manifest.set_state(config_name, "done")
+                    continue
+                _remove_dir(sub_dir)
+            if self.cache_dir:
+                key = gist.utils.get_param_hash(param,
+                                                self.sim_opts["sim_exe"],
+                                                script_digest)
+                run_dir = self._link_cache_entry(key, sub_dir, queued_keys)
+                if not run_dir:
+                    self.cached_configs.append(config_name)
+                    continue
+                queued_keys.add(key)
+            else:
+                run_dir = sub_dir
+                os.mkdir(sub_dir)
+            if batch_size > 1 and output_as_file and \
+                    param["ep_type"] == "ember_ep":
+                to_batch.append((config_name, param,
+                                 self._stage(config_name, run_dir), cost))
+                continue
+            run_dir = self._stage(config_name, run_dir)
+            cmd, log_name = self._get_job_cmd(param_file, run_dir)
+            self.jobs.append(runner.Job(
+                config_name, cmd, run_dir, cores=job_cores,
+                log_name=log_name,
+                parser=get_ep_specific_parser(param["ep_type"]),
+                timeout=self.get_job_timeout(param),
+                hang_timeout=self.sim_opts.get("hang_timeout", None),
+                cost=cost))
+        for i in range(0, len(to_batch), batch_size):
+            job, batch_file = self._get_batch_job(
+                to_batch[i:i + batch_size], job_cores)
+            self.jobs.append(job)
+            param_files.append(batch_file)
+        if self._param_writer:
+            self._param_writer.flush()
+        if self.logger.getEffectiveLevel() > 10:  # run cmd if not DEBUG
+            self._get_job_runner().run(self.jobs)
+            self._stop_staging()
+            self._report_exit_status()
+            if self.manifest:
+                self.manifest.dump()
+        self._stop_staging()
+        self._close_config_store()
+        for param_file in param_files:
+            self._remove_param_file(param_file)
+        self._close_param_writer()
+
+    def _start_staging(self):
+        """
+        with sim_opts["scratch_dir"], e.g. "/dev/shm", jobs write to a
+        dir of their own on scratch, which is written back to the output
+        dir in the background once they are done, see gist.staging. No
+        more jobs are launched while sim_opts["scratch_max_pending"]
+        finished dirs wait for it, max_parallel_jobs by default. Only
+        for jobs run on this box.
+        With sim_opts["compress"], e.g. "gzip", the log, stats and config
+        dump of a finished config are compressed right away, the readers
+        of this module read them either way, and with a config store the
+        config dump goes there instead. That's done in the background as
+        well, in place without scratch_dir, so that the jobs still
+        running aren't held up
+        """
+        scratch_dir = self.sim_opts.get("scratch_dir", "")
+        if scratch_dir and ("job_array" in self.sim_opts or
+                            "coordinator" in self.sim_opts):
+            self.logger.warning("scratch_dir is only used for jobs run on "
+                                "this box, writing to the output dir")
+            scratch_dir = ""
+        compress = self.sim_opts.get("compress", "")
+        if not (scratch_dir or compress or self._config_store):
+            return
+        if scratch_dir:
+            if not os.path.exists(scratch_dir):
+                os.makedirs(scratch_dir)
+            self._scratch_root = tempfile.mkdtemp(prefix="gist-",
+                                                  dir=scratch_dir)
+        max_pending = self.sim_opts.get(
+            "scratch_max_pending", self.sim_opts.get("max_parallel_jobs", 1))
+        self._write_back = staging.WriteBack(
+            max_pending, compress, _is_output_to_compress,
+            self._config_store, ["config.py"])
+
+    def _stage(self, name, run_dir):
+        """
+        :param name: name of a config or batch
+        :param run_dir: the dir the job of it would write to
+        :return: the dir the job is to write to, on scratch if staging
+        """
+        if not self._scratch_root:
+            return run_dir
+        scratch_dir = os.path.join(self._scratch_root, name)
+        os.mkdir(scratch_dir)
+        self._staged[name] = (scratch_dir, run_dir)
+        return scratch_dir
+
+    def _can_launch(self):
+        """ hold off new jobs while the write back is behind """
+        return not (self._write_back and self._write_back.is_full())
+
+    def _stop_staging(self):
+        """ wait for everything to be written back """
+        if not self._write_back:
+            return
+        write_back = self._write_back
+        self._write_back = None
+        try:
+            write_back.close()
+        finally:
+            if self._scratch_root:
+                shutil.rmtree(self._scratch_root, ignore_errors=True)
+            self._scratch_root = ""
+            self._staged = {}
+
+    def _open_config_store(self):
+        """
+        with sim_opts["dedup_config"] as well as dump_config, config
+        dumps are kept once per distinct content in config_store of the
+        output dir (of the cache dir if there is one, since that's where
+        the outputs are), and linked to from the config dirs. Configs
+        that only differ in e.g. the traffic pattern dump the same
+        model, so most dumps end up as links
+        """
+        if not self.sim_opts["dump_config"] or \
+                not self.sim_opts.get("dedup_config", False):
+            return
+        store_dir = os.path.join(self.cache_dir or self.output_base_dir,
+                                 "config_store")
+        self._config_store = gist.utils.DedupStore(
+            store_dir, self.sim_opts.get("compress", ""))
+
+    def _close_config_store(self):
+        """
+        write how much disk the config store saved into
+        config_dedup.json of the output dir
+        """
+        if not self._config_store:
+            return
+        report = self._config_store.get_report()
+        self._config_store = None
+        with open(os.path.join(self.output_base_dir, "config_dedup.json"),
+                  "w") as fp:
+            json.dump(report, fp, indent=2)
+            fp.close()
+        self.logger.info("%d config dumps, %d distinct, %.1f MB saved" %
+                         (report["files"], report["stored_files"],
+                          report["saved_bytes"] / 1048576.0))
+
+    def _get_output_dir(self, config_name):
+        """
+        :return: where the outputs of a config are right now
+        """
+        if config_name in self._staged:
+            return self._staged[config_name][0]
+        return self.config_index.get_dir(config_name)
+
+    def _finish_outputs(self, name, run_dir):
+        """
+        write back and compress the outputs of a finished config or
+        batch, see _start_staging
+        """
+        num_done = 0
+        if name in self._staged:
+            num_done = self._write_back.put(*self._staged.pop(name))
+        elif self._write_back and os.path.isdir(run_dir):
+            num_done = self._write_back.put(run_dir, run_dir)
+        if name not in self._finished:  # no key, or not streamed
+            return
+        if num_done:
+            self._written_keys.append((num_done, name))
+        else:
+            self._release_key(name)
+        self._release_written_keys()
+
+    def _open_param_writer(self):
+        """
+        with sim_opts["indexed_params"], the params of all the configs go
+        into one file in config_dir (or the temp dir), written in bulk,
+        and the target script is given a record of it to read with
+        gist.utils.load_param() instead of a file per config, which
+        saves a create and a delete per config on shared file systems
+        """
         config_d = self.sim_opts["config_dir"]
+        if self.sim_opts["config_file"] == "temp":
+            gist.utils.setup_tmp_config_dir(config_d)
+            config_d = tempfile.gettempdir()
+        if not self.sim_opts.get("indexed_params", False):
+            return
+        if not os.path.exists(config_d):
+            os.mkdir(config_d)
+        # unique, since shards of a sweep can share config_dir
+        fd, file_name = tempfile.mkstemp(prefix="params_", suffix=".jsonl",
+                                         dir=config_d)
+        os.close(fd)
+        self._param_writer = gist.utils.IndexedParamWriter(file_name)
+
+    def _write_param_files(self, param_list, names):
+        """
+        :return: list of what the target script is given for each param,
+                 a file name or a record of the indexed params file
+        """
+        if self._param_writer:
+            return [self._param_writer.write(p) for p in param_list]
         if self.sim_opts["config_file"] != "temp":
-            tmp_fp_list = gist.utils.get_param_files(config_d,
-                                                     self.param_list)
+            fp_list = gist.utils.get_param_files(self.sim_opts["config_dir"],
+                                                 param_list, names)
         else:
-            gist.utils.setup_tmp_config_dir(config_d)
-            tmp_fp_list = gist.utils.get_tmp_param_files(self.param_list)
-            
+            fp_list = gist.utils.get_tmp_param_files(param_list)
+        return [fp.name for fp in fp_list]
+
+    def _remove_param_file(self, param_file):
+        # records go away with the indexed params file
+        if not self._param_writer:
+            os.remove(param_file)
+
+    def _close_param_writer(self):
+        if self._param_writer:
+            self._param_writer.remove()
+            self._param_writer = None
+
+    def _run_streamed(self):
+        """
+        run() for a streamed sweep: each config is expanded, written,
+        run and put into config.csv and summary.csv in turn, and then
+        forgotten. Costs are not estimated, jobs are launched in the
+        order of the sweep space
+        """
+        self.cmd = self.assemble_command()
+        columns = sorted(self.space.get_flat_keys())
+        config_writer = gist.utils.CsvRowWriter(
+            os.path.join(self.output_base_dir, "config.csv"), columns)
+        if not self._is_histogram():
+            self._summary_writer = gist.utils.CsvRowWriter(
+                os.path.join(self.output_base_dir, "summary.csv"), columns,
+                more_columns=True)
+        self._open_param_writer()
+        self._open_config_store()
+        self._start_staging()
+        jobs = self._iter_jobs(config_writer)
+        if self.logger.getEffectiveLevel() > 10:  # run cmd if not DEBUG
+            job_runner = self._get_job_runner()
+            if isinstance(job_runner, runner.JobRunner):
+                num_jobs = job_runner.run_stream(jobs)
+            else:
+                self.logger.warning("only jobs run on this box are "
+                                    "streamed, making all the jobs now")
+                num_jobs = len(job_runner.run(list(jobs)))
+            self._stop_staging()
+            self.logger.info("%d jobs run, %d configs failed" %
+                             (num_jobs, self._num_failed))
+            if self.manifest:
+                self.manifest.dump()
+        else:
+            for _ in jobs:
+                pass
+        self._stop_staging()
+        self._release_written_keys(everything=True)
+        self._close_config_store()
+        config_writer.close()
+        if self._summary_writer:
+            self._summary_writer.close()
+            self._summary_writer = None
+        for param_file in self._param_files.values():
+            self._remove_param_file(param_file)
+        self._param_files = {}
+        self._close_param_writer()
+
+    def _iter_jobs(self, config_writer):
+        """
+        the streamed version of the loop in run(), makes the job of
+        each config only when the runner asks for it
+        :param config_writer: CsvRowWriter of config.csv
+        :return: generator of jobs
+        """
         output_as_file = (self.sim_opts["output_as"] == "file")
-        counter = 0
-        for tmp_fp in tmp_fp_list:
-            # make sub dir first
-            sub_dir = os.path.join(self.output_base_dir, "config_%d" % counter)
-            os.mkdir(sub_dir)
-            cmd = self.cmd
-            if self.sim_opts["dump_config"]:
-                cmd = cmd + " --output-config " + \
-                      os.path.join(sub_dir, "config.py")
-            if output_as_file:
-                cmd = cmd + " --model-options " + "\"%s %s\" >> %s" % \
-                      (tmp_fp.name, sub_dir, os.path.join(sub_dir, "output.log"))
+        job_cores = self.get_job_cores()
+        script_digest = ""
+        if self.cache_dir:
+            script_digest = gist.utils.get_file_digest(
+                self.other_opts["target_script"])
+        batch_size = int(self.sim_opts.get("batch_size", 1))
+        to_batch = []
+        for config_name, param in itertools.izip(self.config_names,
+                                                 self.param_list):
+            self._release_written_keys()
+            config_writer.write(config_name, gist.utils.flatten_dict(param))
+            param.update(self.other_opts)
+            self.config_index.add([config_name])
+            sub_dir = self.config_index.get_dir(config_name)
+            if self.resumed:
+                if is_sim_complete(os.path.join(sub_dir, "output.log")):
+                    self._write_summary_row(config_name, param)
+                    continue
+                _remove_dir(sub_dir)
+            if self.cache_dir:
+                key = gist.utils.get_param_hash(param,
+                                                self.sim_opts["sim_exe"],
+                                                script_digest)
+                run_dir = self._link_cache_entry(key, sub_dir,
+                                                 self._queued_keys)
+                if not run_dir:
+                    if key in self._queued_keys:  # wait for the other one
+                        self._dup_configs.setdefault(
+                            self._queued_keys[key], []).append(
+                                (config_name, param))
+                    else:
+                        self._write_summary_row(config_name, param)
+                    continue
+                self._queued_keys[key] = config_name
+                self._config_keys[config_name] = key
             else:
-                cmd = cmd + " " + tmp_fp.name
-            self.logger.debug("calling: %s" % cmd)
-            if self.logger.getEffectiveLevel() > 10:  # run cmd if not DEBUG
-                call(cmd, shell=True)
-            os.remove(tmp_fp.name)
-            counter += 1
+                run_dir = sub_dir
+                os.mkdir(sub_dir)
+            self._running_params[config_name] = param
+            if batch_size > 1 and output_as_file and \
+                    param["ep_type"] == "ember_ep":
+                to_batch.append((config_name, param,
+                                 self._stage(config_name, run_dir), 0))
+                if len(to_batch) == batch_size:
+                    yield self._get_streamed_batch_job(to_batch, job_cores)
+                    to_batch = []
+                continue
+            param_file = self._write_param_files([param], [config_name])[0]
+            if self._param_writer:
+                self._param_writer.flush()
+            self._param_files[config_name] = param_file
+            run_dir = self._stage(config_name, run_dir)
+            cmd, log_name = self._get_job_cmd(param_file, run_dir)
+            yield runner.Job(
+                config_name, cmd, run_dir, cores=job_cores,
+                log_name=log_name,
+                parser=get_ep_specific_parser(param["ep_type"]),
+                timeout=self.get_job_timeout(param),
+                hang_timeout=self.sim_opts.get("hang_timeout", None))
+        if to_batch:
+            yield self._get_streamed_batch_job(to_batch, job_cores)
+
+    def _get_streamed_batch_job(self, batch, job_cores):
+        job, batch_file = self._get_batch_job(batch, job_cores)
+        if self._param_writer:
+            self._param_writer.flush()
+        self._param_files[job.name] = batch_file
+        return job
+
+    def _finish_streamed(self, config_name):
+        """
+        put a config that is done running into summary.csv and forget
+        about it, the configs waiting for its result follow once its
+        outputs are final, see _release_key
+        """
+        param = self._running_params.pop(config_name)
+        results = self.results.pop(config_name, None)
+        info = self.job_info.pop(config_name, {})
+        if info.get("status", "done") != "done":
+            self._num_failed += 1
+        # read before they are written back
+        sub_dir = self._get_output_dir(config_name)
+        self._write_summary_row(config_name, param, results, info, sub_dir)
+        if not self._summary_writer and os.path.isdir(sub_dir):
+            _write_job_info(sub_dir, info)
+            for key in info:
+                if key not in self._job_info_header:
+                    self._job_info_header.append(key)
+        if config_name in self._config_keys:
+            self._finished[config_name] = (results, info)
+
+    def _release_written_keys(self, everything=False):
+        """
+        release the keys of the configs that are done being written back
+        :param everything: release them all, once nothing is written
+                           back anymore
+        """
+        while self._written_keys and \
+                (everything or not self._write_back or
+                 self._written_keys[0][0] <= self._write_back.num_done):
+            self._release_key(self._written_keys.popleft()[1])
+
+    def _release_key(self, config_name):
+        """
+        with the outputs of a config final, put the configs with the
+        same hash key into summary.csv, and forget the key, so that the
+        next config with it finds the outputs in the cache and memory
+        doesn't grow with the sweep
+        """
+        del self._queued_keys[self._config_keys.pop(config_name)]
+        results, info = self._finished.pop(config_name)
+        for dup_name, dup_param in self._dup_configs.pop(config_name, []):
+            self._write_summary_row(dup_name, dup_param, results, info)
+
+    def _write_summary_row(self, config_name, param, results=None,
+                           info=None, sub_dir=""):
+        """
+        :param results: results of the config, read from its output dir
+                        if not given
+        :param info: job_info of the config, if it was run
+        :param sub_dir: output dir of the config, if not the final one
+        """
+        if not self._summary_writer:
+            return
+        sub_dir = sub_dir or self.config_index.get_dir(config_name)
+        log_name = os.path.join(sub_dir, "output.log")
+        if not gist.utils.find_output_file(log_name):
+            results = results or {}
+        elif param["ep_type"] != "ember_ep":
+            results = get_accu_stats(self.stats, sub_dir)
+        elif results is None:
+            results = get_ember_output_from_file(log_name)
+        row = gist.utils.flatten_dict(param)
+        row.update(results)
+        row.update(info or {})
+        self._summary_writer.write(config_name, row)
+
+    def _is_histogram(self):
+        return self.param_list[0]["ep_type"] != "ember_ep" and \
+            "sst.HistogramStatistic" in self.stats_params["stats_type"]
+
+    def _get_job_runner(self):
+        """
+        jobs run on this box, unless sim_opts["coordinator"] is given,
+        e.g. {"host": "", "port": 5000}, in which case they are handed
+        out to workers started with "python -m gist.distrib" on any
+        number of hosts, or sim_opts["job_array"] is given, e.g.
+        {"submit_cmd": "sbatch", "header": ["#SBATCH -t 1:00:00"],
+        "max_wait": 7200}, in which case they are submitted to the batch
+        scheduler as job arrays, see cluster.ArraySubmitter
+        :return: an object that has run(jobs)
+        """
+        if "job_array" in self.sim_opts:
+            opts = dict(self.sim_opts["job_array"])
+            work_dir = os.path.join(self.output_base_dir, "job_array")
+            return cluster.ArraySubmitter(work_dir,
+                                          callback=self._on_job_update,
+                                          **opts)
+        if "coordinator" in self.sim_opts:
+            opts = self.sim_opts["coordinator"]
+            return distrib.Coordinator(
+                opts.get("host", ""), opts.get("port", 0),
+                heartbeat_timeout=opts.get("heartbeat_timeout", 60),
+                callback=self._on_job_update)
+        max_jobs = self.sim_opts.get("max_parallel_jobs", 1)
+        max_cores = self.sim_opts.get("max_cores", None)
+        return runner.JobRunner(max_jobs, max_cores,
+                                callback=self._on_job_update,
+                                can_launch=self._can_launch)
+
+    def _get_job_cmd(self, param_file, run_dir):
+        """
+        :param param_file: file with the params for the target script
+        :param run_dir: dir the outputs of the job go to
+        :return: argv list of the job, and the log its stdout goes to
+        """
+        cmd = list(self.cmd)
+        if self.sim_opts["dump_config"]:
+            cmd += ["--output-config", os.path.join(run_dir, "config.py")]
+        log_name = ""
+        if self.sim_opts["output_as"] == "file":
+            cmd += ["--model-options", "%s %s" % (param_file, run_dir)]
+            log_name = os.path.join(run_dir, "output.log")
+        else:
+            cmd.append(param_file)
+        self.logger.debug("calling: %s" % gist.utils.cmd_to_str(cmd))
+        return cmd, log_name
+
+    def _get_batch_job(self, batch, job_cores):
+        """
+        run a bunch of small ember configs in one sst run, since for
+        those starting sst and building the model takes longer than the
+        simulation. The param file of a batch holds a list of param dicts
+        instead of one, and the target script is expected to put them all
+        in the same model, one after another like the sst built-in sweeps.
+        The log of the batch is split into the config dirs when it's done
+        :param batch: list of (config name, param, run dir, cost)
+        :param job_cores: cores of the job
+        :return: the job, and the param file (or record) of the batch
+        """
+        batch_name = "batch_%s" % batch[0][0].split("_")[1]
+        self.config_index.add([batch_name])
+        batch_dir = self.config_index.get_dir(batch_name)
+        _remove_dir(batch_dir)
+        os.mkdir(batch_dir)
+        batch_dir = self._stage(batch_name, batch_dir)
+        params = [b[1] for b in batch]
+        if self._param_writer:
+            batch_file = self._param_writer.write(params)
+        else:
+            batch_file = gist.utils.get_tmp_param_files([params])[0].name
+        cmd, log_name = self._get_job_cmd(batch_file, batch_dir)
+        timeouts = [self.get_job_timeout(b[1]) for b in batch]
+        if None in timeouts:
+            timeout = None
+        else:
+            timeout = sum(timeouts)
+        job = runner.Job(
+            batch_name, cmd, batch_dir, cores=job_cores, log_name=log_name,
+            timeout=timeout,
+            hang_timeout=self.sim_opts.get("hang_timeout", None),
+            cost=sum(b[3] for b in batch))
+        self._batches[batch_name] = [(b[0], b[2]) for b in batch]
+        return job, batch_file
+
+    def _on_job_update(self, job):
+        """
+        keep the manifest up to date, and keep the results parsed from
+        the output of a job as soon as it exits
+        """
+        if job.name in self._batches:
+            self._on_batch_update(job)
+        elif job.returncode is None:
+            self._set_manifest_state(job.name, "running")
+        else:
+            self.results[job.name] = job.results
+            self.job_info[job.name] = self._get_job_info(job)
+            self._set_manifest_state(job.name, job.status)
+            if self.streamed:
+                self._finish_streamed(job.name)
+            self._finish_outputs(job.name, job.sub_dir)
+        if self.streamed and job.returncode is not None:
+            self._remove_param_file(self._param_files.pop(job.name))
+
+    def _on_batch_update(self, job):
+        """
+        same as _on_job_update but for each config in a batch, which
+        only counts as done if its part of the batch log is complete
+        """
+        members = self._batches[job.name]
+        logs = [os.path.join(run_dir, "output.log")
+                for config_name, run_dir in members]
+        if job.returncode is not None:
+            split_ember_log(job.log_name, logs)
+        for (config_name, run_dir), log in zip(members, logs):
+            if job.returncode is None:
+                self._set_manifest_state(config_name, "running")
+                continue
+            status = job.status
+            if is_sim_complete(log):
+                self.results[config_name] = get_ember_output_from_file(log)
+            elif status == "done":
+                status = "failed"
+            info = self._get_job_info(job)
+            info["status"] = status
+            info["batch"] = job.name
+            self.job_info[config_name] = info
+            self._set_manifest_state(config_name, status)
+            if self.streamed:
+                self._finish_streamed(config_name)
+            self._finish_outputs(config_name, run_dir)
+        if job.returncode is None:
+            return
+        self._finish_outputs(job.name, job.sub_dir)
+        if self.streamed:
+            del self._batches[job.name]
+
+    def _set_manifest_state(self, config_name, state):
+        if not self.manifest:
+            return
+        # make sure failures hit the disk right away
+        force = state not in ("running", "done")
+        self.manifest.set_state(config_name, state, force=force)
+
+    def _get_job_info(self, job):
+        """
+        what it cost to simulate a config, which ends up in summary.csv
+        :param job: finished job
+        :return: OrderedDict of column -> value
+        """
+        info = OrderedDict([("status", job.status)])
+        usage = job.usage
+        if usage:
+            info["wall_time(s)"] = "%.3f" % usage["wall_time"]
+            info["user_time(s)"] = "%.3f" % usage["user_time"]
+            info["sys_time(s)"] = "%.3f" % usage["sys_time"]
+            info["max_rss(MB)"] = "%.1f" % (usage["max_rss"] / 1024.0)
+        if self.sim_opts["mpi"]:
+            info["mpi_ranks"] = int(self.sim_opts["mpi_opts"]["n"])
+        else:
+            info["mpi_ranks"] = 1
+        return info
+
+    def _link_cache_entry(self, key, sub_dir, queued_keys):
+        """
+        link sub_dir to the cache entry of key, and get the entry ready
+        for a new run unless it already has a complete result or another
+        config of this run has the same key
+        :param key: hash key of the config
+        :param sub_dir: config_N dir of this run
+        :param queued_keys: keys already being run by this run, any
+                            container, the caller adds key to it if a
+                            dir is returned
+        :return: dir that the simulation should write to, "" if no need
+                 to run it
+        """
+        entry = os.path.join(self.cache_dir, key)
+        os.symlink(os.path.relpath(entry, os.path.dirname(sub_dir)), sub_dir)
+        if key in queued_keys:
+            return ""
+        if is_sim_complete(os.path.join(entry, "output.log")):
+            self.logger.info("%s is cached in %s" % (sub_dir, entry))
+            return ""
+        if os.path.exists(entry):  # leftover of a run that didn't finish
+            shutil.rmtree(entry)
+        os.mkdir(entry)
+        return entry
+
+    def _report_exit_status(self):
+        """
+        log how many jobs failed and keep the exit status of each job
+        in self.exit_status, keyed by config name
+        """
+        self.exit_status = OrderedDict()
+        for job in self.jobs:
+            self.exit_status[job.name] = job.returncode
+        failed = runner.get_failed_jobs(self.jobs)
+        if failed:
+            self.logger.error("%d out of %d jobs failed: %s" %
+                              (len(failed), len(self.jobs),
+                               " ".join(job.name for job in failed)))
+        else:
+            self.logger.info("all %d jobs finished" % len(self.jobs))
+        if self.cached_configs:
+            self.logger.info("%d configs reused from cache" %
+                             len(self.cached_configs))
 
     def compile_output(self):
+        if self.streamed and not self._is_histogram():
+            return  # summary.csv is written while running
+        job_info = self.job_info
+        if self.streamed:  # not kept, see _finish_streamed
+            job_info = JobInfoFiles(self.config_index, self._job_info_header)
         if self.param_list[0]["ep_type"] != "ember_ep":
             if "sst.HistogramStatistic" in self.stats_params["stats_type"]:
-                compile_histogram_outputs(self.stats, self.output_base_dir)
+                compile_histogram_outputs(self.stats, self.output_base_dir,
+                                          job_info=job_info)
             else:  # accumulate type
-                compile_accu_output(self.stats, self.output_base_dir)
+                compile_accu_output(self.stats, self.output_base_dir,
+                                    job_info=job_info)
         else:
             self.compile_ember_output()
 
     def compile_general_output(self):
-        cnt = 0
         dict_list = []
         ep_type = self.param_list[0]["ep_type"] != "ember_ep"
-        for param in self.param_list:
-            sub_dir = os.path.join(self.output_base_dir, "config_%d" % cnt)
+        for config_name, param in zip(self.config_names, self.param_list):
+            sub_dir = self.config_index.get_dir(config_name)
             log_name = os.path.join(sub_dir, "output.log")
             results = get_ep_specific_output(ep_type, log_name)
             d = param.copy()
@@ -477,10 +1396,9 @@ class SSTSimulator(simulator.Simulator):
             keys, vals = gist.utils.get_key_val_in_nested_dict(d)
             d = dict(zip(keys, vals))
             dict_list.append(d)
-            cnt += 1
-        self.df = pd.DataFrame(dict_list)
+        self.df = pd.DataFrame(dict_list, index=self.config_names)
         output_name = os.path.join(self.output_base_dir, "summary.csv")
-        self.df.to_csv(output_name)
+        self.df.to_csv(output_name, index_label="configs")
 
     def compile_ember_output(self):
         """
@@ -488,17 +1406,22 @@ class SSTSimulator(simulator.Simulator):
         feeling like a lot easier lol
         :return: None
         """
-        cnt = 0
         dict_list = []
-        for param in self.param_list:
-            sub_dir = os.path.join(self.output_base_dir, "config_%d" % cnt)
-            log_name = os.path.join(sub_dir, "output.log")
-            results = get_ember_output_from_file(log_name)
+        for config_name, param in zip(self.config_names, self.param_list):
+            if config_name in self.results:
+                results = self.results[config_name]
+            else:  # not run by this simulator, e.g. cached
+                sub_dir = self.config_index.get_dir(config_name)
+                log_name = os.path.join(sub_dir, "output.log")
+                results = {}
+                # a config of a killed batch or job may have no log
+                if gist.utils.find_output_file(log_name):
+                    results = get_ember_output_from_file(log_name)
             d = param.copy()
             d.update(results)
+            d.update(self.job_info.get(config_name, {}))
             dict_list.append(gist.utils.flatten_dict(d))
-            cnt += 1
-        self.df = pd.DataFrame(dict_list)
+        self.df = pd.DataFrame(dict_list, index=self.config_names)
         output_name = os.path.join(self.output_base_dir, "summary.csv")
-        self.df.to_csv(output_name)
+        self.df.to_csv(output_name, index_label="configs")
 
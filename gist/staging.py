@@ -0,0 +1,120 @@
+""" Run simulations on node-local scratch and write them back later
+Simulators write their logs and stats as they go, which stalls them
+when the output dir is on NFS. With a scratch dir, e.g. /dev/shm or a
+local SSD, each job writes to its own dir there instead, and once it is
+done a background thread moves (and maybe compresses) the dir to where
+it belongs, while the next jobs run. Without scratch, the same thread
+can still compress the outputs in place, which would otherwise hold up
+whatever launches the jobs.
+Only a bounded number of finished dirs should wait to be written back:
+while is_full(), no more jobs are to be launched, so that scratch
+doesn't fill up. Handing over a dir never blocks, the jobs still running
+keep going and their dirs are taken too.
+"""
+import os
+import shutil
+import threading
+from Queue import Queue
+
+import gist.utils
+
+
+class WriteBack(object):
+    """
+    Moves finished dirs from scratch to their final place, in a
+    background thread
+    :param max_pending: num of dirs waiting to be written back that
+                        makes it full
+    :param compress: compression method of the outputs, see
+                     gist.utils.compress_file, "" for none
+    :param should_compress: function that takes a file name and tells
+                            if the file is to be compressed
+    :param dedup_store: gist.utils.DedupStore the files named in
+                        dedup_names go to instead, if given
+    :param dedup_names: see dedup_store
+    """
+    def __init__(self, max_pending=1, compress="", should_compress=None,
+                 dedup_store=None, dedup_names=()):
+        self.compress = compress
+        self.should_compress = should_compress or (lambda name: True)
+        self.dedup_store = dedup_store
+        self.dedup_names = set(dedup_names)
+        self.errors = []
+        # dirs handed over, and dirs done with, whether or not they made
+        # it, which are the first num_done of them
+        self.num_put = 0
+        self.num_done = 0
+        self.logger = gist.utils.get_logger()
+        self.max_pending = max(int(max_pending), 1)
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._write_back_all)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, scratch_dir, final_dir):
+        """
+        write back a dir, taken even if full
+        :param scratch_dir: dir on scratch, removed once written back
+        :param final_dir: where its files go, made if not there yet,
+                          files already in it are replaced. If it is
+                          scratch_dir, the files are only compressed
+        :return: what num_done gets to once the dir is done with
+        """
+        self._queue.put((scratch_dir, final_dir))
+        self.num_put += 1
+        return self.num_put
+
+    def is_full(self):
+        """
+        :return: True if max_pending dirs are waiting to be written back
+        """
+        return self._queue.qsize() >= self.max_pending
+
+    def close(self):
+        """
+        wait for all the dirs to be written back
+        :raise IOError: if any of them couldn't be
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self.errors:
+            raise IOError("%d dirs were not written back, first one: %s" %
+                          (len(self.errors), self.errors[0]))
+
+    def _write_back_all(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self._write_back(*item)
+            except (IOError, OSError) as e:
+                # keep going, or it'd be full forever
+                self.logger.error("writing back %s failed: %s" %
+                                  (item[0], e))
+                self.errors.append("%s (%s)" % (item[0], e))
+            self.num_done += 1
+
+    def _write_back(self, scratch_dir, final_dir):
+        in_place = (scratch_dir == final_dir)
+        if not os.path.isdir(final_dir):
+            os.makedirs(final_dir)
+        for name in os.listdir(scratch_dir):
+            src = os.path.join(scratch_dir, name)
+            if self.dedup_store and name in self.dedup_names:
+                self.dedup_store.add(src, os.path.join(final_dir, name))
+                continue
+            if self.compress and os.path.isfile(src) and \
+                    self.should_compress(name):
+                src = gist.utils.compress_file(src, self.compress)
+            if in_place:
+                continue
+            dst = os.path.join(final_dir, os.path.basename(src))
+            if os.path.isdir(dst) and not os.path.islink(dst):
+                shutil.rmtree(dst)
+            elif os.path.lexists(dst):
+                os.remove(dst)
+            shutil.move(src, dst)
+        if not in_place:
+            os.rmdir(scratch_dir)
+        self.logger.debug("wrote back %s to %s" % (scratch_dir, final_dir))
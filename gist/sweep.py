@@ -0,0 +1,568 @@
+""" The space of configs a sweep covers
+model_params describes a cross product of nested axes, and the number of
+configs grows fast, so instead of building every param dict up front the
+space maps an index to its param dict on demand. The order is the same
+as itertools.product over the keys of each dict, last key fastest, so
+config_N means the same param set no matter how the space is walked.
+
+A group of params that only makes sense for some values of another
+param, e.g. the shape of a torus, says so with a "when" key, either as
+a dict value or as items of a list of dicts:
+    "topo_type": ["torus", "fattree"],
+    "topo_params": [
+        {"when": {"topo_type": "torus"}, "torus:shape": ["4x4", "8x8"]},
+        {"when": {"topo_type": "fattree"}, "fattree:shape": ["4,4:4"]}
+    ]
+gives 3 configs instead of 6. "when" can only name params next to it
+in the same dict, and takes a value or a list of values. A group whose
+"when" doesn't match is left out, and so is the key if nothing is left
+
+Combinations that can't work are ruled out with "constraints" at the
+top of model_params, python expressions over the params that have to be
+true, e.g.
+    "constraints": ["num_nodes(topo_type, torus_shape) == jobsize"]
+where a param is named by its key with anything but letters, digits and
+_ turned into _. Walking the space, a constraint is checked as soon as
+every param it uses has a value, so a whole block of configs is skipped
+at once. Configs keep their index in the space without constraints.
+
+Params that go together, e.g. link_bw and link_lat, are varied in lock
+step by a "zip" group, one axis for all of them instead of one each:
+    "zip": {"link_bw": ["1GB/s", "4GB/s"], "link_lat": ["10ns", "20ns"]}
+gives 2 configs, ("1GB/s", "10ns") and ("4GB/s", "20ns"), with link_bw
+and link_lat in the dict the group is in. "zip" takes a list of such
+groups too, the lists of a group must have the same length.
+"""
+import __builtin__
+import bisect
+import itertools
+import random
+import re
+
+WHEN = "when"
+CONSTRAINTS = "constraints"
+ZIP = "zip"
+
+
+class _Axis(object):
+    """
+    one key of a dict in model_params
+    a list of values, a dict (a sub space) or a list of dicts (the sub
+    spaces one after another), anything else is a single value
+    If zipped, value is a zip group, and each value of the axis is a
+    dict of one item of every list in the group, to be merged into the
+    dict of the axis instead of going under a key
+    """
+    def __init__(self, value, zipped=False):
+        self.values = None
+        self.spaces = None
+        self.offsets = None
+        self.zipped = zipped
+        if zipped:
+            lengths = set(len(v) if isinstance(v, list) else -1
+                          for v in value.itervalues())
+            if len(lengths) != 1 or -1 in lengths:
+                raise ValueError("a zip group needs lists of the same "
+                                 "length, got %s" % value)
+            keys = list(value)
+            self.values = [dict(zip(keys, items))
+                           for items in zip(*[value[k] for k in keys])]
+        elif isinstance(value, dict):
+            self.spaces = [SweepSpace(value, nested=True)]
+        elif isinstance(value, list) and value and \
+                all(isinstance(item, dict) for item in value):
+            self.spaces = [SweepSpace(item, nested=True) for item in value]
+        elif isinstance(value, list):
+            self.values = value
+        else:
+            self.values = [value]
+        if self.spaces is not None:
+            # index where each sub space starts
+            self.offsets = []
+            size = 0
+            for space in self.spaces:
+                self.offsets.append(size)
+                size += len(space)
+            self.size = size
+        else:
+            self.size = len(self.values)
+
+    def get(self, index):
+        if self.values is not None:
+            return self.values[index]
+        # the last sub space starting at or before index, which skips
+        # empty ones
+        i = bisect.bisect_right(self.offsets, index) - 1
+        return self.spaces[i][index - self.offsets[i]]
+
+    def walk(self, key, flat, check):
+        """
+        :param key: key of the axis
+        :param flat: flat params with a value so far
+        :param check: called with flat params, False if they can't work
+        :return: generator of (digit, flat params with this axis too) of
+                 each value of the axis that passes check
+        """
+        if self.spaces is not None:
+            for offset, space in zip(self.offsets, self.spaces):
+                for index, sub_flat in space.walk(flat, check):
+                    yield offset + index, sub_flat
+            return
+        for digit, value in enumerate(self.values):
+            sub_flat = dict(flat)
+            if isinstance(value, dict):
+                sub_flat.update(_flatten(value))
+            else:
+                sub_flat[key] = value
+            if check(sub_flat):
+                yield digit, sub_flat
+
+
+def _flatten(nested_d):
+    """
+    same as utils.flatten_dict
+    """
+    flat = {}
+    for key, value in nested_d.iteritems():
+        if isinstance(value, dict):
+            flat.update(_flatten(value))
+        else:
+            flat[key] = value
+    return flat
+
+
+def get_var_name(key):
+    """
+    :return: name of a param in constraints
+    """
+    return re.sub(r"\W", "_", key)
+
+
+def _matches(when, assignment):
+    for key, value in when.iteritems():
+        allowed = value if isinstance(value, list) else [value]
+        if assignment[key] not in allowed:
+            return False
+    return True
+
+
+def _without_when(group):
+    return dict((k, v) for k, v in group.iteritems() if k != WHEN)
+
+
+def _get_cond_keys(param_dict):
+    """
+    :return: sorted keys of param_dict that a group in it depends on
+    """
+    cond_keys = set()
+    for value in param_dict.itervalues():
+        groups = value if isinstance(value, list) else [value]
+        for group in groups:
+            if isinstance(group, dict) and WHEN in group:
+                for key in group[WHEN]:
+                    if key not in param_dict:
+                        raise ValueError("%s in \"when\" is not a param "
+                                         "next to it" % key)
+                    cond_keys.add(key)
+    return sorted(cond_keys)
+
+
+def _split_by_conds(param_dict, cond_keys):
+    """
+    :return: one param dict per combination of values of cond_keys, with
+             that combination and only the groups that apply to it
+    """
+    values = [param_dict[key] if isinstance(param_dict[key], list)
+              else [param_dict[key]] for key in cond_keys]
+    parts = []
+    for combo in itertools.product(*values):
+        assignment = dict(zip(cond_keys, combo))
+        part = {}
+        for key, value in param_dict.iteritems():
+            if key in assignment:
+                part[key] = [assignment[key]]
+            elif isinstance(value, dict) and WHEN in value:
+                if _matches(value[WHEN], assignment):
+                    part[key] = _without_when(value)
+            elif isinstance(value, list) and \
+                    any(isinstance(item, dict) and WHEN in item
+                        for item in value):
+                groups = [_without_when(item) for item in value
+                          if WHEN not in item or
+                          _matches(item[WHEN], assignment)]
+                if groups:
+                    part[key] = groups
+            else:
+                part[key] = value
+        parts.append(part)
+    return parts
+
+
+class SweepSpace(object):
+    """
+    All the param sets of a model_params dict, indexed like a list but
+    without building it, space[i] decodes i digit by digit with the
+    size of each axis as the radix.
+    len() and [] ignore constraints, iterating or iter_indices() only
+    goes through the configs that meet them
+    :param param_dict: model_params, or any dict nested like it
+    :param functions: dict of name -> function that constraints can call
+    :param nested: True for the spaces of dicts inside model_params
+    """
+    def __init__(self, param_dict, functions=None, nested=False):
+        self.keys = []
+        self.axes = []
+        self.functions = functions or {}
+        self.constraints = []
+        if CONSTRAINTS in param_dict:
+            if nested:
+                raise ValueError("constraints only go at the top of "
+                                 "model_params")
+            for expr in param_dict[CONSTRAINTS]:
+                self.constraints.append(
+                    (expr, compile(expr, "<constraint>", "eval")))
+            param_dict = dict((k, v) for k, v in param_dict.iteritems()
+                              if k != CONSTRAINTS)
+        # with conditional groups, the space is the spaces of each
+        # combination of the params they depend on, one after another
+        self.parts = None
+        cond_keys = _get_cond_keys(param_dict)
+        if cond_keys:
+            self.parts = _Axis(_split_by_conds(param_dict, cond_keys))
+            self.size = self.parts.size
+            return
+        # the order of a dict filled key by key, which is what config_N
+        # has always meant, and not always the order of param_dict
+        ordered = {}
+        for key in param_dict:
+            ordered[key] = None
+        for key in ordered:
+            value = param_dict[key]
+            if key != ZIP:
+                self.keys.append(key)
+                self.axes.append(_Axis(value))
+                continue
+            for group in (value if isinstance(value, list) else [value]):
+                self.keys.append(key)
+                self.axes.append(_Axis(group, zipped=True))
+        self.size = 1
+        for axis in self.axes:
+            self.size *= axis.size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("config %d out of %d" % (index, self.size))
+        if self.parts is not None:
+            return self.parts.get(index)
+        params = {}
+        for key, axis in reversed(zip(self.keys, self.axes)):
+            index, digit = divmod(index, axis.size)
+            if axis.zipped:
+                params.update(axis.get(digit))
+            else:
+                params[key] = axis.get(digit)
+        return params
+
+    def __iter__(self):
+        for i in self.iter_indices():
+            yield self[i]
+
+    def walk(self, flat, check):
+        """
+        go through the space depth first, skipping every config below
+        a partial one that doesn't pass check
+        :param flat: flat params with a value outside this space
+        :param check: called with flat params, False if they can't work
+        :return: generator of (index, flat params)
+        """
+        if self.parts is not None:
+            return self.parts.walk(None, flat, check)
+        return self._walk_axes(0, 0, flat, check)
+
+    def _walk_axes(self, i, index, flat, check):
+        if i == len(self.axes):
+            yield index, flat
+            return
+        axis = self.axes[i]
+        for digit, sub_flat in axis.walk(self.keys[i], flat, check):
+            for item in self._walk_axes(i + 1, index * axis.size + digit,
+                                        sub_flat, check):
+                yield item
+
+    def check(self, flat, complete=False):
+        """
+        :param flat: flat params, maybe only some of them
+        :param complete: if True, flat has all the params, and a
+                         constraint using a name that isn't there is
+                         an error instead of something to check later
+        :return: False if a constraint is false
+        """
+        namespace = dict(self.functions)
+        for key, value in flat.iteritems():
+            namespace[get_var_name(key)] = value
+        for expr, code in self.constraints:
+            try:
+                ok = eval(code, {"__builtins__": __builtin__}, namespace)
+            except NameError as e:
+                if complete:
+                    raise ValueError("constraint %s: %s" % (expr, e))
+                continue
+            if not ok:
+                return False
+        return True
+
+    def is_valid(self, index):
+        """
+        :return: True if config index meets the constraints
+        """
+        if not self.constraints:
+            return True
+        return self.check(_flatten(self[index]), complete=True)
+
+    def get_strides(self):
+        """
+        :return: list of (size, stride) of the axes, where stride is the
+                 index step of one step on the axis. An axis that is a
+                 dict, e.g. ep_params, is its own axes instead, down to
+                 the params in it. The whole space (or a list of dicts)
+                 is one axis if it has conditional groups
+        """
+        if self.parts is not None:
+            return [(self.size, 1)]
+        strides = []
+        stride = 1
+        for axis in reversed(self.axes):
+            if axis.spaces is not None and len(axis.spaces) == 1:
+                # a digit of the axis is an index of its space
+                for size, sub_stride in reversed(axis.spaces[0].get_strides()):
+                    strides.append((size, sub_stride * stride))
+            else:
+                strides.append((axis.size, stride))
+            stride *= axis.size
+        return strides[::-1]
+
+    def iter_indices(self, shard=0, num_shards=1):
+        """
+        :param shard: see get_shard
+        :param num_shards: see get_shard
+        :return: generator of the indices of the configs in the shard
+                 that meet the constraints
+        """
+        if not self.constraints:
+            for index in self.get_shard(shard, num_shards):
+                yield index
+            return
+        for index, flat in self.walk({}, self.check):
+            if index % num_shards == shard and \
+                    self.check(flat, complete=True):
+                yield index
+
+    def get_flat_keys(self):
+        """
+        :return: all the keys a param dict of this space has once
+                 flattened by utils.flatten_dict, without building any
+        """
+        keys = []
+        if self.parts is not None:
+            for space in self.parts.spaces or []:
+                for key in space.get_flat_keys():
+                    if key not in keys:
+                        keys.append(key)
+            return keys
+        for key, axis in zip(self.keys, self.axes):
+            if axis.spaces is not None:
+                sub_keys = []
+                for space in axis.spaces:
+                    sub_keys += space.get_flat_keys()
+            else:
+                sub_keys = []
+                for value in axis.values:
+                    if isinstance(value, dict):
+                        sub_keys += SweepSpace(value,
+                                               nested=True).get_flat_keys()
+                    elif key not in sub_keys:
+                        sub_keys.append(key)
+            for sub_key in sub_keys:
+                if sub_key not in keys:
+                    keys.append(sub_key)
+        return keys
+
+    def get_shard(self, shard, num_shards):
+        """
+        indices of one of num_shards disjoint slices of the space. Every
+        num_shards-th config goes to the same shard, so shards get a mix
+        of cheap and costly configs instead of one end of an axis each
+        :param shard: which slice, 0 to num_shards - 1
+        :param num_shards: num of slices
+        :return: xrange of indices
+        """
+        if not 0 <= shard < num_shards:
+            raise ValueError("shard %d out of %d" % (shard, num_shards))
+        return xrange(shard, self.size, num_shards)
+
+
+class ConfigIndices(object):
+    """
+    indices of the configs of a shard of a space that meet its
+    constraints, without keeping them. If there are constraints, len()
+    and [] walk the space, len() only once
+    """
+    def __init__(self, space, shard=0, num_shards=1):
+        self.space = space
+        self.shard = shard
+        self.num_shards = num_shards
+        self._len = None
+        if not space.constraints:
+            self._len = len(space.get_shard(shard, num_shards))
+
+    def __len__(self):
+        if self._len is None:
+            self._len = sum(1 for _ in self)
+        return self._len
+
+    def __getitem__(self, i):
+        if not self.space.constraints:
+            return self.space.get_shard(self.shard, self.num_shards)[i]
+        for index in itertools.islice(self, i, None):
+            return index
+        raise IndexError("config %d out of %d" % (i, len(self)))
+
+    def __iter__(self):
+        return self.space.iter_indices(self.shard, self.num_shards)
+
+
+class SampledIndices(object):
+    """
+    indices of num configs drawn from a space, the same ones every time
+    for the same seed, and never the same config twice.
+    "random" draws uniformly, "lhs" makes Latin hypercubes of block
+    configs each (num by default): in a cube, every axis (each param of
+    the dicts in the space too, see SweepSpace.get_strides) is split into
+    block equal ranges and each range is drawn from once.
+    The draws are one endless sequence, so start skips the first ones,
+    e.g. start=100 with the seed of an earlier run of num=100 gives 100
+    more configs, none of them run before (for "lhs" block has to stay
+    what it was, and num is a good block for the runs that follow)
+    Configs that don't meet the constraints are skipped. Once the draws
+    keep missing, the configs not drawn yet follow in order, so if there
+    are fewer configs than start + num, it's all of them, and a run that
+    goes past the end still only gets the ones earlier runs didn't
+    """
+    max_misses = 10000
+
+    def __init__(self, space, method="random", num=100, seed=0, start=0,
+                 block=0, shard=0, num_shards=1):
+        if method not in ("random", "lhs"):
+            raise ValueError("unknown sampling method %s" % method)
+        self.space = space
+        self.method = method
+        self.num = int(num)
+        self.seed = int(seed)
+        self.start = int(start)
+        self.block = int(block) or self.num
+        self.shard = shard
+        self.num_shards = num_shards
+        self._len = None
+
+    def _draw(self):
+        """
+        :return: generator of indices, endless unless the space runs out
+        """
+        if self.method == "random":
+            rng = random.Random(self.seed)
+            while True:
+                yield rng.randrange(len(self.space))
+        strides = self.space.get_strides()
+        n = self.block
+        for cube in itertools.count():
+            rng = random.Random(self.seed * 1000003 + cube)
+            digits = []
+            for size, stride in strides:
+                ranges = range(n)
+                rng.shuffle(ranges)
+                digits.append([int((r + rng.random()) * size / n) * stride
+                               for r in ranges])
+            for i in range(n):
+                yield sum(d[i] for d in digits)
+
+    def _iter_sample(self):
+        total = self.start + self.num
+        seen = set()
+        misses = 0
+        for index in self._draw():
+            if len(seen) == total or misses > self.max_misses:
+                break
+            if index in seen or not self.space.is_valid(index):
+                misses += 1
+                continue
+            misses = 0
+            seen.add(index)
+            yield index
+        # the draws hardly ever hit a config not drawn yet anymore, so
+        # the space is about used up, the rest of it comes in order
+        for index in self.space.iter_indices():
+            if len(seen) == total:
+                return
+            if index not in seen:
+                seen.add(index)
+                yield index
+
+    def __iter__(self):
+        sample = itertools.islice(self._iter_sample(), self.start, None)
+        for i, index in enumerate(sample):
+            if i % self.num_shards == self.shard:
+                yield index
+
+    def __len__(self):
+        if self._len is None:
+            self._len = sum(1 for _ in self)
+        return self._len
+
+    def __getitem__(self, i):
+        for index in itertools.islice(self, i, None):
+            return index
+        raise IndexError("config %d out of %d" % (i, len(self)))
+
+
+class LazyList(object):
+    """
+    func applied to each of indices, computed every time an item is
+    asked for, so it takes no more memory than indices does (nothing
+    for an xrange). Enough of a list for len(), [] and for loops
+    """
+    def __init__(self, func, indices):
+        self.func = func
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        return self.func(self.indices[i])
+
+    def __iter__(self):
+        for index in self.indices:
+            yield self.func(index)
+
+
+def get_config_name(index):
+    return "config_%d" % index
+
+
+def parse_shard(shard_str):
+    """
+    :param shard_str: "i/N", e.g. "0/4" for the first of 4 shards
+    :return: (i, N)
+    """
+    try:
+        shard, num_shards = [int(s) for s in shard_str.split("/")]
+    except ValueError:
+        raise ValueError("shard should be like 0/4, got %s" % shard_str)
+    if not 0 <= shard < num_shards:
+        raise ValueError("shard should be like 0/4, got %s" % shard_str)
+    return shard, num_shards
@@ -0,0 +1,126 @@
+import csv
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import gist.utils
+
+from .. import adaptive
+from .. import sst_simu
+from .test_sst import write_sweep_config
+
+
+# latency grows with the link bw and the num of packets
+FAKE_EMBER_SCRIPT = """
+import json
+import sys
+p = json.load(open(sys.argv[2].split()[0]))
+bw = int(p["topo_params"]["link_bw"][0])
+packets = p["ep_params"]["packets_to_send"]
+print "EMBER: platform: default"
+print "Ring total time %d.5 us, loop 1, bufLen 1, latency %d.0 us." % \\
+    (packets, bw * packets)
+print "Simulation is complete, simulated time: 15.364 us"
+"""
+
+# latency is lowest at 3GB/s
+FAKE_BOWL_SCRIPT = """
+import json
+import sys
+p = json.load(open(sys.argv[2].split()[0]))
+bw = int(p["topo_params"]["link_bw"][0])
+print "EMBER: platform: default"
+print "Ring total time 1.5 us, loop 1, bufLen 1, latency %d.0 us." % \\
+    ((bw - 3) ** 2 + 1)
+print "Simulation is complete, simulated time: 15.364 us"
+"""
+
+
+class AdaptiveTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        gist.utils.init_logger(level=logging.ERROR)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_scale_fidelity(self):
+        self.assertEqual(adaptive.scale_fidelity(1000, 0.1), 100)
+        self.assertEqual(adaptive.scale_fidelity(5, 0.1), 1)
+        self.assertEqual(adaptive.scale_fidelity("100 us", 0.1), "10 us")
+        self.assertRaises(ValueError, adaptive.scale_fidelity, "us", 0.1)
+
+    def test_successive_halving(self):
+        config_file = write_sweep_config(
+            self.work_dir, FAKE_EMBER_SCRIPT,
+            halving={"scales": [0.1, 1], "keep": 0.5,
+                     "metric": "real_latency(us)"})
+        with open(config_file) as fp:
+            config = json.load(fp)
+        config["model_params"]["topo_params"]["link_bw"] = \
+            ["%dGB/s" % bw for bw in (4, 1, 6, 3, 2, 5)]
+        config["model_params"]["ep_params"] = {"packets_to_send": [100]}
+        with open(config_file, "w") as fp:
+            json.dump(config, fp)
+        sim = sst_simu.SSTSimulator(config_file)
+        best = adaptive.successive_halving(sim)
+        self.assertEqual(best, ["config_1", "config_4", "config_3"])
+        with open(os.path.join(sim.output_base_dir, "round_1",
+                               "summary.csv")) as fp:
+            rows = dict((row["configs"], row) for row in csv.DictReader(fp))
+        # the last round runs the full 100 packets
+        self.assertEqual(sorted(rows), sorted(best))
+        self.assertEqual(float(rows["config_1"]["real_latency(us)"]), 100)
+        with open(os.path.join(sim.output_base_dir, "halving.csv")) as fp:
+            rows = dict((row["configs"], row) for row in csv.DictReader(fp))
+        self.assertEqual(float(rows["config_2"]["round_0:real_latency(us)"]),
+                         60)
+        self.assertEqual(rows["config_2"]["last_round"], "0")
+        self.assertEqual(rows["config_3"]["last_round"], "1")
+
+    def test_encode_params(self):
+        x = adaptive.encode_params([
+            {"bw": "1GB/s", "topo": "torus", "n": 2},
+            {"bw": "3GB/s", "topo": "fattree", "n": 2}])
+        # bw as a number, a column per topo, n doesn't vary
+        self.assertEqual(x.shape, (2, 4))
+        self.assertEqual(list(x[:, 0]), [-1, 1])
+        self.assertEqual(list(x[:, 1]), [0, 0])
+
+    def test_gaussian_process(self):
+        x = np.linspace(0, 4, 9)[:, None]
+        gp = adaptive.GaussianProcess(length_scale=1).fit(x, np.sin(x[:, 0]))
+        mean, std = gp.predict(np.array([[1.25], [10.0]]))
+        self.assertAlmostEqual(mean[0], np.sin(1.25), places=1)
+        self.assertLess(std[0], std[1])
+
+    def test_active_sampling(self):
+        config_file = write_sweep_config(
+            self.work_dir, FAKE_BOWL_SCRIPT,
+            active={"metric": "real_latency(us)", "budget": 5,
+                    "batch_size": 2, "acquisition": "value"})
+        with open(config_file) as fp:
+            config = json.load(fp)
+        config["model_params"]["topo_params"]["link_bw"] = \
+            ["%dGB/s" % bw for bw in range(1, 9)]
+        with open(config_file, "w") as fp:
+            json.dump(config, fp)
+        sim = sst_simu.SSTSimulator(config_file)
+        best = adaptive.active_sampling(sim)
+        self.assertEqual(len(best), 5)
+        self.assertEqual(best[0], "config_2")
+        with open(os.path.join(sim.output_base_dir, "active.csv")) as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual([row["batch"] for row in rows],
+                         ["0", "0", "1", "1", "2"])
+        self.assertEqual(rows[0]["predicted"], "")
+        self.assertNotEqual(rows[-1]["predicted"], "")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
 import pandas as pd
@@ -87,3 +89,38 @@ class AnalysisTest(unittest.TestCase):
         s = pd.Series([np.nan, np.nan, "blah", "blah"])
         v = analysis._pd_data_valid(s)
         self.assertTrue(v)
+
+    def test_estimate_runtimes(self):
+        out_dir = tempfile.mkdtemp()
+        summary = os.path.join(out_dir, "summary.csv")
+        # wall time = 0.001 * num_nodes * packets
+        rows = []
+        for shape in ["2x2", "4x4", "8x8"]:
+            for packets in [100, 1000]:
+                nodes = analysis.cal_torus_nodes(shape)
+                rows.append({"topo_type": "torus", "torus:shape": shape,
+                             "packets_to_send": packets,
+                             "wall_time(s)": 0.001 * nodes * packets})
+        pd.DataFrame(rows).to_csv(summary)
+        features = ["num_nodes", "packets_to_send", "message_size"]
+        param_list = [
+            {"topo_type": "torus",
+             "topo_params": {"torus:shape": "4x8"},
+             "ep_params": {"packets_to_send": 500}},
+            {"topo_type": "torus",
+             "topo_params": {"torus:shape": "16x16"},
+             "ep_params": {"packets_to_send": 10}},
+            {"topo_type": "torus",
+             "topo_params": {"torus:shape": "2x2"},
+             "ep_params": {"packets_to_send": "unknown"}}
+        ]
+        costs = analysis.estimate_runtimes(param_list, features, [summary])
+        self.assertAlmostEqual(costs[0], 16.0, places=3)
+        self.assertAlmostEqual(costs[1], 2.56, places=3)
+        # can't be predicted, so assumed to be long
+        self.assertEqual(costs[2], costs[0])
+        # no history, fall back to size
+        costs = analysis.estimate_runtimes(param_list, features)
+        self.assertEqual(costs[:2], [16000.0, 2560.0])
+        shutil.rmtree(out_dir)
+
@@ -0,0 +1,109 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from .. import cluster
+from .. import runner
+
+
+# stands in for sbatch, runs all tasks of the array in a process pool
+FAKE_SUBMIT = """
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+
+
+def run_task(index):
+    env = dict(os.environ, SLURM_ARRAY_TASK_ID=str(index))
+    return subprocess.call(["sh", sys.argv[1]], env=env)
+
+
+if __name__ == "__main__":
+    text = open(sys.argv[1]).read()
+    last = int(re.search(r"--array=0-(\\d+)", text).group(1))
+    pool = multiprocessing.Pool(4)
+    pool.map(run_task, range(last + 1))
+    print "Submitted batch job 42"
+"""
+
+
+class ClusterTest(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.submit = os.path.join(self.out_dir, "fake_sbatch.py")
+        with open(self.submit, "w") as fp:
+            fp.write(FAKE_SUBMIT)
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def test_job_array(self):
+        jobs = []
+        for i in range(5):
+            sub_dir = os.path.join(self.out_dir, "config_%d" % i)
+            os.mkdir(sub_dir)
+            cmd = ["sh", "-c", "echo latency %d; exit %d" % (i, i % 2)]
+            jobs.append(runner.Job("config_%d" % i, cmd, sub_dir,
+                                   log_name=os.path.join(sub_dir, "output.log"),
+                                   parser=lambda l: {"lat": l.split()[-1]}))
+        finished = []
+        submitter = cluster.ArraySubmitter(
+            os.path.join(self.out_dir, "job_array"),
+            submit_cmd="%s %s" % (sys.executable, self.submit),
+            max_array_size=2, poll_interval=0.1,
+            callback=lambda job: finished.append(job.name), status_cmd="")
+        submitter.run(jobs)
+        # 5 jobs in arrays of at most 2
+        scripts = [f for f in os.listdir(submitter.work_dir)
+                   if f.startswith("submit")]
+        self.assertEqual(len(scripts), 3)
+        self.assertEqual(sorted(finished), [job.name for job in jobs])
+        for i, job in enumerate(jobs):
+            self.assertEqual(job.returncode, i % 2)
+            self.assertEqual(job.results, {"lat": str(i)})
+
+    def _get_jobs(self, cmds, timeout=None):
+        jobs = []
+        for i, cmd in enumerate(cmds):
+            sub_dir = os.path.join(self.out_dir, "config_%d" % i)
+            os.mkdir(sub_dir)
+            jobs.append(runner.Job("config_%d" % i, cmd, sub_dir,
+                                   timeout=timeout))
+        return jobs
+
+    def test_lost_and_timed_out(self):
+        jobs = self._get_jobs([["sleep", "30"],
+                               # kills the shell that writes its status
+                               ["sh", "-c", "kill -9 $PPID"],
+                               ["true"]], timeout=1)
+        jobs[1].timeout = None  # or $PPID would be the timeout shell
+        submitter = cluster.ArraySubmitter(
+            os.path.join(self.out_dir, "job_array"),
+            submit_cmd="%s %s" % (sys.executable, self.submit),
+            poll_interval=0.1, status_cmd="true")  # says all gone
+        submitter.run(jobs)
+        self.assertEqual([job.status for job in jobs],
+                         ["timeout", "failed", "done"])
+        self.assertEqual(jobs[1].returncode, -1)
+
+    def test_max_wait(self):
+        jobs = self._get_jobs([["true"]])
+        cancelled = os.path.join(self.out_dir, "cancelled_")
+        # submitted but never run
+        submitter = cluster.ArraySubmitter(
+            os.path.join(self.out_dir, "job_array"),
+            submit_cmd="echo Submitted batch job 7", poll_interval=0.1,
+            status_cmd="echo {job_ids}",
+            cancel_cmd="touch %s{job_ids}" % cancelled, max_wait=0.3)
+        submitter.run(jobs)
+        self.assertEqual(jobs[0].status, "timeout")
+        self.assertEqual(jobs[0].returncode, -1)
+        self.assertTrue(os.path.exists(cancelled + "7"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from .. import distrib
+from .. import runner
+
+
+def start_worker(address, results):
+    def work():
+        results.append(distrib.run_worker(address[0], address[1],
+                                          heartbeat_interval=0.1))
+    worker = threading.Thread(target=work)
+    worker.daemon = True
+    worker.start()
+    return worker
+
+
+class DistribTest(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def get_jobs(self, num_jobs):
+        jobs = []
+        for i in range(num_jobs):
+            log = os.path.join(self.out_dir, "output_%d.log" % i)
+            jobs.append(runner.Job("config_%d" % i,
+                                   ["sh", "-c", "sleep 0.1; echo hi %d" % i],
+                                   log_name=log))
+        return jobs
+
+    def test_workers(self):
+        coordinator = distrib.Coordinator("localhost")
+        num_jobs = []
+        workers = [start_worker(coordinator.address, num_jobs)
+                   for i in range(3)]
+        jobs = coordinator.run(self.get_jobs(6))
+        for worker in workers:
+            worker.join(5)
+        self.assertEqual(sum(num_jobs), 6)
+        for i, job in enumerate(jobs):
+            self.assertEqual(job.status, "done")
+            self.assertIn("wall_time", job.usage)
+            with open(job.log_name) as fp:
+                self.assertEqual(fp.read(), "hi %d\n" % i)
+
+    def test_lost_worker(self):
+        coordinator = distrib.Coordinator("localhost", heartbeat_timeout=1)
+        # takes a job and goes away without running it
+        sock = socket.create_connection(coordinator.address)
+        sock.sendall('{"type": "ready"}\n')
+        num_jobs = []
+
+        def take_job_and_quit():
+            sock.makefile("rb").readline()
+            sock.close()
+            start_worker(coordinator.address, num_jobs)
+        threading.Thread(target=take_job_and_quit).start()
+        jobs = coordinator.run(self.get_jobs(2))
+        self.assertEqual([job.status for job in jobs], ["done", "done"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from .. import runner
+
+
+class RunnerTest(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def test_exit_status(self):
+        jobs = [runner.Job("config_0", "exit 0"),
+                runner.Job("config_1", "exit 3")]
+        runner.JobRunner(max_jobs=2, max_cores=2).run(jobs)
+        self.assertEqual(jobs[0].returncode, 0)
+        self.assertEqual(jobs[1].returncode, 3)
+        failed = runner.get_failed_jobs(jobs)
+        self.assertEqual([job.name for job in failed], ["config_1"])
+
+    def test_output_capture(self):
+        jobs = []
+        for i in range(4):
+            log = os.path.join(self.out_dir, "output_%d.log" % i)
+            jobs.append(runner.Job("config_%d" % i,
+                                   "echo hello %d >> %s" % (i, log)))
+        runner.JobRunner(max_jobs=3, max_cores=3).run(jobs)
+        for i in range(4):
+            with open(os.path.join(self.out_dir, "output_%d.log" % i)) as fp:
+                self.assertEqual(fp.read().strip(), "hello %d" % i)
+
+    def test_parallel(self):
+        jobs = [runner.Job("config_%d" % i, "sleep 0.5") for i in range(4)]
+        start = time.time()
+        runner.JobRunner(max_jobs=4, max_cores=4).run(jobs)
+        self.assertLess(time.time() - start, 1.5)
+
+    def test_core_budget(self):
+        # 2 wide jobs can't share 4 cores, so they run one after another
+        jobs = [runner.Job("config_%d" % i, "sleep 0.4", cores=3)
+                for i in range(2)]
+        start = time.time()
+        runner.JobRunner(max_jobs=4, max_cores=4).run(jobs)
+        self.assertGreater(time.time() - start, 0.8)
+
+    def test_backfill(self):
+        # the narrow jobs fill the core left over by the wide one
+        log = os.path.join(self.out_dir, "order.log")
+        jobs = [runner.Job("config_0", "echo narrow0 >> %s" % log),
+                runner.Job("config_1", "echo wide >> %s; sleep 0.4" % log,
+                           cores=3),
+                runner.Job("config_2", "echo narrow2 >> %s" % log)]
+        runner.JobRunner(max_jobs=4, max_cores=4).run(jobs)
+        with open(log) as fp:
+            lines = [line.strip() for line in fp]
+        self.assertEqual(lines[0], "wide")
+        self.assertEqual(sorted(lines[1:]), ["narrow0", "narrow2"])
+
+    def test_can_launch(self):
+        running = []
+        most_running = []
+        def callback(job):
+            if job.returncode is None:
+                running.append(job)
+            else:
+                running.remove(job)
+            most_running.append(len(running))
+        jobs = [runner.Job("config_%d" % i, "sleep 0.1") for i in range(3)]
+        runner.JobRunner(max_jobs=3, max_cores=3, callback=callback,
+                         can_launch=lambda: not running).run(jobs)
+        self.assertEqual([job.returncode for job in jobs], [0] * 3)
+        self.assertEqual(max(most_running), 1)
+
+    def test_too_wide_job(self):
+        jobs = [runner.Job("config_0", "exit 0", cores=8)]
+        runner.JobRunner(max_jobs=2, max_cores=4).run(jobs)
+        self.assertEqual(jobs[0].returncode, 0)
+
+    def test_streamed_output(self):
+        def parser(line):
+            if "latency" in line:
+                return {"latency": line.split()[-1]}
+            return {}
+        jobs = []
+        for i in range(3):
+            log = os.path.join(self.out_dir, "output_%d.log" % i)
+            cmd = "echo start; sleep 0.2; printf 'latency %d'" % i
+            jobs.append(runner.Job("config_%d" % i, cmd, log_name=log,
+                                   parser=parser))
+        runner.JobRunner(max_jobs=3, max_cores=3).run(jobs)
+        for i, job in enumerate(jobs):
+            self.assertEqual(job.returncode, 0)
+            self.assertEqual(job.results, {"latency": str(i)})
+            with open(job.log_name) as fp:
+                self.assertEqual(fp.read(), "start\nlatency %d" % i)
+
+    def test_bad_output_line(self):
+        def parser(line):
+            return {"latency": line.split()[line.split().index("latency") + 1]}
+        cmd = "echo link_latency=10ns; echo latency 3"
+        jobs = [runner.Job("config_%d" % i, cmd, parser=parser,
+                           log_name=os.path.join(self.out_dir,
+                                                 "output_%d.log" % i))
+                for i in range(3)]
+        runner.JobRunner(max_jobs=2, max_cores=2).run(jobs)
+        for job in jobs:
+            self.assertEqual(job.status, "done")
+            self.assertEqual(job.results, {"latency": "3"})
+
+    def test_argv_job(self):
+        log = os.path.join(self.out_dir, "output.log")
+        jobs = [runner.Job("config_0", ["echo", "a  b", "$HOME"],
+                           log_name=log)]
+        runner.JobRunner().run(jobs)
+        self.assertEqual(jobs[0].returncode, 0)
+        with open(log) as fp:
+            self.assertEqual(fp.read(), "a  b $HOME\n")
+
+    def test_timeout(self):
+        jobs = [runner.Job("config_0", ["sleep", "10"], timeout=0.3),
+                runner.Job("config_1", ["sleep", "0.1"], timeout=5)]
+        start = time.time()
+        runner.JobRunner(max_jobs=2, max_cores=2).run(jobs)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(jobs[0].status, "timeout")
+        self.assertNotEqual(jobs[0].returncode, 0)
+        self.assertEqual(jobs[1].status, "done")
+
+    def test_hang_detection(self):
+        log = os.path.join(self.out_dir, "output.log")
+        # the sleep in the sub shell is in the same process group
+        jobs = [runner.Job("config_0", "echo start; (sleep 10); echo end",
+                           log_name=log, hang_timeout=0.3)]
+        start = time.time()
+        runner.JobRunner().run(jobs)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(jobs[0].status, "hang")
+        with open(log) as fp:
+            self.assertEqual(fp.read(), "start\n")
+
+    def test_usage(self):
+        cmd = [sys.executable, "-c",
+               "import time\n"
+               "a = ' ' * (64 * 1024 * 1024)\n"
+               "t = time.time()\n"
+               "while time.time() - t < 0.2: pass"]
+        jobs = [runner.Job("config_0", cmd)]
+        runner.JobRunner().run(jobs)
+        usage = jobs[0].usage
+        self.assertGreater(usage["wall_time"], 0.2)
+        self.assertGreater(usage["user_time"] + usage["sys_time"], 0.1)
+        self.assertGreater(usage["max_rss"], 64 * 1024)
+
+    def test_longest_first(self):
+        log = os.path.join(self.out_dir, "order.log")
+        jobs = [runner.Job("config_%d" % i, "echo %d >> %s" % (i, log),
+                           cost=cost)
+                for i, cost in enumerate([1, 5, 3])]
+        runner.JobRunner().run(jobs)
+        with open(log) as fp:
+            self.assertEqual(fp.read().split(), ["1", "2", "0"])
+
+    def test_run_stream(self):
+        made = []
+
+        def make_jobs():
+            for i in range(6):
+                made.append(i)
+                yield runner.Job("config_%d" % i, "exit %d" % (i % 2))
+
+        finished = []
+
+        def on_update(job):
+            if job.returncode is not None:
+                # never more than lookahead jobs made ahead of the runner
+                self.assertLessEqual(len(made) - len(finished), 2 + 2)
+                finished.append((job.name, job.returncode))
+
+        job_runner = runner.JobRunner(max_jobs=2, max_cores=2,
+                                      callback=on_update)
+        num_jobs = job_runner.run_stream(make_jobs(), lookahead=2)
+        self.assertEqual(num_jobs, 6)
+        self.assertEqual(sorted(finished),
+                         [("config_%d" % i, i % 2) for i in range(6)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,9 @@ import unittest
 
 import gist.utils
 
+from .. import analysis
 from .. import simulator
+from .. import sweep
 
 
 class SimulatorTest(unittest.TestCase):
@@ -57,6 +59,167 @@ class SimulatorTest(unittest.TestCase):
         self.assertIsInstance(p_get, list)
         self.assertEqual(len(p_get), 4)
 
+    def test_sweep_space(self):
+        p = dict(self.p, work=[{"type": ["a"], "bw": [1, 2]},
+                               {"type": ["b"], "bw": [3, 4, 5]}])
+        space = sweep.SweepSpace(p)
+        p_get = list(space)
+        self.assertEqual(len(space), 90)
+        self.assertEqual(len(p_get), 90)
+        for i in (0, 1, 17, 45, 89):
+            self.assertEqual(space[i], p_get[i])
+        self.assertEqual(space[-1], p_get[-1])
+        self.assertRaises(IndexError, space.__getitem__, 90)
+        # every config in exactly one shard
+        shards = [list(space.get_shard(i, 4)) for i in range(4)]
+        self.assertEqual(sorted(sum(shards, [])), range(90))
+        self.assertEqual(sweep.parse_shard("1/4"), (1, 4))
+        self.assertRaises(ValueError, sweep.parse_shard, "4/4")
+
+    def test_conditional_groups(self):
+        p = {
+            "topo_type": ["torus", "fattree", "dragonfly"],
+            "link_bw": ["1GB/s", "2GB/s"],
+            "topo_params": [
+                {"when": {"topo_type": "torus"},
+                 "torus:shape": ["4x4", "8x8", "16x16"]},
+                {"when": {"topo_type": ["fattree", "dragonfly"]},
+                 "radix": [16]}
+            ],
+            "torus_opts": {"when": {"topo_type": "torus"}, "vns": [1, 2]}
+        }
+        space = sweep.SweepSpace(p)
+        p_get = list(space)
+        # torus 2 * 3 * 2, the others 2 * 1 each
+        self.assertEqual(len(space), 16)
+        self.assertEqual(len(p_get), 16)
+        for param in p_get:
+            if param["topo_type"] == "torus":
+                self.assertIn("torus:shape", param["topo_params"])
+                self.assertIn(param["torus_opts"]["vns"], [1, 2])
+            else:
+                self.assertEqual(param["topo_params"], {"radix": 16})
+                self.assertNotIn("torus_opts", param)
+        self.assertEqual(space[7], p_get[7])
+        self.assertNotIn("when", space.get_flat_keys())
+        self.assertRaises(ValueError, sweep.SweepSpace,
+                          {"a": [1], "b": {"when": {"c": 1}, "d": [1]}})
+
+    def test_constraints(self):
+        p = {
+            "topo_type": ["torus"],
+            "torus:shape": ["2x2", "4x4", "8x8"],
+            "ember": {"jobsize": [4, 16, 64], "msg_size": [1, 2]},
+            "constraints": ["num_nodes(topo_type, torus_shape) == jobsize",
+                            "msg_size < 2"]
+        }
+        space = sweep.SweepSpace(p, {"num_nodes": analysis.cal_num_nodes})
+        p_get = list(space)
+        self.assertEqual(len(p_get), 3)
+        for param in p_get:
+            self.assertNotIn("constraints", param)
+            self.assertEqual(param["ember"]["msg_size"], 1)
+        # indices stay those of the space without constraints
+        indices = list(space.iter_indices())
+        self.assertEqual(len(space), 18)
+        self.assertEqual([space[i] for i in indices], p_get)
+        shard = sweep.ConfigIndices(space, 1, 3)
+        self.assertEqual(len(shard), 1)
+        self.assertIn(shard[0], indices)
+        # configs of other shapes are never looked at
+        seen = []
+
+        def see(*args):
+            seen.append(args)
+            return True
+
+        p["constraints"] = ["torus_shape == '4x4'",
+                            "see(torus_shape, jobsize)"]
+        space = sweep.SweepSpace(p, {"see": see})
+        self.assertEqual(len(list(space)), 6)
+        self.assertEqual(set(shape for shape, _ in seen), set(["4x4"]))
+        p["constraints"] = ["no_such_param > 1"]
+        self.assertRaises(ValueError, list, sweep.SweepSpace(p))
+
+    def test_zip_groups(self):
+        p = {
+            "ep": ["ember"],
+            "topo_params": {
+                "zip": {"torus:shape": ["4x4", "8x8", "16x16"],
+                        "torus:local_ports": [1, 2, 4]},
+                "num_vns": [1, 2]
+            },
+            "zip": [{"link_bw": ["1GB/s", "4GB/s"],
+                     "link_lat": ["10ns", "20ns"]}]
+        }
+        space = sweep.SweepSpace(p)
+        p_get = list(space)
+        self.assertEqual(len(p_get), 3 * 2 * 2)
+        pairs = set()
+        for param in p_get:
+            self.assertNotIn("zip", param)
+            self.assertNotIn("zip", param["topo_params"])
+            topo = param["topo_params"]
+            pairs.add((topo["torus:shape"], topo["torus:local_ports"]))
+            pairs.add((param["link_bw"], param["link_lat"]))
+        self.assertEqual(pairs, set([("4x4", 1), ("8x8", 2), ("16x16", 4),
+                                     ("1GB/s", "10ns"), ("4GB/s", "20ns")]))
+        self.assertEqual(set(space.get_flat_keys()),
+                         set(["ep", "torus:shape", "torus:local_ports",
+                              "num_vns", "link_bw", "link_lat"]))
+        p["zip"] = {"link_bw": ["1GB/s"], "link_lat": ["10ns", "20ns"]}
+        self.assertRaises(ValueError, sweep.SweepSpace, p)
+
+    def test_sampling(self):
+        p = {"a": range(10), "b": range(10), "c": {"d": range(10)}}
+        space = sweep.SweepSpace(p)
+        for method in ("random", "lhs"):
+            first = list(sweep.SampledIndices(space, method, 10, seed=3))
+            self.assertEqual(len(set(first)), 10)
+            self.assertEqual(
+                first, list(sweep.SampledIndices(space, method, 10, seed=3)))
+            more = list(sweep.SampledIndices(space, method, 10, seed=3,
+                                             start=10))
+            self.assertEqual(len(set(first + more)), 20)
+            both = list(sweep.SampledIndices(space, method, 20, seed=3,
+                                             block=10))
+            self.assertEqual(both, first + more)
+        # each value of every axis once in a cube as big as the axes
+        lhs = [space[i] for i in first]
+        for key in ("a", "b"):
+            self.assertEqual(sorted(param[key] for param in lhs), range(10))
+        self.assertEqual(sorted(param["c"]["d"] for param in lhs),
+                         range(10))
+        # the params inside dicts are axes of their own too
+        p = {"ep_params": {"a": range(8), "b": range(8), "c": "x"},
+             "topo_params": {"d": range(4)}}
+        space = sweep.SweepSpace(p)
+        self.assertEqual(space.get_strides(),
+                         [(8, 32), (1, 32), (8, 4), (4, 1)])
+        lhs = [space[i] for i in sweep.SampledIndices(space, "lhs", 8)]
+        for key in ("a", "b"):
+            self.assertEqual(sorted(param["ep_params"][key]
+                                    for param in lhs), range(8))
+        self.assertEqual(sorted(param["topo_params"]["d"] for param in lhs),
+                         sorted(range(4) * 2))
+        # going past the end of the space only adds configs not run yet
+        space = sweep.SweepSpace({"a": range(10), "b": range(15)})
+        for method in ("random", "lhs"):
+            first = list(sweep.SampledIndices(space, method, 100, seed=3))
+            more = list(sweep.SampledIndices(space, method, 100, seed=3,
+                                             start=100))
+            self.assertEqual(len(more), 50)
+            self.assertEqual(sorted(first + more), range(150))
+            self.assertEqual(
+                list(sweep.SampledIndices(space, method, 200, seed=3,
+                                          block=100)),
+                first + more)
+        # asking for more than there is gives all of them
+        p = {"a": range(10), "b": range(10), "c": {"d": range(10)}}
+        p["constraints"] = ["a + b + d < 2"]
+        space = sweep.SweepSpace(p)
+        self.assertEqual(len(sweep.SampledIndices(space, "random", 5)), 4)
+
     def test_dump_param_header(self):
         header_gold = set(["configs", "foo", "duh", "huh", "hmm"])
         p_get = gist.utils.permute_params(self.p)
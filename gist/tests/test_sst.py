@@ -1,11 +1,131 @@
+import csv
+import json
+import logging
 import os
+import shutil
+import sys
+import tempfile
 import unittest
 
+import gist.simulator
+import gist.sweep
 import gist.utils
 
 from .. import sst_simu
 
 
+FAKE_SST_SCRIPT = """
+print "Simulation is complete, simulated time: 15.364 us"
+"""
+
+# runs every config in a batch like the ember built-in sweeps
+FAKE_EMBER_SCRIPT = """
+import json
+import sys
+params = json.load(open(sys.argv[2].split()[0]))
+if not isinstance(params, list):
+    params = [params]
+for i, p in enumerate(params):
+    print "EMBER: platform: default"
+    print "EMBER: network: BW=%s pktSize=64B flitSize=8B" % \\
+        p["topo_params"]["link_bw"]
+    print "Ring total time %d.5 us, loop 1, bufLen 1, latency 1.2 us." % \\
+        (i + 1)
+print "Simulation is complete, simulated time: 15.364 us"
+"""
+
+# same as FAKE_EMBER_SCRIPT, but given records of an indexed params file
+FAKE_INDEXED_SCRIPT = """
+import sys
+sys.path.insert(0, %r)
+import gist.utils
+params = gist.utils.load_param(sys.argv[2].split()[0])
+if not isinstance(params, list):
+    params = [params]
+for i, p in enumerate(params):
+    print "EMBER: platform: default"
+    print "Ring total time %%d.5 us, loop 1, bufLen 1, latency 1.2 us." %% \\
+        (i + 1)
+print "Simulation is complete, simulated time: 15.364 us"
+""" % os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+# dumps a config that is the same for all but the 3GB/s config
+FAKE_DUMP_SCRIPT = """
+import json
+import sys
+args = sys.argv[1:]
+p = json.load(open(args[args.index("--model-options") + 1].split()[0]))
+with open(args[args.index("--output-config") + 1], "w") as fp:
+    fp.write("# model\\n" * 1000)
+    if p["topo_params"]["link_bw"] == "3GB/s":
+        fp.write("# faster\\n")
+print "Simulation is complete, simulated time: 15.364 us"
+"""
+
+# writes a stats csv like sst does
+FAKE_STATS_SCRIPT = """
+import os
+import sys
+args = sys.argv[1:]
+run_dir = args[args.index("--model-options") + 1].split()[1]
+with open(os.path.join(run_dir, "stats_0.csv"), "w") as fp:
+    fp.write("ComponentName, StatisticName, StatisticSubId, "
+             "StatisticType, SimTime, Rank, Sum.u64, SumSQ.u64, "
+             "Count.u64\\n")
+    fp.write("rtr:G0R0, send_packet_count, port0, Accumulator, "
+             "15370000, 0, 114, 114, 114\\n")
+print "Simulation is complete, simulated time: 15.364 us"
+"""
+
+# killed while running the second config of a batch
+FAKE_HANGING_SCRIPT = """
+import sys
+import time
+print "EMBER: platform: default"
+print "Ring total time 1.5 us, loop 1, bufLen 1, latency 1.2 us."
+print "EMBER: platform: default"
+sys.stdout.flush()
+time.sleep(30)
+"""
+
+
+def write_sweep_config(work_dir, script_text=FAKE_SST_SCRIPT, **sim_opts):
+    """
+    write a small sweep config that runs a fake target script with python
+    instead of sst, sim_opts overrides the default ones
+    :return: path to the config json
+    """
+    script = os.path.join(work_dir, "fake_sst.py")
+    with open(script, "w") as fp:
+        fp.write(script_text)
+    config = {
+        "sim_opts": {
+            "sim_exe": sys.executable,
+            "mpi": False,
+            "config_file": "temp",
+            "config_dir": "",
+            "dump_config": False,
+            "output_as": "file",
+            "output_dir": os.path.join(work_dir, "time"),
+            "other_opts": {
+                "target_script": script,
+                "stats": {}
+            }
+        },
+        "model_params": {
+            "ep_type": ["ember_ep"],
+            "topo_params": {"link_bw": ["1GB/s", "2GB/s", "3GB/s"]},
+            "stats_params": {"stats_type": ["sst.AccumulatorStatistic"]}
+        }
+    }
+    config["sim_opts"].update(sim_opts)
+    config_file = os.path.join(work_dir, "sweep.json")
+    with open(config_file, "w") as fp:
+        json.dump(config, fp)
+    return config_file
+
+
 class SSTTest(unittest.TestCase):
     def test_time_convert_to_us(self):
         sim_time = gist.utils.convert_time_to_us("123", "us00")
@@ -26,6 +146,442 @@ class SSTTest(unittest.TestCase):
             "work_time(us)": "1308.114"
         }
         self.assertEqual(tgt_dict, results)
+        self.assertEqual(sst_simu.get_ember_output_from_line(
+            "merlin: link_latency=10ns link_bandwidth=1GB/s"), {})
+
+
+class SSTRunTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        # commands are only called when not in DEBUG
+        gist.utils.init_logger(level=logging.ERROR)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_param_hash(self):
+        p_0 = {"a": 1, "b": {"c": "2GB/s", "d": [1, 2]}}
+        p_1 = {"b": {"d": [1, 2], "c": "2GB/s"}, "a": 1}
+        key_0 = gist.utils.get_param_hash(p_0, "sst", "abc")
+        self.assertEqual(key_0, gist.utils.get_param_hash(p_1, "sst", "abc"))
+        self.assertNotEqual(key_0, gist.utils.get_param_hash(p_0, "sst", ""))
+        p_1["a"] = 2
+        self.assertNotEqual(key_0, gist.utils.get_param_hash(p_1, "sst", "abc"))
+
+    def test_assemble_argv(self):
+        mpi_opts = {"mpi_exe": "mpirun", "n": 4,
+                    "other_opts": "--bind-to core"}
+        config_file = write_sweep_config(self.work_dir, mpi=True,
+                                         mpi_opts=mpi_opts, threads=2)
+        sim = sst_simu.SSTSimulator(config_file)
+        cmd = sim.assemble_command()
+        self.assertEqual(cmd, [gist.utils.find_exe("mpirun"), "-n", "4",
+                               "--bind-to", "core",
+                               sys.executable, "--num_threads", "2",
+                               sim.other_opts["target_script"]])
+        self.assertEqual(sim.get_job_cores(), 8)
+
+    def test_job_timeout(self):
+        timeout = {"scale_by": "link_bw", "seconds_per_unit": 10, "min": 15}
+        config_file = write_sweep_config(self.work_dir, timeout=timeout)
+        sim = sst_simu.SSTSimulator(config_file)
+        param = {"topo_params": {"link_bw": "2"}}
+        self.assertEqual(sim.get_job_timeout(param), 20)
+        param = {"topo_params": {"link_bw": "1"}}
+        self.assertEqual(sim.get_job_timeout(param), 15)
+
+    def test_compile_job_info(self):
+        out_dir = os.path.join(self.work_dir, "test_output")
+        shutil.copytree("gist/tests/test_output", out_dir)
+        os.rename(os.path.join(out_dir, "config_gold.csv"),
+                  os.path.join(out_dir, "config.csv"))
+        stats = {"rtr_send_packet": ["rtr", "send_packet_count",
+                                     " Count.u64"]}
+        job_info = {"config_1": {"status": "timeout"}}
+        sst_simu.compile_accu_output(stats, out_dir, job_info=job_info)
+        with open(os.path.join(out_dir, "summary.csv")) as fp:
+            rows = list(csv.reader(fp))
+        self.assertEqual(rows[0][-3:], ["exe_time(us)", "rtr_send_packet",
+                                        "status"])
+        self.assertEqual(rows[1][-1], "")
+        self.assertEqual(rows[2][-1], "timeout")
+
+    def test_compile_compressed(self):
+        out_dir = os.path.join(self.work_dir, "test_output")
+        shutil.copytree("gist/tests/test_output", out_dir)
+        os.rename(os.path.join(out_dir, "config_gold.csv"),
+                  os.path.join(out_dir, "config.csv"))
+        stats = {"rtr_send_packet": ["rtr", "send_packet_count",
+                                     " Count.u64"]}
+        sst_simu.compile_accu_output(stats, out_dir, "plain.csv")
+        for config_dir in ("config_0", "config_1"):
+            sub_dir = os.path.join(out_dir, config_dir)
+            for name in os.listdir(sub_dir):
+                gist.utils.compress_file(os.path.join(sub_dir, name), "bz2")
+        sst_simu.compile_accu_output(stats, out_dir, "compressed.csv")
+        with open(os.path.join(out_dir, "plain.csv")) as plain, \
+                open(os.path.join(out_dir, "compressed.csv")) as compressed:
+            self.assertEqual(plain.read(), compressed.read())
+        sst_simu.compile_histogram_outputs(stats, out_dir)
+        log = os.path.join(out_dir, "config_0", "output.log")
+        self.assertTrue(sst_simu.is_sim_complete(log))
+        self.assertIn("exe_time(us)",
+                      sst_simu.get_miranda_output_from_file(log))
+
+    def test_compress(self):
+        config_file = write_sweep_config(self.work_dir, FAKE_EMBER_SCRIPT,
+                                         compress="gzip", batch_size=2)
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        sim.compile_output()
+        self.assertEqual(sorted(os.listdir(os.path.join(sim.output_base_dir,
+                                                        "config_1"))),
+                         ["output.log.gz"])
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual([row["exe_time(us)"] for row in rows],
+                         ["1", "2", "1"])
+        sim = sst_simu.SSTSimulator(resume_dir=sim.output_base_dir)
+        sim.run()
+        self.assertEqual(sim.jobs, [])
+
+    def test_scratch(self):
+        scratch_dir = os.path.join(self.work_dir, "scratch")
+        config_file = write_sweep_config(self.work_dir, FAKE_EMBER_SCRIPT,
+                                         scratch_dir=scratch_dir,
+                                         compress="gzip", batch_size=2,
+                                         max_parallel_jobs=2)
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        sim.compile_output()
+        self.assertEqual(os.listdir(scratch_dir), [])
+        for name in ("config_1", "batch_0"):
+            self.assertEqual(os.listdir(os.path.join(sim.output_base_dir,
+                                                     name)),
+                             ["output.log.gz"])
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual([row["exe_time(us)"] for row in rows],
+                         ["1", "2", "1"])
+
+    def test_scratch_stream(self):
+        scratch_dir = os.path.join(self.work_dir, "scratch")
+        config_file = write_sweep_config(self.work_dir, stream=True,
+                                         scratch_dir=scratch_dir,
+                                         scratch_max_pending=1,
+                                         max_parallel_jobs=2)
+        with open(config_file) as fp:
+            config = json.load(fp)
+        config["model_params"]["ep_type"] = ["miranda_ep"]
+        with open(config_file, "w") as fp:
+            json.dump(config, fp)
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        self.assertEqual(os.listdir(scratch_dir), [])
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            rows = list(csv.DictReader(fp))
+        # read from scratch, before being written back
+        self.assertEqual([row["exe_time(us)"] for row in rows], ["15"] * 3)
+        log = os.path.join(sim.output_base_dir, "config_2", "output.log")
+        self.assertTrue(sst_simu.is_sim_complete(log))
+
+    def test_dedup_config(self):
+        config_file = write_sweep_config(self.work_dir, FAKE_DUMP_SCRIPT,
+                                         dump_config=True, dedup_config=True)
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        store_dir = os.path.join(sim.output_base_dir, "config_store")
+        self.assertEqual(len(os.listdir(store_dir)), 2)
+        dumps = [os.path.join(sim.output_base_dir, "config_%d" % i,
+                              "config.py") for i in range(3)]
+        self.assertTrue(os.path.samefile(dumps[0], dumps[1]))
+        self.assertFalse(os.path.samefile(dumps[0], dumps[2]))
+        with open(os.path.join(sim.output_base_dir,
+                               "config_dedup.json")) as fp:
+            report = json.load(fp)
+        self.assertEqual(report["files"], 3)
+        self.assertEqual(report["stored_files"], 2)
+        self.assertEqual(report["saved_bytes"], 8000)
+        # compressed once in the store, on the way back from scratch
+        config_file = write_sweep_config(
+            self.work_dir, FAKE_DUMP_SCRIPT, dump_config=True,
+            dedup_config=True, compress="gzip",
+            scratch_dir=os.path.join(self.work_dir, "scratch"))
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        store_dir = os.path.join(sim.output_base_dir, "config_store")
+        self.assertTrue(all(name.endswith(".py.gz")
+                            for name in os.listdir(store_dir)))
+        dump = os.path.join(sim.output_base_dir, "config_1", "config.py")
+        with gist.utils.open_output_file(dump) as fp:
+            self.assertEqual(len(fp.readlines()), 1000)
+
+    def test_hash_output_reuses_cache(self):
+        output_dir = os.path.join(self.work_dir, "hash")
+        config_file = write_sweep_config(self.work_dir, output_dir=output_dir)
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        self.assertEqual(len(sim.jobs), 3)
+        self.assertEqual(sim.exit_status.values(), [0, 0, 0])
+        self.assertEqual(sim.results["config_0"], {"exe_time(us)": "15"})
+        sim.compile_output()
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual(rows[1]["status"], "done")
+        self.assertEqual(rows[1]["mpi_ranks"], "1")
+        self.assertGreater(float(rows[1]["wall_time(s)"]), 0)
+        self.assertGreater(float(rows[1]["max_rss(MB)"]), 0)
+        for i in range(3):
+            log = os.path.join(sim.output_base_dir, "config_%d" % i,
+                               "output.log")
+            self.assertTrue(sst_simu.is_sim_complete(log))
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        self.assertEqual(len(sim.jobs), 0)
+        self.assertEqual(len(sim.cached_configs), 3)
+        log = os.path.join(sim.output_base_dir, "config_1", "output.log")
+        self.assertTrue(sst_simu.is_sim_complete(log))
+
+    def test_resume(self):
+        config_file = write_sweep_config(self.work_dir)
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        manifest = gist.simulator.Manifest.load(sim.output_base_dir)
+        self.assertEqual(manifest.states.values(), ["done"] * 3)
+        # pretend config_1 was killed half way
+        os.remove(os.path.join(sim.output_base_dir, "config_1", "output.log"))
+        sim = sst_simu.SSTSimulator(resume_dir=sim.output_base_dir)
+        self.assertIn("stats", sim.manifest.configs["sim_opts"]["other_opts"])
+        sim.run()
+        self.assertEqual([job.name for job in sim.jobs], ["config_1"])
+        log = os.path.join(sim.output_base_dir, "config_1", "output.log")
+        self.assertTrue(sst_simu.is_sim_complete(log))
+
+    def test_manifest_journal(self):
+        manifest = gist.simulator.Manifest(self.work_dir, {}, [{}, {}])
+        manifest.dump()
+        with open(manifest.path) as fp:
+            dumped = fp.read()
+        # failures go to the journal instead of rewriting the manifest
+        manifest.set_state("config_1", "failed", force=True)
+        with open(manifest.path) as fp:
+            self.assertEqual(fp.read(), dumped)
+        loaded = gist.simulator.Manifest.load(self.work_dir)
+        self.assertEqual(loaded.states.values(), ["pending", "failed"])
+        manifest.dump()
+        self.assertFalse(os.path.exists(manifest.journal_path))
+        loaded = gist.simulator.Manifest.load(self.work_dir)
+        self.assertEqual(loaded.states.values(), ["pending", "failed"])
+
+    def test_sharded_layout(self):
+        output_dir = os.path.join(self.work_dir, "hash")
+        config_file = write_sweep_config(self.work_dir, output_dir=output_dir,
+                                         output_layout="sharded")
+        with open(config_file) as fp:
+            config = json.load(fp)
+        config["model_params"]["ep_type"] = ["miranda_ep"]
+        with open(config_file, "w") as fp:
+            json.dump(config, fp)
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        sim.compile_output()
+        self.assertNotIn("config_1", os.listdir(sim.output_base_dir))
+        # the layout is found without being told
+        index = gist.simulator.ConfigIndex(sim.output_base_dir)
+        self.assertTrue(index.sharded)
+        path = index.get_path("config_1")
+        self.assertEqual(len(path.split(os.sep)), 3)
+        # linked to the cache from two levels down
+        log = os.path.join(sim.output_base_dir, path, "output.log")
+        self.assertTrue(sst_simu.is_sim_complete(log))
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual([row["exe_time(us)"] for row in rows], ["15"] * 3)
+        os.remove(log)
+        sim = sst_simu.SSTSimulator(resume_dir=sim.output_base_dir)
+        sim.run()
+        self.assertEqual([job.name for job in sim.jobs], ["config_1"])
+        self.assertTrue(sst_simu.is_sim_complete(log))
+        with open(os.path.join(sim.output_base_dir,
+                               index.file_name)) as fp:
+            self.assertEqual(fp.read(), "layout sharded\n")
+
+    def test_shard(self):
+        config_file = write_sweep_config(self.work_dir)
+        sim = sst_simu.SSTSimulator(config_file, shard="1/2")
+        self.assertEqual(sim.config_names, ["config_1"])
+        sim.run()
+        self.assertEqual([job.name for job in sim.jobs], ["config_1"])
+        self.assertEqual(list(sim.manifest.states), ["config_1"])
+        sim.compile_output()
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual([row["configs"] for row in rows], ["config_1"])
+
+    def test_stream(self):
+        config_file = write_sweep_config(self.work_dir, stream=True)
+        sim = sst_simu.SSTSimulator(config_file)
+        self.assertIsInstance(sim.param_list, gist.sweep.LazyList)
+        sim.run()
+        sim.compile_output()
+        with open(os.path.join(sim.output_base_dir, "config.csv")) as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual([row["configs"] for row in rows],
+                         ["config_0", "config_1", "config_2"])
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual(sorted(row["configs"] for row in rows),
+                         ["config_0", "config_1", "config_2"])
+        self.assertEqual([row["status"] for row in rows], ["done"] * 3)
+        self.assertEqual(rows[0]["exe_time(us)"], "15")
+        # nothing left behind, nothing kept
+        self.assertEqual(sim._param_files, {})
+        self.assertEqual(sim._running_params, {})
+        self.assertEqual(sim.results, {})
+        # resume regenerates the params from the configs
+        os.remove(os.path.join(sim.output_base_dir, "config_1", "output.log"))
+        sim = sst_simu.SSTSimulator(resume_dir=sim.output_base_dir)
+        self.assertTrue(sim.streamed)
+        ran = []
+        sim._on_job_update = lambda job, update=sim._on_job_update: \
+            (ran.append(job.name), update(job))
+        sim.run()
+        self.assertEqual(set(ran), set(["config_1"]))
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            self.assertEqual(len(list(csv.DictReader(fp))), 3)
+
+    def test_stream_hash_output(self):
+        output_dir = os.path.join(self.work_dir, "hash")
+        config_file = write_sweep_config(self.work_dir, output_dir=output_dir,
+                                         stream=True)
+        with open(config_file) as fp:
+            config = json.load(fp)
+        # config_0 and config_1 are the same config
+        config["model_params"]["topo_params"]["link_bw"] = \
+            ["1GB/s", "1GB/s", "2GB/s"]
+        with open(config_file, "w") as fp:
+            json.dump(config, fp)
+        sim = sst_simu.SSTSimulator(config_file)
+        ran = []
+        sim._on_job_update = lambda job, update=sim._on_job_update: \
+            (ran.append(job.name), update(job))
+        sim.run()
+        self.assertEqual(sorted(set(ran)), ["config_0", "config_2"])
+        self.assertEqual(sim._dup_configs, {})
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            rows = dict((row["configs"], row) for row in csv.DictReader(fp))
+        self.assertEqual(sorted(rows), ["config_0", "config_1", "config_2"])
+        self.assertEqual(rows["config_1"]["exe_time(us)"], "15")
+        self.assertEqual(rows["config_1"]["status"], "done")
+        self.assertEqual(os.readlink(os.path.join(sim.output_base_dir,
+                                                  "config_1")),
+                         os.readlink(os.path.join(sim.output_base_dir,
+                                                  "config_0")))
+        # nothing kept of the keys once the configs are done
+        self.assertEqual(sim._queued_keys, {})
+        self.assertEqual(sim._finished, {})
+        # cached the second time around
+        sim = sst_simu.SSTSimulator(config_file)
+        ran = []
+        sim._on_job_update = lambda job, update=sim._on_job_update: \
+            (ran.append(job.name), update(job))
+        sim.run()
+        self.assertEqual(ran, [])
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual([row["exe_time(us)"] for row in rows], ["15"] * 3)
+
+    def test_stream_hash_output_written_back(self):
+        output_dir = os.path.join(self.work_dir, "hash")
+        config_file = write_sweep_config(self.work_dir, output_dir=output_dir,
+                                         stream=True, compress="gzip")
+        with open(config_file) as fp:
+            config = json.load(fp)
+        # config_2 is config_0 again, maybe after it's done
+        config["model_params"]["topo_params"]["link_bw"] = \
+            ["1GB/s", "2GB/s", "1GB/s"]
+        with open(config_file, "w") as fp:
+            json.dump(config, fp)
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        self.assertEqual(sim._queued_keys, {})
+        self.assertEqual(sim._dup_configs, {})
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            rows = dict((row["configs"], row) for row in csv.DictReader(fp))
+        self.assertEqual(sorted(rows), ["config_0", "config_1", "config_2"])
+        self.assertEqual(rows["config_2"]["exe_time(us)"], "15")
+        self.assertEqual(os.listdir(os.path.join(sim.output_base_dir,
+                                                 "config_2")),
+                         ["output.log.gz"])
+
+    def test_stream_histogram_job_info(self):
+        config_file = write_sweep_config(self.work_dir, FAKE_STATS_SCRIPT,
+                                         stream=True)
+        with open(config_file) as fp:
+            config = json.load(fp)
+        config["sim_opts"]["other_opts"]["stats"] = {
+            "rtr_send_packet": ["rtr", "send_packet_count", " Count.u64"]}
+        config["model_params"]["ep_type"] = ["miranda_ep"]
+        config["model_params"]["stats_params"]["stats_type"] = \
+            ["sst.HistogramStatistic"]
+        with open(config_file, "w") as fp:
+            json.dump(config, fp)
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        self.assertEqual(sim.job_info, {})
+        sim.compile_output()
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual([row["status"] for row in rows], ["done"] * 3)
+        self.assertEqual([row["mpi_ranks"] for row in rows], ["1"] * 3)
+
+    def test_batch(self):
+        config_file = write_sweep_config(self.work_dir, FAKE_EMBER_SCRIPT,
+                                         batch_size=2)
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        self.assertEqual([job.name for job in sim.jobs],
+                         ["batch_0", "batch_2"])
+        self.assertEqual(sim.results["config_1"]["exe_time(us)"], "2")
+        self.assertEqual(sim.results["config_2"]["exe_time(us)"], "1")
+        self.assertEqual(sim.job_info["config_1"]["batch"], "batch_0")
+        self.assertEqual(sim.manifest.states.values(), ["done"] * 3)
+        log = os.path.join(sim.output_base_dir, "config_1", "output.log")
+        result = sst_simu.get_ember_output_from_file(log)
+        self.assertEqual(result["real_latency(us)"], "1.2")
+        self.assertEqual(result["exe_time(us)"], "2")
+
+    def test_killed_batch(self):
+        config_file = write_sweep_config(self.work_dir, FAKE_HANGING_SCRIPT,
+                                         batch_size=3, timeout=0.5)
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        sim.compile_output()
+        for i in range(3):
+            log = os.path.join(sim.output_base_dir, "config_%d" % i,
+                               "output.log")
+            self.assertTrue(os.path.exists(log))
+            self.assertFalse(sst_simu.is_sim_complete(log))
+        self.assertEqual(sim.manifest.states.values(), ["timeout"] * 3)
+        with open(os.path.join(sim.output_base_dir, "summary.csv")) as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual([row["status"] for row in rows], ["timeout"] * 3)
+        self.assertEqual(rows[0]["work_time(us)"], "1.5")
+
+    def test_indexed_params(self):
+        config_dir = os.path.join(self.work_dir, "params")
+        config_file = write_sweep_config(self.work_dir, FAKE_INDEXED_SCRIPT,
+                                         batch_size=2, indexed_params=True,
+                                         config_file="",
+                                         config_dir=config_dir)
+        sim = sst_simu.SSTSimulator(config_file)
+        sim.run()
+        self.assertEqual(sim.manifest.states.values(), ["done"] * 3)
+        self.assertEqual(sim.results["config_1"]["exe_time(us)"], "2")
+        self.assertIn(".jsonl#", sim.jobs[0].cmd[-1])
+        # the params file is gone with the sweep
+        self.assertEqual(os.listdir(config_dir), [])
 
 
 if __name__ == '__main__':
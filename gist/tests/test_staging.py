@@ -0,0 +1,91 @@
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import gist.utils
+
+from .. import staging
+
+
+class StagingTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        gist.utils.init_logger(level=logging.CRITICAL)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _make_dir(self, name, files):
+        path = os.path.join(self.work_dir, name)
+        os.makedirs(path)
+        for file_name, text in files.items():
+            with open(os.path.join(path, file_name), "w") as fp:
+                fp.write(text)
+        return path
+
+    def test_write_back(self):
+        write_back = staging.WriteBack(
+            max_pending=1, compress="gzip",
+            should_compress=lambda name: name.endswith(".log"))
+        final_dirs = []
+        for i in range(3):
+            scratch = self._make_dir("scratch/config_%d" % i,
+                                     {"output.log": "log %d" % i,
+                                      "exit_status": "0"})
+            final = os.path.join(self.work_dir, "out", "config_%d" % i)
+            if i == 0:  # made up front, with an old log in it
+                self._make_dir("out/config_0", {"output.log.gz": "old"})
+            write_back.put(scratch, final)
+            final_dirs.append(final)
+        write_back.close()
+        self.assertEqual(os.listdir(os.path.join(self.work_dir, "scratch")),
+                         [])
+        for i, final in enumerate(final_dirs):
+            self.assertEqual(sorted(os.listdir(final)),
+                             ["exit_status", "output.log.gz"])
+            with gzip.open(os.path.join(final, "output.log.gz")) as fp:
+                self.assertEqual(fp.read(), "log %d" % i)
+
+    def test_compress_in_place(self):
+        write_back = staging.WriteBack(
+            compress="gzip",
+            should_compress=lambda name: name.endswith(".log"))
+        out = self._make_dir("out/config_0", {"output.log": "log",
+                                              "exit_status": "0"})
+        write_back.put(out, out)
+        write_back.close()
+        self.assertEqual(sorted(os.listdir(out)),
+                         ["exit_status", "output.log.gz"])
+
+    def test_full(self):
+        written = threading.Event()
+        write_back = staging.WriteBack(
+            max_pending=1, compress="gzip",
+            should_compress=lambda name: written.wait())
+        for i in range(3):
+            scratch = self._make_dir("scratch/config_%d" % i,
+                                     {"output.log": "log %d" % i})
+            # never blocks, even though nothing gets written back
+            write_back.put(scratch,
+                           os.path.join(self.work_dir, "out", str(i)))
+        self.assertTrue(write_back.is_full())
+        written.set()
+        write_back.close()
+        self.assertFalse(write_back.is_full())
+        self.assertEqual(sorted(os.listdir(os.path.join(self.work_dir,
+                                                        "out"))),
+                         ["0", "1", "2"])
+
+    def test_write_back_error(self):
+        write_back = staging.WriteBack()
+        write_back.put(os.path.join(self.work_dir, "missing"),
+                       os.path.join(self.work_dir, "out"))
+        self.assertRaises(IOError, write_back.close)
+
+
+if __name__ == '__main__':
+    unittest.main()
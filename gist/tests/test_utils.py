@@ -1,3 +1,8 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
 import unittest
 from .. import utils
 
@@ -55,5 +60,86 @@ class UtilTest(unittest.TestCase):
         self.assertEqual(res[0][0], "10")
         self.assertEqual(res[0][1], "GB/s")
 
+    def test_csv_row_writer(self):
+        work_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(work_dir, "summary.csv")
+            writer = utils.CsvRowWriter(file_name, ["x"], more_columns=True,
+                                        max_buffered=2)
+            writer.write("config_0", {"x": 0, "a": 1})
+            writer.write("config_1", {"x": 1})
+            # after the header is written
+            writer.write("config_2", {"x": 2, "b": 3})
+            writer.write("config_3", {"x": 3, "a": 4, "c": 5})
+            writer.close()
+            with open(file_name) as fp:
+                rows = list(csv.reader(fp))
+            self.assertEqual(rows, [["configs", "x", "a", "b", "c"],
+                                    ["config_0", "0", "1", "", ""],
+                                    ["config_1", "1", "", "", ""],
+                                    ["config_2", "2", "", "3", ""],
+                                    ["config_3", "3", "4", "", "5"]])
+            self.assertEqual(os.listdir(work_dir), ["summary.csv"])
+        finally:
+            shutil.rmtree(work_dir)
+
+    def test_indexed_params(self):
+        work_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(work_dir, "params.jsonl")
+            writer = utils.IndexedParamWriter(file_name)
+            specs = [writer.write({"n": i, "s": "x" * i}) for i in range(5)]
+            writer.write([{"n": 5}, {"n": 6}])
+            writer.close()
+            self.assertEqual(specs[3], file_name + "#3")
+            self.assertEqual(utils.load_param(specs[3]), {"n": 3, "s": "xxx"})
+            self.assertEqual(utils.read_indexed_param(file_name, 5),
+                             [{"n": 5}, {"n": 6}])
+            plain = os.path.join(work_dir, "config_0.json")
+            with open(plain, "w") as fp:
+                json.dump({"n": 0}, fp)
+            self.assertEqual(utils.load_param(plain), {"n": 0})
+            writer.remove()
+            self.assertEqual(os.listdir(work_dir), ["config_0.json"])
+        finally:
+            shutil.rmtree(work_dir)
+
+    def test_compress_file(self):
+        work_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(work_dir, "output.log")
+            for method in ("gzip", "bz2"):
+                with open(file_name, "w") as fp:
+                    fp.write("line 1\nline 2\n")
+                compressed = utils.compress_file(file_name, method)
+                self.assertFalse(os.path.exists(file_name))
+                self.assertEqual(utils.find_output_file(file_name),
+                                 compressed)
+                for name in (file_name, compressed):
+                    with utils.open_output_file(name) as fp:
+                        self.assertEqual(list(fp), ["line 1\n", "line 2\n"])
+                os.remove(compressed)
+            self.assertEqual(utils.find_output_file(file_name), "")
+            self.assertRaises(IOError, utils.open_output_file, file_name)
+        finally:
+            shutil.rmtree(work_dir)
+
+    def test_dedup_store(self):
+        work_dir = tempfile.mkdtemp()
+        try:
+            store = utils.DedupStore(os.path.join(work_dir, "store"))
+            for i, text in enumerate(["same", "same", "other"]):
+                file_name = os.path.join(work_dir, "config_%d.py" % i)
+                with open(file_name, "w") as fp:
+                    fp.write(text)
+                self.assertEqual(store.add(file_name), file_name)
+            self.assertTrue(os.path.samefile(
+                os.path.join(work_dir, "config_0.py"),
+                os.path.join(work_dir, "config_1.py")))
+            self.assertEqual(len(os.listdir(store.store_dir)), 2)
+            self.assertEqual(store.get_report()["saved_bytes"], 4)
+        finally:
+            shutil.rmtree(work_dir)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,16 +1,25 @@
 import argparse
-import itertools
+import bz2
+import csv
+import gzip
+import hashlib
 import json
 import logging
 import os
+import pipes
 import re
+import struct
 import sys
 import tempfile
 import time
+from collections import OrderedDict
+from distutils.spawn import find_executable
 
 import pandas as pd
 import shutil
 
+from gist import sweep
+
 
 logger_name = "gist"
 logger_level = logging.ERROR
@@ -40,7 +49,14 @@ def init_logger(name="", level=""):
     global logger_initialized
 
     if logger_initialized:
-        return get_logger()
+        logger = get_logger()
+        if level:
+            # get_logger() may have initialized it with the default level
+            logger_level = level
+            logger.setLevel(logger_level)
+            for handler in logger.handlers:
+                handler.setLevel(logger_level)
+        return logger
     else:
         logger_initialized = True
 
@@ -62,6 +78,26 @@ def init_logger(name="", level=""):
     return logger
 
 
+def cmd_to_str(cmd):
+    """
+    get a printable command line from an argv list, quoted the way
+    a shell would need it, mostly for logging
+    :param cmd: argv list
+    :return: str
+    """
+    return " ".join(pipes.quote(arg) for arg in cmd)
+
+
+def find_exe(exe):
+    """
+    look up an executable in PATH once, instead of having every single
+    launch of it search through PATH again
+    :param exe: name or path of the executable
+    :return: full path of it if found, otherwise exe itself
+    """
+    return find_executable(exe) or exe
+
+
 def get_time_str():
     """
     get a str of current time down to minutes
@@ -112,6 +148,19 @@ def find_bw_unit(in_str):
     return matches
 
 
+def convert_bw_to_gbps(in_str):
+    """
+    :param in_str: bandwidth with its unit, e.g. "1GB/s"
+    :return: float number of GB/s
+    """
+    matches = find_bw_unit(in_str)
+    if not matches:
+        raise ValueError("no bandwidth in %s" % in_str)
+    value, unit = matches[0]
+    scale = {"TB/s": 1000.0, "GB/s": 1.0, "MB/s": 0.001, "KB/s": 0.000001}
+    return float(value) * scale[unit]
+
+
 def json_to_dict(json_file):
     """
     load a json file to a python dict object and get rid of
@@ -186,6 +235,13 @@ def add_default_arg_parser():
                         action="store_true")
     parser.add_argument("-png", help="set output format to png",
                         action="store_true")
+    parser.add_argument("--resume",
+                        help="output dir of an unfinished sweep to resume",
+                        default="")
+    parser.add_argument("--shard",
+                        help="i/N, run only the i-th of N disjoint slices "
+                             "of the sweep",
+                        default="")
     parser.add_argument("-v", "--verbose", help="output verbose",
                         action="store_true")
     parser.add_argument("-d", "--debug", help="whether to turn on debug",
@@ -238,35 +294,10 @@ def get_input_files_from_args(args, file_type=""):
 def permute_params(param_dict):
     """
     get all the combinations of params based on config["model_params"]
-    (basically a cross product
+    (basically a cross product, see sweep.SweepSpace for the order
     :return: a list of dict objects, each dict is an unique param set
     """
-    params = {}
-    for key, value in param_dict.iteritems():
-        # if value is a dict, keep the key and unfold it
-        if isinstance(value, dict):
-            sub_list = permute_params(value)
-            params.update({key: sub_list})
-        else:
-            if isinstance(value, list):
-                # if all the items in a list are dicts, unfold them
-                # and put into one list object
-                if all(isinstance(item, dict) for item in value):
-                    sub_list = []
-                    for item in value:
-                        for sub_params in permute_params(item):
-                            sub_list.append(sub_params)
-                    params.update({key: sub_list})
-                else:
-                    params.update({key: value})
-            else:
-                params.update({key: value})
-    param_list = itertools.product(*params.values())
-    param_dict_list = []
-    for v in param_list:
-        param_dict_list.append(dict(zip(params, v)))
-    # now param_dict_list has all combinations of params
-    return param_dict_list
+    return list(sweep.SweepSpace(param_dict))
 
 
 def get_keys_in_dict(nested_dict):
@@ -363,17 +394,19 @@ def flatten_dict_list(dict_list):
 # TODO the following 3 functions needs heavily refactoring
 
 
-def get_param_files(dir, param_list):
+def get_param_files(dir, param_list, names=None):
     """
     In contrary to get_tmp_param_files, this gets a list of
     regular files 
     """
     if not os.path.exists(dir):
         os.mkdir(dir)
+    if names is None:
+        names = ["config_%d" % i for i in range(len(param_list))]
     fp_list = []
     cnt = 0
     for p in param_list:
-        f_name = os.path.join(dir, "config_%d.json" % cnt)
+        f_name = os.path.join(dir, "%s.json" % names[cnt])
         with open(f_name, "wb") as fp:
             json.dump(p, fp)
             fp.close()
@@ -406,16 +439,379 @@ def get_tmp_param_files(param_list):
     return tmp_fp_list
 
 
-def dump_param_summary(param_list, output_dir_base):
+INDEX_SUFFIX = ".idx"
+# an offset in the index of an indexed params file
+_OFFSET = struct.Struct("<Q")
+
+
+class IndexedParamWriter(object):
+    """
+    writes all the params of a sweep into one file, one JSON per line,
+    instead of a file each, and the offset of every line into
+    file_name + ".idx", so the param of one config is read back with a
+    seek. write() returns what the target script is given in place of a
+    param file, "<file_name>#<record>", which load_param() reads
+    :param file_name: params file, created or truncated
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._fp = open(file_name, "wb")
+        self._index_fp = open(file_name + INDEX_SUFFIX, "wb")
+        self._num_records = 0
+
+    def write(self, param):
+        """
+        :param param: param dict, or anything else JSON can take
+        :return: record spec of the param
+        """
+        self._index_fp.write(_OFFSET.pack(self._fp.tell()))
+        self._fp.write(json.dumps(param) + "\n")
+        self._num_records += 1
+        return "%s#%d" % (self.file_name, self._num_records - 1)
+
+    def flush(self):
+        """ make the records written so far readable by the jobs """
+        self._fp.flush()
+        self._index_fp.flush()
+
+    def close(self):
+        self._fp.close()
+        self._index_fp.close()
+
+    def remove(self):
+        """ close and remove the params file and its index """
+        self.close()
+        for name in (self.file_name, self.file_name + INDEX_SUFFIX):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+def read_indexed_param(file_name, record):
+    """
+    :param file_name: params file written by IndexedParamWriter
+    :param record: num of the record
+    :return: the param of the record
+    """
+    with open(file_name + INDEX_SUFFIX, "rb") as index_fp:
+        index_fp.seek(record * _OFFSET.size)
+        offset, = _OFFSET.unpack(index_fp.read(_OFFSET.size))
+        index_fp.close()
+    with open(file_name, "rb") as fp:
+        fp.seek(offset)
+        line = fp.readline()
+        fp.close()
+    return json.loads(line, object_hook=_byteify)
+
+
+def load_param(spec):
+    """
+    read the param a target script is given, either a param file or a
+    record of an indexed params file like "params.jsonl#12"
+    :param spec: file name or record spec
+    :return: the param
+    """
+    file_name, sep, record = spec.rpartition("#")
+    if sep and record.isdigit():
+        return read_indexed_param(file_name, int(record))
+    with open(spec) as fp:
+        param = json_to_dict(fp)
+        fp.close()
+    return param
+
+
+def get_file_digest(file_name):
+    """
+    :param file_name: file to digest, e.g. the target script of a simulator
+    :return: hex str of sha1 of the file content
+    """
+    sha = hashlib.sha1()
+    with open(file_name, "rb") as fp:
+        for chunk in iter(lambda: fp.read(65536), b""):
+            sha.update(chunk)
+        fp.close()
+    return sha.hexdigest()
+
+
+def get_param_hash(param, sim_exe, script_digest=""):
+    """
+    get a stable key of one config, same param set run by the same
+    simulator with the same script always gets the same key
+    :param param: param dict of one config
+    :param sim_exe: simulator executable
+    :param script_digest: digest of the script the simulator runs, if any
+    :return: hex str
+    """
+    sha = hashlib.sha1()
+    sha.update(json.dumps(param, sort_keys=True))
+    sha.update(sim_exe)
+    sha.update(script_digest)
+    return sha.hexdigest()
+
+
+def dump_param_summary(param_list, output_dir_base, names=None):
     """
     dump all the params in the form of a csv file named "config.csv"
     :param param_list: list of different params
     :param output_dir_base: where the output will be
+    :param names: sub dir name of each config, config_0 to config_N
+                  if not given
     :return: None
     """
     df = pd.DataFrame(flatten_dict_list(param_list))
+    # label each row by the sub dir the config runs in
+    if names is None:
+        names = ["config_%d" % i for i in range(len(df))]
+    df.index = names
     output_name = os.path.join(output_dir_base, "config.csv")
-    df.to_csv(output_name)
+    df.to_csv(output_name, index_label="configs")
+
+
+class CsvRowWriter(object):
+    """
+    writes a table to a csv file one row at a time, so the table never
+    has to be in memory as a whole, e.g. config.csv and summary.csv of a
+    streamed sweep. Rows are dicts, labelled by index_label like the
+    csv files pandas writes, and keys missing from a row are left empty
+    :param file_name: csv file to write
+    :param columns: columns every row has
+    :param index_label: header of the label column
+    :param more_columns: if True, the other keys of the rows become
+                         columns too, after the given ones. The first
+                         max_buffered rows are held back to find most
+                         of them before the header is written, keys
+                         showing up later are added as columns at the
+                         end, and the header and the rows written before
+                         are filled in when the file is closed
+    :param max_buffered: see more_columns
+    """
+    def __init__(self, file_name, columns, index_label="configs",
+                 more_columns=False, max_buffered=100):
+        self.file_name = file_name
+        self.columns = list(columns)
+        self.index_label = index_label
+        self.more_columns = more_columns
+        self.max_buffered = max_buffered
+        self._fp = open(file_name, "wb")
+        self._writer = csv.writer(self._fp)
+        self._buffer = []
+        self._header_written = False
+        # num of columns in the header written, if columns were added
+        # after it
+        self._num_header_columns = None
+        if not more_columns:
+            self._write_header()
+
+    def _write_header(self):
+        for _, row in self._buffer:
+            for key in row:
+                if key not in self.columns:
+                    self.columns.append(key)
+        self._writer.writerow([self.index_label] + self.columns)
+        self._header_written = True
+        for label, row in self._buffer:
+            self._write_row(label, row)
+        self._buffer = []
+
+    def _write_row(self, label, row):
+        if self.more_columns:
+            for key in row:
+                if key not in self.columns:
+                    if self._num_header_columns is None:
+                        self._num_header_columns = len(self.columns)
+                    self.columns.append(key)
+        self._writer.writerow([label] +
+                              [row.get(key, "") for key in self.columns])
+        self._fp.flush()
+
+    def write(self, label, row):
+        """
+        :param label: label of the row, e.g. the config name
+        :param row: dict of column -> value
+        """
+        if self._header_written:
+            self._write_row(label, row)
+            return
+        self._buffer.append((label, row))
+        if len(self._buffer) >= self.max_buffered:
+            self._write_header()
+
+    def close(self):
+        if not self._header_written:
+            self._write_header()
+        self._fp.close()
+        if self._num_header_columns is not None:
+            self._fill_in_columns()
+
+    def _fill_in_columns(self):
+        """
+        rewrite the file with the columns added after the header was
+        written, a row at a time
+        """
+        tmp_name = self.file_name + ".tmp"
+        width = len(self.columns) + 1
+        with open(self.file_name, "rb") as in_fp, \
+                open(tmp_name, "wb") as out_fp:
+            reader = csv.reader(in_fp)
+            writer = csv.writer(out_fp)
+            next(reader)
+            writer.writerow([self.index_label] + self.columns)
+            for row in reader:
+                writer.writerow(row + [""] * (width - len(row)))
+            in_fp.close()
+            out_fp.close()
+        os.rename(tmp_name, self.file_name)
+
+
+# compression method -> extension of the files it makes
+COMPRESSED_EXTS = {"gzip": ".gz", "bz2": ".bz2", "lzma": ".xz"}
+
+
+def _get_compressed_opener(method):
+    """
+    :return: function that opens a file compressed with method like
+             open() does
+    """
+    if method == "gzip":
+        return gzip.open
+    if method == "bz2":
+        return bz2.BZ2File
+    if method == "lzma":
+        try:
+            from backports import lzma
+        except ImportError:
+            raise ValueError("lzma needs backports.lzma, which is not "
+                             "installed, use gzip or bz2 instead")
+        return lzma.open
+    raise ValueError("unknown compression %s" % method)
+
+
+def compress_file(file_name, method="gzip"):
+    """
+    compress a file into file_name plus the extension of the method,
+    e.g. output.log.gz, and remove the original. The compressed file is
+    written under a tmp name first, so a crash half way never leaves a
+    broken one behind
+    :param file_name: file to compress
+    :param method: "gzip", "bz2" or "lzma"
+    :return: name of the compressed file
+    """
+    opener = _get_compressed_opener(method)
+    out_name = file_name + COMPRESSED_EXTS[method]
+    tmp_name = out_name + ".tmp"
+    with open(file_name, "rb") as in_fp:
+        out_fp = opener(tmp_name, "wb")
+        shutil.copyfileobj(in_fp, out_fp, 1 << 20)
+        out_fp.close()
+        in_fp.close()
+    os.rename(tmp_name, out_name)
+    os.remove(file_name)
+    return out_name
+
+
+def _get_compression(file_name):
+    for method, ext in COMPRESSED_EXTS.items():
+        if file_name.endswith(ext):
+            return method
+    return ""
+
+
+def find_output_file(file_name):
+    """
+    :param file_name: name of an output file before any compression
+    :return: file_name if it's there, otherwise its compressed form if
+             that's there, "" if neither is
+    """
+    if os.path.isfile(file_name):
+        return file_name
+    for ext in COMPRESSED_EXTS.values():
+        if os.path.isfile(file_name + ext):
+            return file_name + ext
+    return ""
+
+
+def open_output_file(file_name):
+    """
+    open an output file for reading whether it has been compressed or
+    not, readers just see the lines of the original
+    :param file_name: name of the file before or after compression
+    :return: file object
+    """
+    method = _get_compression(file_name)
+    if not method:
+        found = find_output_file(file_name)
+        if not found:
+            raise IOError(2, "No such file or directory", file_name)
+        file_name = found
+        method = _get_compression(file_name)
+    if method:
+        return _get_compressed_opener(method)(file_name, "rb")
+    return open(file_name, "r")
+
+
+class DedupStore(object):
+    """
+    keeps one copy of each distinct content of the files added to it,
+    named by its sha1 in store_dir, and puts a hard link to that copy in
+    place of each file (a symlink if store_dir is on another file
+    system), e.g. for the config dumps of a sweep, which are mostly the
+    same. Not thread safe, add files from one thread only
+    :param store_dir: where the copies go, made if not there yet
+    :param compress: compression method of the copies, see compress_file,
+                     the links get its extension
+    """
+    def __init__(self, store_dir, compress=""):
+        self.store_dir = store_dir
+        self.compress = compress
+        self.ext = COMPRESSED_EXTS[compress] if compress else ""
+        self.num_files = 0
+        self.num_stored = 0
+        # size of all the files added, and of the copies stored for them
+        self.total_bytes = 0
+        self.stored_bytes = 0
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+
+    def add(self, file_name, link_name=""):
+        """
+        :param file_name: file to keep a copy of, removed after
+        :param link_name: where the link goes, file_name by default. The
+                          extension of the compression is added to it
+        :return: name of the link
+        """
+        link_name = (link_name or file_name) + self.ext
+        entry = os.path.join(self.store_dir, get_file_digest(file_name) +
+                             os.path.splitext(file_name)[1] + self.ext)
+        size = os.path.getsize(file_name)
+        if os.path.exists(entry):
+            os.remove(file_name)
+        else:
+            if self.compress:
+                file_name = compress_file(file_name, self.compress)
+            shutil.move(file_name, entry)
+            self.num_stored += 1
+            self.stored_bytes += os.path.getsize(entry)
+        self.num_files += 1
+        self.total_bytes += size
+        if os.path.lexists(link_name):
+            os.remove(link_name)
+        try:
+            os.link(entry, link_name)
+        except OSError:
+            os.symlink(os.path.relpath(entry, os.path.dirname(link_name)),
+                       link_name)
+        return link_name
+
+    def get_report(self):
+        """
+        :return: OrderedDict of how many files were added and stored,
+                 and the bytes they took and would have taken
+        """
+        return OrderedDict([
+            ("files", self.num_files),
+            ("stored_files", self.num_stored),
+            ("total_bytes", self.total_bytes),
+            ("stored_bytes", self.stored_bytes),
+            ("saved_bytes", self.total_bytes - self.stored_bytes)])
 
 
 def copy_input_to_output_dir(config_input, output_dir_base):